@@ -3,10 +3,13 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 from logging.config import fileConfig
 
-import wsgi
 from ironblogger.app import app
+from ironblogger.cli import load_config
 from ironblogger.model import db
 
+# From $IB2_CONFIG or wsgi.py, as for the ironblogger command:
+load_config()
+
 config = context.config
 fileConfig(config.config_file_name)
 
@@ -0,0 +1,39 @@
+"""Track caching info per feed url
+
+Revision ID: 2e9d5a7c4f18
+Revises: 7b1f4c9e2a63
+Create Date: 2016-06-25 11:23:51.604377
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2e9d5a7c4f18'
+down_revision = '7b1f4c9e2a63'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('feed',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('etag', sa.String(), nullable=True),
+    sa.Column('modified', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('url')
+    )
+    # The old per-blog values aren't carried over: blogs which haven't been
+    # fetched since last_fetched was added are fetched unconditionally
+    # anyway, so they'd never be used.
+    with op.batch_alter_table('blog') as batch_op:
+        batch_op.drop_column('modified')
+        batch_op.drop_column('etag')
+
+
+def downgrade():
+    op.add_column('blog', sa.Column('etag', sa.String(), nullable=True))
+    op.add_column('blog', sa.Column('modified', sa.String(), nullable=True))
+    op.drop_table('feed')
@@ -0,0 +1,33 @@
+"""Add indexes for frequently queried columns
+
+Revision ID: 3a6e5b0c2f41
+Revises: 4f5b0f1fc173
+Create Date: 2016-06-04 14:12:40.118273
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a6e5b0c2f41'
+down_revision = '4f5b0f1fc173'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_post_timestamp', 'post', ['timestamp'])
+    op.create_index('ix_post_counts_for', 'post', ['counts_for'])
+    op.create_index('ix_blogger_start_date', 'blogger', ['start_date'])
+    op.create_index('ix_blog_blogger_id', 'blog', ['blogger_id'])
+    op.create_index('ix_payment_blogger_id_duedate', 'payment',
+                    ['blogger_id', 'duedate'])
+
+
+def downgrade():
+    op.drop_index('ix_payment_blogger_id_duedate', 'payment')
+    op.drop_index('ix_blog_blogger_id', 'blog')
+    op.drop_index('ix_blogger_start_date', 'blogger')
+    op.drop_index('ix_post_counts_for', 'post')
+    op.drop_index('ix_post_timestamp', 'post')
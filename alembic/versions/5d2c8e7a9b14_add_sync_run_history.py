@@ -0,0 +1,58 @@
+"""Add sync run history
+
+Revision ID: 5d2c8e7a9b14
+Revises: 3a6e5b0c2f41
+Create Date: 2016-06-11 16:47:05.530927
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d2c8e7a9b14'
+down_revision = '3a6e5b0c2f41'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('sync_run',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('end_time', sa.DateTime(), nullable=True),
+    sa.Column('fetch_time', sa.Float(), nullable=False),
+    sa.Column('parse_time', sa.Float(), nullable=False),
+    sa.Column('sanitize_time', sa.Float(), nullable=False),
+    sa.Column('upsert_time', sa.Float(), nullable=False),
+    sa.Column('assign_time', sa.Float(), nullable=False),
+    sa.Column('feeds_fetched', sa.Integer(), nullable=False),
+    sa.Column('bytes_fetched', sa.Integer(), nullable=False),
+    sa.Column('fetch_errors', sa.Integer(), nullable=False),
+    sa.Column('parse_errors', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sync_run_start_time', 'sync_run', ['start_time'])
+    op.create_table('feed_fetch',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.Integer(), nullable=False),
+    sa.Column('blog_id', sa.Integer(), nullable=False),
+    sa.Column('duration', sa.Float(), nullable=False),
+    sa.Column('bytes', sa.Integer(), nullable=True),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['blog_id'], ['blog.id'], ),
+    sa.ForeignKeyConstraint(['run_id'], ['sync_run.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_feed_fetch_run_id', 'feed_fetch', ['run_id'])
+    op.create_index('ix_feed_fetch_blog_id', 'feed_fetch', ['blog_id'])
+
+
+def downgrade():
+    op.drop_index('ix_feed_fetch_blog_id', 'feed_fetch')
+    op.drop_index('ix_feed_fetch_run_id', 'feed_fetch')
+    op.drop_table('feed_fetch')
+    op.drop_index('ix_sync_run_start_time', 'sync_run')
+    op.drop_table('sync_run')
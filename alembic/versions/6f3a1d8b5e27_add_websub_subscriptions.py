@@ -0,0 +1,42 @@
+"""Add WebSub subscriptions
+
+Revision ID: 6f3a1d8b5e27
+Revises: 2e9d5a7c4f18
+Create Date: 2016-07-02 16:41:09.273518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f3a1d8b5e27'
+down_revision = '2e9d5a7c4f18'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('feed', sa.Column('hub', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('topic', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('secret', sa.String(), nullable=True))
+    op.add_column('feed', sa.Column('push_requested', sa.DateTime(), nullable=True))
+    op.add_column('feed', sa.Column('push_expires', sa.DateTime(), nullable=True))
+    # Existing blogs are linked to their feeds the next time they're fetched.
+    with op.batch_alter_table('blog') as batch_op:
+        batch_op.add_column(sa.Column('feed_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_blog_feed_id', 'feed',
+                                    ['feed_id'], ['id'])
+        batch_op.create_index('ix_blog_feed_id', ['feed_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('blog') as batch_op:
+        batch_op.drop_index('ix_blog_feed_id')
+        batch_op.drop_constraint('fk_blog_feed_id', type_='foreignkey')
+        batch_op.drop_column('feed_id')
+    op.drop_column('feed', 'push_expires')
+    op.drop_column('feed', 'push_requested')
+    op.drop_column('feed', 'secret')
+    op.drop_column('feed', 'topic')
+    op.drop_column('feed', 'hub')
@@ -0,0 +1,28 @@
+"""Add fetch leases
+
+Revision ID: 7b1f4c9e2a63
+Revises: 5d2c8e7a9b14
+Create Date: 2016-06-18 14:02:37.118204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7b1f4c9e2a63'
+down_revision = '5d2c8e7a9b14'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('blog', sa.Column('last_fetched', sa.DateTime(), nullable=True))
+    op.add_column('blog', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('blog', sa.Column('lease_expires', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('blog', 'lease_expires')
+    op.drop_column('blog', 'lease_owner')
+    op.drop_column('blog', 'last_fetched')
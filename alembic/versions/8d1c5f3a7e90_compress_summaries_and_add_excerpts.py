@@ -0,0 +1,182 @@
+"""Compress post summaries, and add excerpts
+
+Revision ID: 8d1c5f3a7e90
+Revises: 6f3a1d8b5e27
+Create Date: 2016-07-09 10:52:44.902317
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d1c5f3a7e90'
+down_revision = '6f3a1d8b5e27'
+branch_labels = None
+depends_on = None
+
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+from six.moves.html_parser import HTMLParser
+
+# Posts are converted this many at a time:
+BATCH_SIZE = 500
+
+post = sa.table('post',
+                sa.column('id', sa.Integer),
+                sa.column('summary', sa.Text),
+                sa.column('summary_z', sa.LargeBinary),
+                sa.column('excerpt', sa.Text))
+
+
+# A copy of ironblogger.excerpt as of this revision, so that later changes
+# there don't change what this migration does:
+
+_EXCERPT_LENGTH = 500
+
+_ELLIPSIS = u'\u2026'
+
+_VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+class _Truncator(HTMLParser):
+
+    def __init__(self, length):
+        try:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        except TypeError:
+            # Python 2 never converts them:
+            HTMLParser.__init__(self)
+        self.remaining = length
+        self.truncated = False
+        self.out = []
+        self.open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.truncated:
+            return
+        self.out.append(self.get_starttag_text())
+        if tag not in _VOID_ELEMENTS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.truncated:
+            self.out.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.truncated or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append('</%s>' % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.truncated:
+            return
+        # Trailing whitespace doesn't need cutting off:
+        if len(data.rstrip()) <= self.remaining:
+            self.out.append(data)
+            self.remaining -= min(len(data), self.remaining)
+            return
+        cut = data[:self.remaining]
+        # Don't cut a word in half, if we can help it:
+        if not data[self.remaining].isspace() and ' ' in cut:
+            cut = cut[:cut.rindex(' ')]
+        self.out.append(cut.rstrip() + _ELLIPSIS)
+        self._truncate()
+
+    def _entity(self, text):
+        if self.truncated:
+            return
+        if self.remaining == 0:
+            self.out.append(_ELLIPSIS)
+            self._truncate()
+            return
+        self.out.append(text)
+        self.remaining -= 1
+
+    def handle_entityref(self, name):
+        self._entity('&%s;' % name)
+
+    def handle_charref(self, name):
+        self._entity('&#%s;' % name)
+
+    def _truncate(self):
+        self.truncated = True
+        while self.open_tags:
+            self.out.append('</%s>' % self.open_tags.pop())
+
+
+def _make_excerpt(html, length=_EXCERPT_LENGTH):
+    truncator = _Truncator(length)
+    truncator.feed(html)
+    truncator.close()
+    if not truncator.truncated:
+        return html
+    return u''.join(truncator.out)
+
+
+def _convert(source, targets, convert):
+    """Call ``convert`` on the ``source`` column of each post where it isn't
+    NULL, and store the results: ``convert`` returns a dict of values for
+    the ``targets`` columns."""
+    conn = op.get_bind()
+    update = post.update()\
+        .where(post.c.id == sa.bindparam('_id'))\
+        .values(dict((name, sa.bindparam(name)) for name in targets))
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select([post.c.id, post.c[source]])
+                            .where(post.c.id > last_id)
+                            .where(post.c[source] != None)
+                            .order_by(post.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        params = []
+        for id, value in rows:
+            values = convert(value)
+            values['_id'] = id
+            params.append(values)
+        conn.execute(update, params)
+        last_id = rows[-1][0]
+
+
+def _compress(summary):
+    # As `ironblogger.model.Post.summary` does it:
+    excerpt = _make_excerpt(summary)
+    if excerpt == summary:
+        return {'summary_z': None, 'excerpt': excerpt}
+    return {'summary_z': zlib.compress(summary.encode('utf-8')),
+            'excerpt': excerpt}
+
+
+def upgrade():
+    op.add_column('post', sa.Column('summary_z', sa.LargeBinary(), nullable=True))
+    op.add_column('post', sa.Column('excerpt', sa.Text(), nullable=True))
+    _convert('summary', ['summary_z', 'excerpt'], _compress)
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.alter_column('excerpt', existing_type=sa.Text(),
+                              nullable=False)
+        batch_op.drop_column('summary')
+
+
+def downgrade():
+    op.add_column('post', sa.Column('summary', sa.Text(), nullable=True))
+    conn = op.get_bind()
+    # Where the excerpt is the whole summary, only it was kept:
+    conn.execute(post.update().where(post.c.summary_z == None)
+                 .values(summary=post.c.excerpt))
+    _convert('summary_z', ['summary'], lambda summary_z: {
+        'summary': zlib.decompress(summary_z).decode('utf-8'),
+    })
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.alter_column('summary', existing_type=sa.Text(),
+                              nullable=False)
+        batch_op.drop_column('excerpt')
+        batch_op.drop_column('summary_z')
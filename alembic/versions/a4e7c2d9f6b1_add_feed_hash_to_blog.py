@@ -0,0 +1,73 @@
+"""Add feed_hash to blog
+
+Revision ID: a4e7c2d9f6b1
+Revises: 8d1c5f3a7e90
+Create Date: 2016-07-16 15:08:21.530472
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4e7c2d9f6b1'
+down_revision = '8d1c5f3a7e90'
+branch_labels = None
+depends_on = None
+
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+from six.moves.urllib.parse import urlsplit, urlunsplit
+
+# Blogs are updated this many at a time:
+BATCH_SIZE = 500
+
+blog = sa.table('blog',
+                sa.column('id', sa.Integer),
+                sa.column('feed_url', sa.String),
+                sa.column('feed_hash', sa.Integer))
+
+
+# A copy of ironblogger.feedurl as of this revision, so that later changes
+# there don't change what this migration does:
+
+def _normalize_feed_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    for default_scheme, default_port in ('http', ':80'), ('https', ':443'):
+        if scheme == default_scheme and netloc.endswith(default_port):
+            netloc = netloc[:-len(default_port)]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def _feed_hash(url):
+    return zlib.crc32(_normalize_feed_url(url).encode('utf-8')) & 0x7fffffff
+
+
+def upgrade():
+    op.add_column('blog', sa.Column('feed_hash', sa.Integer(), nullable=True))
+    conn = op.get_bind()
+    update = blog.update()\
+        .where(blog.c.id == sa.bindparam('_id'))\
+        .values(feed_hash=sa.bindparam('feed_hash'))
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select([blog.c.id, blog.c.feed_url])
+                            .where(blog.c.id > last_id)
+                            .order_by(blog.c.id)
+                            .limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        conn.execute(update, [{'_id': id, 'feed_hash': _feed_hash(url)}
+                              for id, url in rows])
+        last_id = rows[-1][0]
+    with op.batch_alter_table('blog') as batch_op:
+        batch_op.alter_column('feed_hash', existing_type=sa.Integer(),
+                              nullable=False)
+    op.create_index('ix_blog_feed_hash', 'blog', ['feed_hash'])
+
+
+def downgrade():
+    op.drop_index('ix_blog_feed_hash', 'blog')
+    with op.batch_alter_table('blog') as batch_op:
+        batch_op.drop_column('feed_hash')
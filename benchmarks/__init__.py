@@ -0,0 +1,39 @@
+"""Benchmarks for iron blogger.
+
+These aren't part of the test suite; each module in this package is a
+script which can be run with e.g.:
+
+    python -m benchmarks.template_filters
+
+from the root of the source tree.
+"""
+import timeit
+
+from ironblogger.app import app
+
+# The wsgi module centralizes any side-effecting module imports necessary for
+# the operation of the app. We import it here for these side effects, and use
+# it in a noop statement below to silence the unused import warnings.
+import ironblogger.wsgi
+ironblogger.wsgi
+
+
+def configure_app(**config):
+    """Apply a basic config to the app, suitable for benchmarking.
+
+    Keyword arguments override the defaults.
+    """
+    defaults = dict(
+        IB2_REGION='Boston',
+        IB2_TIMEZONE='US/Eastern',
+        IB2_LANGUAGE='en-us',
+        SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',
+        SECRET_KEY='CHANGEME',
+    )
+    defaults.update(config)
+    app.config.update(defaults)
+
+
+def best_of(fn, repeat=5):
+    """Return the fastest of ``repeat`` runs of ``fn``, in seconds."""
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
@@ -0,0 +1,139 @@
+"""Benchmark for fetching feeds.
+
+Serves generated feeds from a local server (see `tests.util.feedserver`),
+points a blog at each of them, and runs the sync twice: once with every
+feed new, and once more, when the server answers every request with 304
+Not Modified. For each pass it reports feeds per second, the median and
+99th percentile time to download a feed, and the time spent in each stage
+of the sync. The peak RSS of the process is reported at the end.
+
+    python -m benchmarks.fetch --feeds 2000 --latency 0.02 --gzip
+
+Run with ``--help`` for the other ways to make the server misbehave, and
+``--no-streaming`` to compare against parsing whole feeds with feedparser. As
+with `benchmarks.scale`, the results are written as JSON to ``--output``.
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+from datetime import datetime
+
+from ironblogger.app import app, db
+from ironblogger.model import Blogger, Blog, SyncRun
+from ironblogger.tasks import sync
+from tests.util.feedserver import FeedServer
+from . import configure_app
+
+
+def log(msg, *args):
+    sys.stderr.write((msg % args) + '\n')
+
+
+def percentile(values, p):
+    """Return the ``p``th percentile of ``values`` (nearest rank)."""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def setup_blogs(server):
+    blogger = Blogger(name='Benchmark', start_date=datetime(2015, 1, 1))
+    db.session.add(blogger)
+    for n in range(server.num_feeds):
+        db.session.add(Blog(blogger=blogger,
+                            title='Blog %d' % n,
+                            page_url=server.page_url(n),
+                            feed_url=server.feed_url(n)))
+    db.session.commit()
+
+
+def timed_sync():
+    start = time.time()
+    sync()
+    elapsed = time.time() - start
+    run = db.session.query(SyncRun).order_by(SyncRun.id.desc()).first()
+    durations = [fetch.duration for fetch in run.fetches]
+    result = {
+        'seconds': elapsed,
+        'feeds_per_sec': len(durations) / elapsed,
+        'p50_latency': percentile(durations, 50),
+        'p99_latency': percentile(durations, 99),
+        'bytes': run.bytes_fetched,
+        'fetch_errors': run.fetch_errors,
+        'parse_errors': run.parse_errors,
+        'stages': dict((stage, getattr(run, stage + '_time'))
+                       for stage in SyncRun.STAGES),
+    }
+    log('%.1f feeds/sec; p50 %.1fms, p99 %.1fms; %d errors',
+        result['feeds_per_sec'],
+        result['p50_latency'] * 1000,
+        result['p99_latency'] * 1000,
+        result['fetch_errors'] + result['parse_errors'])
+    return result
+
+
+def peak_rss_kib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on OS X, rather than KiB:
+        peak //= 1024
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark fetching feeds from a local server.')
+    parser.add_argument('--feeds', type=int, default=1000)
+    parser.add_argument('--posts-per-feed', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to wait before each response.')
+    parser.add_argument('--gzip', action='store_true',
+                        help='compress responses.')
+    parser.add_argument('--no-etag', dest='etag', action='store_false',
+                        help="don't support conditional requests.")
+    parser.add_argument('--bytes-per-sec', type=int,
+                        help='send response bodies at this rate.')
+    parser.add_argument('--error-every', type=int, metavar='N',
+                        help='fail every Nth feed with a 500.')
+    parser.add_argument('--no-streaming', dest='streaming',
+                        action='store_false',
+                        help="download whole feeds before parsing them.")
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout, metavar='FILE')
+    args = parser.parse_args()
+
+    server = FeedServer(num_feeds=args.feeds,
+                        posts_per_feed=args.posts_per_feed,
+                        latency=args.latency,
+                        etag=args.etag,
+                        gzip=args.gzip,
+                        bytes_per_sec=args.bytes_per_sec,
+                        error_every=args.error_every)
+    configure_app()
+    app.config['IB2_FETCH_STREAMING'] = args.streaming
+    results = {}
+    with server, app.test_request_context():
+        db.create_all()
+        setup_blogs(server)
+        for name in 'initial', 'repeat':
+            log('%s sync of %d feeds:', name, args.feeds)
+            results[name] = timed_sync()
+    results['peak_rss_kib'] = peak_rss_kib()
+    log('peak RSS: %d KiB', results['peak_rss_kib'])
+
+    output = {
+        'params': dict((key, getattr(args, key)) for key in (
+            'feeds', 'posts_per_feed', 'latency', 'gzip', 'etag',
+            'bytes_per_sec', 'error_every', 'streaming')),
+        'results': results,
+    }
+    json.dump(output, args.output, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""Benchmarks against a large, synthetic database.
+
+The randomized test data (see `tests.util.randomize`) tops out at a couple
+dozen bloggers, which is far too small to show how things scale. This
+generates a database of configurable size using the same vocabulary, and
+times the bookkeeping tasks and the heaviest pages against it:
+
+    python -m benchmarks.scale --preset large --database /tmp/large.db \\
+        --output results.json
+
+Generating the large preset takes a while, so the database is kept if
+``--database`` is given, and reused on later runs with the same
+parameters. Results are written as JSON; passing an earlier run's results
+with ``--compare`` prints how each timing has changed, e.g. to check a
+branch against master:
+
+    python -m benchmarks.scale --database /tmp/large.db --preset large \\
+        --compare master.json --output branch.json
+
+Progress and the summary go to stderr; only the JSON goes to ``--output``
+(stdout by default).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import arrow
+
+from ironblogger.app import app, db
+from ironblogger.date import duedate, duedate_seek, to_dbtime
+from ironblogger.feedurl import feed_hash
+from ironblogger.model import Blogger, Blog, Post, Payment
+from ironblogger.tasks import assign_rounds, export_bloggers
+from ironblogger.view import build_ledger
+from tests.util.randomize import blogger_choices, blog_title_choices, \
+    word_choices, tld_choices, proto_choices, random_parties
+from . import configure_app
+
+PRESETS = {
+    'small': dict(bloggers=50, blogs=200, posts=20000, years=2),
+    'medium': dict(bloggers=500, blogs=2000, posts=200000, years=5),
+    'large': dict(bloggers=5000, blogs=20000, posts=2000000, years=10),
+}
+
+# Rows per INSERT batch:
+BATCH_SIZE = 10000
+
+# Generating a summary word by word for every post would dominate the time
+# taken to build the database, so we draw from a pool of them:
+SUMMARY_POOL_SIZE = 1000
+
+# Posts published in this many of the most recent rounds are left
+# unassigned, for the assign_rounds benchmark to work on:
+UNASSIGNED_ROUNDS = 1
+
+
+def log(msg, *args):
+    sys.stderr.write((msg % args) + '\n')
+
+
+def generate(params, seed):
+    """Populate the (empty) database according to ``params``."""
+    rand = random.Random(seed)
+    now = arrow.now(app.config['IB2_TIMEZONE'])
+    first_start = now.replace(years=-params['years'])
+
+    # Every round from the first possible start date to now, oldest first:
+    dues = [duedate(first_start)]
+    while dues[-1] < now:
+        dues.append(duedate_seek(dues[-1], 1))
+    db_dues = [to_dbtime(due) for due in dues]
+    unassigned_after = db_dues[-1 - UNASSIGNED_ROUNDS]
+
+    log('Generating %d bloggers...', params['bloggers'])
+    blogger_rounds = []  # index in dues of each blogger's first round
+    rows = []
+    for i in range(params['bloggers']):
+        first = rand.randint(0, len(dues) - 2)
+        blogger_rounds.append(first)
+        rows.append({
+            'id': i + 1,
+            'name': '%s %d' % (rand.choice(blogger_choices), i),
+            'start_date': db_dues[first] - timedelta(days=6),
+            'email': None,
+            'real_name': None,
+        })
+    _insert(Blogger, rows)
+
+    log('Generating %d blogs...', params['blogs'])
+    blog_owners = []
+    rows = []
+    for i in range(params['blogs']):
+        # Make sure everyone has at least one blog:
+        if i < params['bloggers']:
+            owner = i
+        else:
+            owner = rand.randrange(params['bloggers'])
+        blog_owners.append(owner)
+        page_url = '%s://blogger%d.example.%s/%d/' % (
+            rand.choice(proto_choices), owner, rand.choice(tld_choices), i)
+        rows.append({
+            'id': i + 1,
+            'blogger_id': owner + 1,
+            'title': rand.choice(blog_title_choices),
+            'page_url': page_url,
+            'feed_url': page_url + 'feed.xml',
+            'feed_hash': feed_hash(page_url + 'feed.xml'),
+        })
+    _insert(Blog, rows)
+
+    log('Generating %d posts...', params['posts'])
+    summaries = []
+    for i in range(SUMMARY_POOL_SIZE):
+        # Let the model compress it and compute the excerpt:
+        post = Post(summary=' '.join(rand.choice(word_choices)
+                                     for n in range(rand.randint(25, 150))))
+        summaries.append((post.summary_z, post.excerpt))
+    taken = set()
+    rows = []
+    for i in range(params['posts']):
+        blog = rand.randrange(params['blogs'])
+        owner = blog_owners[blog]
+        round = rand.randint(blogger_rounds[owner], len(dues) - 1)
+        # Rounds can be an hour short across a DST change, so stay clear of
+        # the previous duedate:
+        timestamp = db_dues[round] - timedelta(
+            seconds=rand.randint(0, 6 * 24 * 60 * 60))
+        counts_for = None
+        if db_dues[round] <= unassigned_after and (owner, round) not in taken:
+            taken.add((owner, round))
+            counts_for = db_dues[round]
+        title = ' '.join(rand.choice(word_choices)
+                         for n in range(rand.randint(1, 10)))
+        summary_z, excerpt = rand.choice(summaries)
+        rows.append({
+            'blog_id': blog + 1,
+            'guid': '%x' % rand.getrandbits(128),
+            'timestamp': timestamp,
+            'counts_for': counts_for,
+            'title': title,
+            'summary_z': summary_z,
+            'excerpt': excerpt,
+            'page_url': 'http://blog%d.example.com/posts/%d.html' % (blog, i),
+        })
+        if len(rows) == BATCH_SIZE:
+            _insert(Post, rows)
+            rows = []
+    _insert(Post, rows)
+
+    log('Generating parties and payments...')
+    random_parties(rand, now, first_start)
+    rows = []
+    for owner, first in enumerate(blogger_rounds):
+        for n in range(rand.randint(0, 3)):
+            rows.append({
+                'blogger_id': owner + 1,
+                'duedate': db_dues[rand.randint(first, len(dues) - 1)],
+                'amount': rand.randint(1, 30) * 100,
+            })
+    _insert(Payment, rows)
+    db.session.commit()
+    return unassigned_after
+
+
+def _insert(model, rows):
+    if rows:
+        db.session.execute(model.__table__.insert(), rows)
+
+
+def benchmarks(unassigned_after):
+    """Return a list of (name, setup, fn) triples for the benchmarks.
+
+    ``setup`` (which may be None) is called before each run of ``fn``, and
+    isn't included in the timing.
+    """
+    client = app.test_client()
+
+    def get(url):
+        def fn():
+            resp = client.get(url)
+            assert resp.status_code == 200, (url, resp.status_code)
+        return fn
+
+    def unassign():
+        db.session.query(Post)\
+            .filter(Post.timestamp > unassigned_after)\
+            .update({'counts_for': None})
+        db.session.commit()
+
+    def export():
+        with open(os.devnull, 'w') as f:
+            export_bloggers(f)
+
+    num_posts = db.session.query(Post).count()
+    last_page = (num_posts - 1) // app.config['IB2_POSTS_PER_PAGE']
+    return [
+        ('assign_rounds', unassign,
+         lambda: assign_rounds(since=unassigned_after)),
+        ('build_ledger', None, lambda: build_ledger(None, None)),
+        ('show_status', None, get('/status')),
+        ('show_posts_first', None, get('/posts')),
+        ('show_posts_deep', None, get('/posts?page=%d' % last_page)),
+        ('show_rss', None, get('/rss')),
+        ('export_bloggers', None, export),
+    ]
+
+
+def run_benchmarks(unassigned_after, repeat, only=None):
+    results = {}
+    for name, setup, fn in benchmarks(unassigned_after):
+        if only and name not in only:
+            continue
+        runs = []
+        for i in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.time()
+            fn()
+            runs.append(time.time() - start)
+            # Don't let the session's identity map grow across runs:
+            db.session.remove()
+        runs.sort()
+        results[name] = {
+            'best': runs[0],
+            'median': runs[len(runs) // 2],
+            'runs': runs,
+        }
+        log('%-20s best %8.3fs  median %8.3fs', name, runs[0],
+            runs[len(runs) // 2])
+    return results
+
+
+def compare(results, baseline):
+    log('%-20s %10s %10s %8s', 'benchmark', 'baseline', 'current', 'ratio')
+    for name in sorted(results):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['best']
+        new = results[name]['best']
+        log('%-20s %9.3fs %9.3fs %7.2fx', name, old, new, new / old)
+
+
+def _git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                             stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark iron blogger against a large database.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    for key in 'bloggers', 'blogs', 'posts', 'years':
+        parser.add_argument('--' + key, type=int,
+                            help='override the preset.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', metavar='PATH',
+                        help='SQLite database to use; kept for later runs.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        help='only run the named benchmark (repeatable).')
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout, metavar='FILE')
+    parser.add_argument('--compare', type=argparse.FileType('r'),
+                        metavar='FILE',
+                        help='results of an earlier run, to compare with.')
+    args = parser.parse_args()
+
+    params = dict(PRESETS[args.preset], seed=args.seed)
+    for key in 'bloggers', 'blogs', 'posts', 'years':
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+
+    if args.database is None:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(path)
+    else:
+        path = os.path.abspath(args.database)
+    params_path = path + '.params.json'
+    reuse = os.path.exists(path) and os.path.exists(params_path) and \
+        json.load(open(params_path))['params'] == params
+    if os.path.exists(path) and not reuse:
+        os.remove(path)
+
+    configure_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + path)
+    try:
+        with app.test_request_context():
+            if reuse:
+                log('Reusing %s', path)
+                with open(params_path) as f:
+                    unassigned_after = arrow.get(
+                        json.load(f)['unassigned_after']).naive
+            else:
+                db.create_all()
+                start = time.time()
+                unassigned_after = generate(params, args.seed)
+                log('Generated database in %.1fs', time.time() - start)
+                with open(params_path, 'w') as f:
+                    json.dump({
+                        'params': params,
+                        'unassigned_after': unassigned_after.isoformat(),
+                    }, f)
+            results = run_benchmarks(unassigned_after, args.repeat, args.only)
+    finally:
+        if args.database is None:
+            for name in path, params_path:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    output = {
+        'params': params,
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'timestamp': time.time(),
+        'results': results,
+    }
+    json.dump(output, args.output, indent=2, sort_keys=True,
+              separators=(',', ': '))
+    args.output.write('\n')
+    if args.compare is not None:
+        compare(results, json.load(args.compare))
+
+
+if __name__ == '__main__':
+    main()
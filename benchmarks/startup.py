@@ -0,0 +1,179 @@
+"""Benchmark for the startup cost of the ``ironblogger`` command & workers.
+
+The ``ironblogger`` script itself is run several times, both just parsing
+its arguments (``--help``) and running a cheap command (``export``, on an
+empty database) with the config loaded from ``IB2_CONFIG``, the way cron
+would. Then each target module is imported in a fresh interpreter several
+times. The best wall clock time is reported for each. On Python 3.7+, the modules
+which took longest to import (according to ``python -X importtime``) are
+listed as well, which is the place to start if a budget is blown:
+
+    python -m benchmarks.startup
+
+`tests/test_cli.py` enforces a budget for ``ironblogger --help``.
+
+The peak RSS of a web worker which has served one request is also
+reported, with and without the admin interface (``IB2_ENABLE_ADMIN``).
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules to time, from the command line module down to the full web app:
+TARGETS = [
+    'ironblogger.cli',
+    'ironblogger.tasks',
+    'ironblogger.wsgi',
+]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'scripts', 'ironblogger')
+
+# Commands to time, as run from the command line:
+COMMANDS = [
+    ['--help'],
+    ['export'],
+]
+
+# Number of modules to list from -X importtime:
+TOP_MODULES = 10
+
+_timing_script = '''
+import time
+start = time.time()
+import %s
+print(time.time() - start)
+'''
+
+
+def import_time(module):
+    """Return the time taken to import ``module`` in a fresh interpreter."""
+    with open(os.devnull, 'w') as devnull:
+        # Keep deprecation warnings and the like out of the report:
+        output = subprocess.check_output(
+            [sys.executable, '-c', _timing_script % module], stderr=devnull)
+    return float(output.decode('ascii').strip().splitlines()[-1])
+
+
+def command_time(args, env):
+    """Return the time taken to run the ironblogger script with ``args``."""
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        subprocess.check_call([sys.executable, SCRIPT] + args, env=env,
+                              cwd=ROOT, stdout=devnull, stderr=devnull)
+    return time.time() - start
+
+
+def command_env(tmpdir):
+    """Return the environment to run the script in, with a config file (and
+    an empty database) in ``tmpdir``."""
+    config = os.path.join(tmpdir, 'ib2.cfg')
+    with open(config, 'w') as f:
+        f.write("IB2_TIMEZONE = 'US/Eastern'\n"
+                "SQLALCHEMY_DATABASE_URI = 'sqlite:///%s'\n" %
+                os.path.join(tmpdir, 'ib2.db'))
+    env = dict(os.environ, IB2_CONFIG=config, PYTHONPATH=ROOT)
+    command_time(['init-db'], env)
+    return env
+
+
+_worker_script = '''
+import resource, sys
+from ironblogger.wsgi import application
+from ironblogger.app import db
+application.config.update(
+    SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',
+    IB2_TIMEZONE='US/Eastern',
+    IB2_REGION='Boston',
+    IB2_LANGUAGE='en-us',
+    IB2_ENABLE_ADMIN=%r,
+)
+with application.test_request_context():
+    db.create_all()
+    application.test_client().get('/posts')
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    peak //= 1024
+print(peak)
+'''
+
+
+def worker_rss_kib(enable_admin):
+    """Return the peak RSS of a worker which has served one request."""
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output(
+            [sys.executable, '-c', _worker_script % enable_admin],
+            stderr=devnull)
+    return int(output.decode('ascii').strip().splitlines()[-1])
+
+
+def slowest_imports(module):
+    """Return (cumulative microseconds, name) for the slowest imports.
+
+    Returns None if the interpreter doesn't support ``-X importtime``.
+    """
+    if sys.version_info < (3, 7):
+        return None
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime',
+                             '-W', 'ignore', '-c', 'import ' + module],
+                            stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    entries = []
+    for line in err.decode('utf-8').splitlines():
+        # Lines look like: "import time:  self [us] | cumulative | name"
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        entries.append((int(fields[1]), fields[2].strip()))
+    entries.sort(reverse=True)
+    return entries[:TOP_MODULES]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the startup time of the ironblogger command.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout, metavar='FILE')
+    args = parser.parse_args()
+
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        env = command_env(tmpdir)
+        for command in COMMANDS:
+            name = 'ironblogger ' + ' '.join(command)
+            times = sorted(command_time(command, env)
+                           for i in range(args.repeat))
+            results[name] = {'best': times[0], 'runs': times}
+            sys.stderr.write('%-20s best %7.1fms\n' % (name, times[0] * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+    for module in TARGETS:
+        times = sorted(import_time(module) for i in range(args.repeat))
+        results[module] = {'best': times[0], 'runs': times}
+        sys.stderr.write('%-20s best %7.1fms\n' % (module, times[0] * 1000))
+        slowest = slowest_imports(module)
+        if slowest:
+            for cumulative, name in slowest:
+                sys.stderr.write('    %8.1fms  %s\n' % (cumulative / 1000.0,
+                                                        name))
+    rss = {}
+    for enable_admin in True, False:
+        name = 'admin' if enable_admin else 'no_admin'
+        rss[name] = min(worker_rss_kib(enable_admin)
+                        for i in range(args.repeat))
+        sys.stderr.write('worker RSS (%-8s)  %7d KiB\n' % (name, rss[name]))
+    results['worker_rss_kib'] = rss
+    json.dump({'repeat': args.repeat, 'results': results}, args.output,
+              indent=2, sort_keys=True, separators=(',', ': '))
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Micro-benchmark for the timestamp template filters.
+
+Renders a table of 10,000 rows, each of which uses every timestamp filter,
+and reports the best time out of several runs. This is done both with
+distinct timestamps in every row (the worst case for the memo in
+`ironblogger.template_filters`) and with the small set of timestamps
+typical of /status, where many rows share the same duedate.
+"""
+from datetime import datetime, timedelta
+
+import arrow
+
+from ironblogger.app import app
+from ironblogger.date import from_dbtime, rssdate
+from . import configure_app, best_of
+
+NUM_ROWS = 10000
+
+template = '''
+{%- for row in rows -%}
+{{ row.dbtime | timestamp_rss }} {{ row.local | timestamp_long }}
+{{ row.local | timestamp_short }} {{ row.local | datestamp }}
+{% endfor -%}
+'''
+
+# The way things were done before the filters were memoized, for comparison:
+naive_template = '''
+{%- for row in rows -%}
+{{ rssdate(from_dbtime(row.dbtime)) }} {{ row.local.strftime(long) }}
+{{ row.local.strftime(short) }} {{ row.local.strftime(date) }}
+{% endfor -%}
+'''
+
+
+def make_rows(distinct):
+    start = datetime(2015, 1, 1)
+    rows = []
+    for i in range(NUM_ROWS):
+        if distinct:
+            dbtime = start + timedelta(minutes=17 * i)
+        else:
+            dbtime = start + timedelta(weeks=i % 5)
+        rows.append({
+            'dbtime': dbtime,
+            'local': arrow.get(dbtime).to(app.config['IB2_TIMEZONE']),
+        })
+    return rows
+
+
+def main():
+    configure_app()
+    with app.test_request_context():
+        env = app.jinja_env
+        tmpl = env.from_string(template)
+        naive_tmpl = env.from_string(naive_template)
+        for distinct in True, False:
+            rows = make_rows(distinct)
+            timings = [
+                ('filters', lambda: tmpl.render(rows=rows)),
+                ('unmemoized', lambda: naive_tmpl.render(
+                    rows=rows,
+                    rssdate=rssdate,
+                    from_dbtime=from_dbtime,
+                    long=app.config['IB2_TIMESTAMP_LONG'],
+                    short=app.config['IB2_TIMESTAMP_SHORT'],
+                    date=app.config['IB2_DATESTAMP'],
+                )),
+            ]
+            for name, fn in timings:
+                print('%-10s %-10s %d rows: %.3fs' % (
+                    'distinct' if distinct else 'repeated',
+                    name,
+                    NUM_ROWS,
+                    best_of(fn),
+                ))
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,9 @@ application.config.update(
     IB2_TIMEZONE='US/Eastern',
     IB2_LANGUAGE='en-us',
     SQLALCHEMY_DATABASE_URI=os.getenv('OPENSHIFT_POSTGRESQL_DB_URL') + '/' + APPNAME,
+    # The public pages can be served from a read replica; see
+    # ironblogger/engines.py for details:
+    # SQLALCHEMY_BINDS={'replica': 'postgresql://...'},
     # Secret key used for things like storing session information.
     # You can generate a key by running:
     #   dd if=/dev/random bs=1 count=128 | base64
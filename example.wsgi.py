@@ -16,6 +16,14 @@ application.config.update(
     # The database to use. Any SQLAlchemy URI can be used, but only SQLite and
     # postgresql have tested, and other DBMSes may not work:
     SQLALCHEMY_DATABASE_URI='sqlite:///' + os.getenv('PWD') + '/ib2.db',
+    # If you're using SQLite in production, enable the tuned profile, which
+    # (among other things) lets the public pages keep working while a sync is
+    # running. See ironblogger/engines.py for details:
+    # IB2_SQLITE_PRODUCTION=True,
+    # Read-only replicas (or any deployment that doesn't need the admin
+    # interface at /admin) can leave it out, which saves a bit of memory in
+    # each worker:
+    # IB2_ENABLE_ADMIN=False,
     # Secret key used for things like storing session information.
     # You can generate a key by running:
     #   dd if=/dev/random bs=1 count=128 | base64
@@ -27,4 +35,13 @@ application.config.update(
     # nicer. Here's a good example for US English (Used on the Boston site):
     # IB2_TIMESTAMP_LONG="%A %B %d, %Y at %I:%M %P",
     # IB2_TIMESTAMP_SHORT="%a %b %d, %I:%M %P",
+
+    # Responses are compressed if the client supports it. Bodies smaller
+    # than this many bytes are sent as-is (see ironblogger/compress.py for
+    # other options):
+    # IB2_COMPRESS_MIN_SIZE=500,
+
+    # Serve Prometheus metrics at /metrics. Anyone can read them, so keep
+    # that url private at your front-end proxy if you turn this on:
+    # IB2_METRICS=True,
 )
@@ -1,6 +1,7 @@
+from flask_admin import Admin
 from flask.ext.admin.contrib.sqla import ModelView
 from flask.ext import login
-from .app import admin
+from .app import app
 
 from . import model
 from .currency import format_usd
@@ -46,8 +47,42 @@ class PartyView(AdminModelView):
     }
 
 
+class SyncRunView(AdminModelView):
+
+    can_create = False
+    can_edit = False
+    column_list = ('start_time', 'duration') + \
+        tuple(stage + '_time' for stage in model.SyncRun.STAGES) + \
+        ('feeds_fetched', 'bytes_fetched', 'fetch_errors', 'parse_errors',
+         'error')
+    column_sortable_list = ('start_time',) + \
+        tuple(stage + '_time' for stage in model.SyncRun.STAGES)
+    column_default_sort = ('start_time', True)
+    column_formatters = {
+        'duration': lambda v,c,m,n: m.duration and '%.1f' % m.duration,
+    }
+
+
+class FeedFetchView(AdminModelView):
+
+    can_create = False
+    can_edit = False
+    column_list = ('run', 'blog', 'duration', 'bytes', 'status', 'error')
+    column_sortable_list = (('run', 'run.start_time'),
+                            ('blog', 'blog.title'),
+                            'duration', 'bytes', 'status')
+    column_default_sort = ('duration', True)
+    column_filters = ('status', 'error')
+    column_formatters = {
+        'duration': lambda v,c,m,n: '%.2f' % m.duration,
+    }
+
+
+admin = Admin(app)
 admin.add_view(UserView(model.User, model.db.session))
 admin.add_view(BloggerView(model.Blogger, model.db.session))
 admin.add_view(BlogView(model.Blog, model.db.session))
 admin.add_view(PaymentView(model.Payment, model.db.session))
 admin.add_view(PartyView(model.Party, model.db.session))
+admin.add_view(SyncRunView(model.SyncRun, model.db.session))
+admin.add_view(FeedFetchView(model.FeedFetch, model.db.session))
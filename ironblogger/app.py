@@ -13,16 +13,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 import flask
-from flask_admin import Admin
 from flask_mail import Mail
-from flask_sqlalchemy import SQLAlchemy
+from .assets import Assets
+from .compress import Compress
+from .engines import RoutingSQLAlchemy
+from .instrument import Instrumentation
 
 # Do the setup of our app and all of our flask extensions here; this
 # makes it much easier to avoid circular dependencies in the other modules.
 app = flask.Flask(__name__)
-admin = Admin(app)
-db = SQLAlchemy(app)
+# after_request hooks run in the reverse of the order they're registered, so
+# this needs to come first to see the final response:
+instrumentation = Instrumentation(app)
+db = RoutingSQLAlchemy(app)
 mail = Mail(app)
+compress = Compress(app)
+assets = Assets(app)
+# The admin interface (flask_admin) is the exception; it's set up by the
+# admin module, which is only loaded if IB2_ENABLE_ADMIN is set.
 
 
 app.config.update(
@@ -32,4 +40,7 @@ app.config.update(
     IB2_DATESTAMP='%F',
     IB2_POSTS_PER_PAGE=20,
     IB2_FORCE_HTTPS_LOGIN=True,
+    # Set to False to leave out the admin interface, e.g. on read-only
+    # replicas (see ironblogger/wsgi.py):
+    IB2_ENABLE_ADMIN=True,
 )
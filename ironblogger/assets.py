@@ -0,0 +1,186 @@
+"""Fingerprinting of static assets.
+
+Without a version in the url, browsers have to revalidate each stylesheet,
+script and font on every page view. The `Assets` extension adds a digest of
+the file's contents to every url generated for the ``static`` endpoint, e.g.
+``url_for('static', filename='style.css')`` becomes
+``/static/style.css?v=0123456789ab``. Requests for a url whose digest matches
+the file on disk are served with headers allowing the browser to cache them
+indefinitely; since the url changes whenever the file does, stale copies are
+never used.
+
+Fonts and images are referenced from stylesheets rather than templates, so
+stylesheets are served with the ``url(...)`` references to other static
+files fingerprinted too. A stylesheet's own digest covers the rewritten
+text, so it changes whenever one of the files it references does.
+
+Each file's digest is computed the first time a url is generated for it,
+and then kept for the life of the process; static files are only expected
+to change on deploy, which restarts it. In debug mode, digests are
+recomputed every time, so that edits show up right away. The digests for
+`LAYOUT_ASSETS` (and the fonts they reference) are computed when the wsgi
+module is loaded, so that the first request doesn't have to.
+
+The following config options are recognized:
+
+    IB2_STATIC_FINGERPRINT - Set to False to disable fingerprinting.
+    IB2_STATIC_MAX_AGE     - max-age (in seconds) for fingerprinted urls.
+"""
+import hashlib
+import posixpath
+import re
+import threading
+
+from flask import Response, request, url_for
+from flask.helpers import safe_join
+from six.moves.urllib.parse import urlsplit
+from werkzeug.exceptions import NotFound
+
+# The query parameter holding the fingerprint:
+VERSION_ARG = 'v'
+
+# The assets referenced by layout.html, i.e. on every page:
+LAYOUT_ASSETS = [
+    'bower_components/bootstrap/dist/css/bootstrap.min.css',
+    'bower_components/bootstrap/dist/js/bootstrap.min.js',
+    'bower_components/fontawesome/css/font-awesome.min.css',
+    'bower_components/jquery/dist/jquery.min.js',
+    'style.css',
+]
+
+# A ``url(...)`` reference in a stylesheet:
+CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class Assets(object):
+    """Flask extension which fingerprints static asset urls."""
+
+    def __init__(self, app=None):
+        # filename -> (digest, rewritten stylesheet or None); the digest is
+        # None for missing files:
+        self._cache = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('IB2_STATIC_FINGERPRINT', True)
+        app.config.setdefault('IB2_STATIC_MAX_AGE', 365 * 24 * 60 * 60)
+        app.url_defaults(self.url_defaults)
+        app.after_request(self.after_request)
+        app.add_template_global(self.asset_url)
+        # The url the static route was registered under:
+        self._static_prefix = app.static_url_path + '/'
+        self._send_static_file = app.view_functions['static']
+        app.view_functions['static'] = self.send_static_file
+
+    def asset_url(self, filename, **kwargs):
+        """Return the fingerprinted url for the static file ``filename``.
+
+        Equivalent to ``url_for('static', filename=filename, ...)``.
+        """
+        return url_for('static', filename=filename, **kwargs)
+
+    def fingerprint(self, filename):
+        """Return the fingerprint for ``filename``, or None if it is missing."""
+        return self._lookup(filename)[0]
+
+    def _lookup(self, filename):
+        """Return the ``(digest, stylesheet)`` pair for ``filename``.
+
+        ``stylesheet`` is the rewritten text of a stylesheet, or None for
+        any other file.
+        """
+        if not self.app.debug:
+            with self._lock:
+                cached = self._cache.get(filename)
+            if cached is not None:
+                return cached
+        result = self._compute(filename)
+        with self._lock:
+            self._cache[filename] = result
+        return result
+
+    def _compute(self, filename):
+        try:
+            path = safe_join(self.app.static_folder, filename)
+            with open(path, 'rb') as f:
+                if filename.endswith('.css'):
+                    stylesheet = self._rewrite_stylesheet(
+                        filename, f.read().decode('utf-8')).encode('utf-8')
+                    digest = hashlib.sha1(stylesheet)
+                else:
+                    stylesheet = None
+                    digest = hashlib.sha1()
+                    for chunk in iter(lambda: f.read(64 * 1024), b''):
+                        digest.update(chunk)
+        except (NotFound, IOError, OSError):
+            return None, None
+        return digest.hexdigest()[:12], stylesheet
+
+    def _rewrite_stylesheet(self, filename, text):
+        """Fingerprint the urls of static files referenced by ``text``, the
+        contents of the stylesheet ``filename``."""
+        prefix = self._static_prefix
+
+        def replace(match):
+            quote, url = match.groups()
+            parts = urlsplit(url)
+            if parts.scheme or parts.netloc or not parts.path:
+                return match.group(0)
+            if parts.path.startswith('/'):
+                if not parts.path.startswith(prefix):
+                    return match.group(0)
+                target = parts.path[len(prefix):]
+            else:
+                target = posixpath.normpath(posixpath.join(
+                    posixpath.dirname(filename), parts.path))
+            digest = None if target == filename else self.fingerprint(target)
+            if digest is None:
+                return match.group(0)
+            # Any query there was (e.g. font-awesome's ``?v=4.7.0``) is
+            # replaced; the fragment (e.g. ``#iefix``) is kept:
+            url = '%s?%s=%s' % (parts.path, VERSION_ARG, digest)
+            if parts.fragment:
+                url += '#' + parts.fragment
+            return 'url(%s%s%s)' % (quote, url, quote)
+        return CSS_URL_RE.sub(replace, text)
+
+    def warm(self, filenames):
+        """Compute the fingerprints for each of ``filenames`` up front."""
+        for filename in filenames:
+            self.fingerprint(filename)
+
+    def send_static_file(self, filename):
+        """View for the ``static`` endpoint, serving stylesheets with their
+        references fingerprinted."""
+        if not filename.endswith('.css') or \
+                not self.app.config['IB2_STATIC_FINGERPRINT']:
+            return self._send_static_file(filename)
+        digest, stylesheet = self._lookup(filename)
+        if stylesheet is None:
+            return self._send_static_file(filename)
+        response = Response(stylesheet, mimetype='text/css')
+        response.set_etag(digest)
+        return response.make_conditional(request)
+
+    def url_defaults(self, endpoint, values):
+        if endpoint != 'static' or VERSION_ARG in values or \
+                not self.app.config['IB2_STATIC_FINGERPRINT']:
+            return
+        digest = self.fingerprint(values['filename'])
+        if digest is not None:
+            values[VERSION_ARG] = digest
+    def after_request(self, response):
+        if request.endpoint != 'static' or response.status_code != 200:
+            return response
+        version = request.args.get(VERSION_ARG)
+        if version is None or \
+                version != self.fingerprint(request.view_args['filename']):
+            return response
+        response.headers['Cache-Control'] = \
+            'public, max-age=%d, immutable' % \
+            self.app.config['IB2_STATIC_MAX_AGE']
+        response.expires = None
+        return response
@@ -0,0 +1,53 @@
+"""Persistent cache for compiled templates.
+
+By default, every new worker process compiles each template from source the
+first time it is rendered. Jinja can instead store the compiled bytecode on
+disk, so that it only needs to be compiled once; `precompile_templates`
+populates that cache ahead of time (e.g. during a deploy), so that even the
+first request a worker handles doesn't pay for compilation.
+
+The following config options are recognized:
+
+    IB2_TEMPLATE_CACHE     - Set to False to disable the bytecode cache.
+    IB2_TEMPLATE_CACHE_DIR - Directory to store the cache in. Defaults to a
+                             per-user directory under the system's temporary
+                             directory.
+"""
+import logging
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+from .app import app
+
+app.config.setdefault('IB2_TEMPLATE_CACHE', True)
+app.config.setdefault('IB2_TEMPLATE_CACHE_DIR', None)
+
+
+@app.before_first_request
+def init_bytecode_cache():
+    """Configure the template bytecode cache according to ``app.config``.
+
+    This has to wait until the config has been loaded, so it happens on the
+    first request, rather than at import time.
+    """
+    if not app.config['IB2_TEMPLATE_CACHE']:
+        app.jinja_env.bytecode_cache = None
+        return
+    directory = app.config['IB2_TEMPLATE_CACHE_DIR']
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def precompile_templates():
+    """Compile all of the app's templates, populating the bytecode cache.
+
+    Returns a list of the names of the templates compiled.
+    """
+    init_bytecode_cache()
+    names = app.jinja_loader.list_templates()
+    for name in names:
+        logging.info('Compiling template %r', name)
+        app.jinja_env.get_template(name)
+    return names
@@ -13,54 +13,216 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 
-from argparse import ArgumentParser
+"""The ``ironblogger`` command.
+
+This gets run often (e.g. from cron), so it's important that it start up
+quickly. To that end, this module doesn't import anything heavy at the top
+level; each command names the function it runs by its dotted path, which is
+only imported when the command is actually invoked. Please keep it that way
+-- `tests/test_cli.py` checks the startup time against a budget.
+
+The same goes for the config: it's only loaded (by `load_config`) once the
+arguments have been parsed, and if ``IB2_CONFIG`` names a config file, the
+web app isn't imported at all.
+"""
+from __future__ import absolute_import
+
+from argparse import ArgumentParser, ArgumentTypeError
+from importlib import import_module
+import os
 import sys
 
-from .tasks import *
-from .app import app
+from .profiling import profiled, memory_traced, DEFAULT_PROFILE_PATH
+
+
+def _import_bloggers():
+    from .tasks import import_bloggers
+    import_bloggers(sys.stdin)
+
+
+def _export_bloggers():
+    from .tasks import export_bloggers
+    export_bloggers(sys.stdout)
+
+
+def _dump():
+    from .dump import dump_db
+    dump_db(sys.stdout)
+
+
+def _restore():
+    from .dump import restore_db
+    restore_db(sys.stdin)
+
+
+def _shard(value):
+    """Parse a shard given as ``K/N`` into the pair ``(K, N)``."""
+    try:
+        k, n = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ArgumentTypeError('expected K/N, e.g. 0/4, but got %r' % value)
+    if not 0 <= k < n:
+        raise ArgumentTypeError('K must be between 0 and N-1 in K/N')
+    return k, n
+
+
+def _serve():
+    # The config may have been loaded without the web app (see
+    # `load_config`), so make sure the views are there:
+    from .wsgi import application
+    application.run(debug=True)
+
 
 commands = {
     'init-db': dict(
-        fn=init_db,
+        fn='ironblogger.tasks:init_db',
         help='initialize the database'),
     'import': dict(
-        fn=lambda: import_bloggers(sys.stdin),
+        fn=_import_bloggers,
         help='import bloggers from yaml file.'),
     'export': dict(
-        fn=lambda: export_bloggers(sys.stdout),
+        fn=_export_bloggers,
         help='export bloggers to yaml file.'),
+    'dump': dict(
+        fn=_dump,
+        help='dump the whole database to stdout, as newline-delimited json.'),
+    'restore': dict(
+        fn=_restore,
+        help='restore a dump from stdin into an empty database.'),
     'make-admin': dict(
-        fn=make_admin,
+        fn='ironblogger.tasks:make_admin',
         help='interactively create an admin user.'),
     'serve': dict(
-        fn=lambda: app.run(debug=True),
+        fn=_serve,
         help='start the app server (in debug mode).'),
     'send-reminders': dict(
-        fn=send_reminders,
+        fn='ironblogger.tasks:send_reminders',
         help='send reminder emails.'),
     'shell': dict(
-        fn=shell,
+        fn='ironblogger.tasks:shell',
         help='start a python shell inside the app context.'),
     'fetch-posts': dict(
-        fn=fetch_posts,
-        help='fetch new posts from blogs'),
+        fn='ironblogger.tasks:fetch_posts',
+        help='fetch new posts from blogs',
+        args=[
+            (('--shard',), dict(
+                type=_shard,
+                metavar='K/N',
+                help='only fetch the Kth of N shards of the blogs '
+                     '(counting from 0).')),
+            (('--lease',), dict(
+                action='store_true',
+                help='claim blogs in batches, so several hosts can share '
+                     'the work; see ironblogger/fetch.py.')),
+        ]),
     'assign-rounds': dict(
-        fn=assign_rounds,
+        fn='ironblogger.tasks:assign_rounds',
         help='assign posts to rounds.'),
     'sync': dict(
-        fn=sync,
+        fn='ironblogger.tasks:sync',
         help='Download new posts and update accounting.'),
+    'daemon': dict(
+        fn='ironblogger.daemon:run_daemon',
+        help='run sync (and reminders) on a schedule, until killed.'),
+    'export-site': dict(
+        fn='ironblogger.staticsite:export_site',
+        help='render the public pages to static files.',
+        args=[
+            (('dest',), dict(
+                metavar='DIR',
+                help='directory to write the pages to.')),
+            (('--force',), dict(
+                action='store_true',
+                help='re-render every page, even if it has not changed.')),
+            (('--base-url',), dict(
+                default='http://localhost/',
+                help='url the site will be served from.')),
+        ]),
+    'precompile-templates': dict(
+        fn='ironblogger.bytecode_cache:precompile_templates',
+        help='compile the templates ahead of time, to warm the cache.'),
+    'bench-web': dict(
+        fn='ironblogger.loadtest:bench_web',
+        help='load test the public pages.',
+        args=[
+            (('--database',), dict(
+                metavar='PATH',
+                help='SQLite database to use instead of the configured one.')),
+            (('--requests',), dict(
+                type=int,
+                default=1000,
+                help='number of requests to make (default: %(default)s).')),
+            (('--concurrency',), dict(
+                type=int,
+                default=8,
+                help='number of concurrent clients (default: %(default)s).')),
+            (('--socket',), dict(
+                action='store_true',
+                help='make requests over a local socket, rather than '
+                     'in-process.')),
+            (('--output',), dict(
+                metavar='FILE',
+                help='write the results to FILE as JSON.')),
+        ]),
 }
 
+# A command's fn is either a function, or a string 'module:name' naming one.
+# Each command may also specify 'args', a list of (args, kwargs) pairs to be
+# passed to `add_argument`. The parsed values are passed to the command's fn
+# as keyword arguments.
+
 main_parser = ArgumentParser()
+main_parser.add_argument(
+    '--profile',
+    nargs='?',
+    const=DEFAULT_PROFILE_PATH,
+    metavar='PATH',
+    help='profile the command, saving the stats to PATH (default: %s).' %
+    DEFAULT_PROFILE_PATH)
+main_parser.add_argument(
+    '--trace-memory',
+    action='store_true',
+    help='report the lines which allocated the most memory.')
 
 subcommands_parser = main_parser.add_subparsers()
 
 
-def mk_wrapper_fn(cmd):
+def resolve(fn):
+    """Return the function ``fn`` refers to, importing it if necessary."""
+    if not isinstance(fn, str):
+        return fn
+    module, name = fn.split(':')
+    return getattr(import_module(module), name)
+
+
+def load_config():
+    """Load the app's config, for a command run from the command line.
+
+    If the environment variable ``IB2_CONFIG`` is set, it's the path to a
+    config file: python code which sets upper case variables, as for
+    flask's ``Config.from_pyfile`` (e.g. ``IB2_TIMEZONE = 'US/Eastern'``).
+    Otherwise, the config is taken from ``wsgi.py`` in the current
+    directory, which means importing the whole web app along with it.
+    """
+    from .app import app
+    if os.environ.get('IB2_CONFIG'):
+        app.config.from_envvar('IB2_CONFIG')
+    else:
+        import wsgi
+
+
+def mk_wrapper_fn(cmd, dests):
     def wrapper_fn(args):
-        with app.test_request_context():
-            commands[cmd]['fn']()
+        kwargs = dict((dest, getattr(args, dest)) for dest in dests)
+        # Include the imports in the profile; they're part of the cost of
+        # running the command:
+        with profiled(args.profile), memory_traced(args.trace_memory):
+            from .app import app
+            if args.load_config:
+                load_config()
+            fn = resolve(commands[cmd]['fn'])
+            with app.test_request_context():
+                fn(**kwargs)
     return wrapper_fn
 
 
@@ -68,9 +230,30 @@ for cmd in commands.keys():
     subp = subcommands_parser.add_parser(
         cmd,
         help=commands[cmd]['help'])
-    subp.set_defaults(func=mk_wrapper_fn(cmd))
+    dests = [subp.add_argument(*args, **kwargs).dest
+             for args, kwargs in commands[cmd].get('args', [])]
+    subp.set_defaults(func=mk_wrapper_fn(cmd, dests))
+
+
+def _expand_profile_flag(argv):
+    """Replace a bare ``--profile`` in ``argv`` with an explicit path.
+
+    Otherwise, argparse would take the command name as the path in e.g.
+    ``ironblogger --profile sync``.
+    """
+    return ['--profile=' + DEFAULT_PROFILE_PATH if arg == '--profile' else arg
+            for arg in argv]
+
 
+def main(argv=None, config=False):
+    """Run the command given by ``argv`` (by default, ``sys.argv[1:]``).
 
-def main():
-    args = main_parser.parse_args()
+    If ``config`` is true, the config is loaded (see `load_config`) before
+    running it; the ``ironblogger`` script does this, while the tests set up
+    the app themselves.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    args = main_parser.parse_args(_expand_profile_flag(argv))
+    args.load_config = config
     args.func(args)
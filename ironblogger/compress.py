@@ -0,0 +1,129 @@
+"""Compression of response bodies.
+
+The listing pages (and the rss feed) include an excerpt of each post, so
+they can get fairly large; they compress very well though. The `Compress`
+extension compresses responses according to the client's Accept-Encoding
+header. gzip is always available; brotli is used if the ``brotli`` package is
+installed and the client prefers it.
+
+The public pages only change after a sync, so the same body tends to be sent
+over and over. Compressed bodies are therefore kept in a (bounded) cache,
+keyed on a digest of the uncompressed body, so that repeat hits don't pay for
+compression again.
+
+The following config options are recognized:
+
+    IB2_COMPRESS_MIN_SIZE   - Bodies smaller than this many bytes are sent
+                              uncompressed.
+    IB2_COMPRESS_LEVEL      - Compression level: 1-9, as for gzip. brotli
+                              uses it as its quality (which goes up to 11).
+    IB2_COMPRESS_CACHE_SIZE - Maximum number of compressed bodies to keep
+                              around. 0 disables the cache.
+    IB2_COMPRESS_MIMETYPES  - Mimetypes which will be compressed.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from flask import request
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _gzip(data, level):
+    buf = BytesIO()
+    # Fixing mtime keeps the output (and hence the cache) deterministic:
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf,
+                       compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+_compressors = OrderedDict([
+    # Listed in order of preference, for when the client doesn't have one:
+    ('br', _brotli),
+    ('gzip', _gzip),
+])
+
+
+class Compress(object):
+    """Flask extension which compresses response bodies."""
+
+    def __init__(self, app=None):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('IB2_COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('IB2_COMPRESS_LEVEL', 6)
+        app.config.setdefault('IB2_COMPRESS_CACHE_SIZE', 128)
+        app.config.setdefault('IB2_COMPRESS_MIMETYPES', [
+            'text/html',
+            'text/css',
+            'text/xml',
+            'application/rss+xml',
+            'application/javascript',
+            'application/json',
+        ])
+        app.after_request(self.after_request)
+
+    def available_encodings(self):
+        return [enc for enc in _compressors
+                if enc != 'br' or brotli is not None]
+
+    def after_request(self, response):
+        config = self.app.config
+        if response.mimetype not in config['IB2_COMPRESS_MIMETYPES']:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.direct_passthrough or \
+                response.status_code != 200 or \
+                'Content-Encoding' in response.headers:
+            return response
+        encoding = request.accept_encodings.best_match(
+            self.available_encodings())
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < config['IB2_COMPRESS_MIN_SIZE']:
+            return response
+
+        response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def compress(self, data, encoding):
+        """Return ``data`` compressed with ``encoding``, using the cache."""
+        max_entries = self.app.config['IB2_COMPRESS_CACHE_SIZE']
+        key = (hashlib.sha1(data).digest(), encoding)
+        with self._lock:
+            if key in self._cache:
+                compressed = self._cache.pop(key)
+                # Re-insert to mark it as most recently used:
+                self._cache[key] = compressed
+                metrics.compress_cache_hits.inc()
+                return compressed
+
+        metrics.compress_cache_misses.inc()
+        compressed = _compressors[encoding](data,
+                                            self.app.config['IB2_COMPRESS_LEVEL'])
+        if max_entries > 0:
+            with self._lock:
+                self._cache[key] = compressed
+                while len(self._cache) > max_entries:
+                    self._cache.popitem(last=False)
+        return compressed
@@ -0,0 +1,193 @@
+"""A long-running alternative to running the tasks from cron.
+
+``ironblogger daemon`` runs `sync` (and, optionally, `send_reminders`) on a
+schedule, from a single process. Compared to running ``ironblogger sync``
+from cron, this saves starting the interpreter, importing everything and
+connecting to the database for every run, and a slow sync can't overlap
+the next one: jobs run one at a time, and a job which is overdue when the
+previous one finishes simply runs next.
+
+Only one daemon may run at a time (per lock file). On SIGTERM or SIGINT,
+the daemon finishes the feed it is fetching, if any, and exits; a second
+signal kills it outright.
+
+The following config options are recognized:
+
+    IB2_DAEMON_SYNC_INTERVAL  - Seconds between the starts of consecutive
+                                syncs.
+    IB2_DAEMON_REMINDER_HOURS - If not None, reminders are sent this many
+                                hours before each deadline. Defaults to
+                                None, i.e. no reminders.
+    IB2_DAEMON_LOCK_FILE      - Path of the lock file. Defaults to a file in
+                                the system's temporary directory.
+"""
+import errno
+import fcntl
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+
+from .app import app, db
+from .date import duedate, duedate_seek, now
+
+app.config.setdefault('IB2_DAEMON_SYNC_INTERVAL', 15 * 60)
+app.config.setdefault('IB2_DAEMON_REMINDER_HOURS', None)
+app.config.setdefault('IB2_DAEMON_LOCK_FILE', None)
+
+DEFAULT_LOCK_FILE = os.path.join(tempfile.gettempdir(),
+                                 'ironblogger-daemon.lock')
+
+
+class AlreadyRunningError(Exception):
+    """Raised if another daemon holds the lock."""
+
+
+class Scheduler(object):
+    """Runs jobs, one at a time, until told to stop.
+
+    Each job is a function, plus a function computing the time (as returned
+    by `time.time`) at which it should next run, given the current time.
+    Exceptions raised by a job are logged, and don't stop the scheduler.
+    """
+
+    def __init__(self, stop=None):
+        if stop is None:
+            stop = threading.Event()
+        self.stop = stop
+        # Each entry is [next run time, name, fn, next_time]:
+        self._jobs = []
+
+    def add(self, name, fn, next_time):
+        self._jobs.append([next_time(time.time()), name, fn, next_time])
+
+    def run(self):
+        while self._jobs and not self.stop.is_set():
+            job = min(self._jobs)
+            when, name, fn, next_time = job
+            delay = when - time.time()
+            if delay > 0:
+                logging.info('Next job: %s, in %.0f seconds', name, delay)
+                # Returns early (and true) if we're told to stop:
+                if self.stop.wait(delay):
+                    break
+            logging.info('Running %s', name)
+            try:
+                fn()
+            except Exception:
+                logging.exception('Job %s failed', name)
+            finally:
+                # Hand any connections back to the pool between jobs:
+                db.session.remove()
+            job[0] = next_time(time.time())
+
+
+def every(seconds):
+    """Return a next_time function for a job run every ``seconds``.
+
+    The first run is immediate.
+    """
+    state = {}
+
+    def next_time(current):
+        if 'last' not in state:
+            state['last'] = current
+            return current
+        state['last'] = max(state['last'] + seconds, current)
+        return state['last']
+    return next_time
+
+
+def before_deadline(hours):
+    """Return a next_time function for a job run ``hours`` before each
+    deadline."""
+    def next_time(current):
+        due = duedate(now())
+        while True:
+            when = due.replace(hours=-hours).timestamp
+            if when > current:
+                return when
+            due = duedate_seek(due, 1)
+    return next_time
+
+
+class PidLock(object):
+    """An exclusive lock on a file, which records the pid of its holder.
+
+    The lock is released when the process exits, however it exits, so a
+    crashed daemon never leaves a stale lock behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+            f.seek(0)
+            holder = f.read().strip()
+            f.close()
+            raise AlreadyRunningError('Another daemon (pid %s) holds %s' %
+                                      (holder or 'unknown', self.path))
+        f.seek(0)
+        f.truncate()
+        f.write('%d\n' % os.getpid())
+        f.flush()
+        self._file = f
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _install_signal_handlers(stop):
+    """Make SIGTERM and SIGINT set ``stop``, the first time."""
+    def handler(signum, frame):
+        logging.info('Received signal %d; finishing in-flight work. '
+                     'Signal again to exit immediately.', signum)
+        stop.set()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+def make_scheduler(stop=None):
+    """Return a `Scheduler` with the jobs given by the config."""
+    from .tasks import sync, send_reminders
+    scheduler = Scheduler(stop)
+    scheduler.add('sync',
+                  lambda: sync(scheduler.stop),
+                  every(app.config['IB2_DAEMON_SYNC_INTERVAL']))
+    hours = app.config['IB2_DAEMON_REMINDER_HOURS']
+    if hours is not None:
+        scheduler.add('send-reminders', send_reminders,
+                      before_deadline(hours))
+    return scheduler
+
+
+def run_daemon():
+    """Run the scheduled tasks until we receive SIGTERM or SIGINT."""
+    lock_path = app.config['IB2_DAEMON_LOCK_FILE'] or DEFAULT_LOCK_FILE
+    with PidLock(lock_path):
+        scheduler = make_scheduler()
+        _install_signal_handlers(scheduler.stop)
+        logging.info('Daemon started (pid %d)', os.getpid())
+        scheduler.run()
+        logging.info('Daemon stopped')
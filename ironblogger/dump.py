@@ -0,0 +1,187 @@
+"""Dumping and restoring the whole database (``ironblogger dump/restore``).
+
+Unlike ``ironblogger export``, which only covers bloggers and their blogs, a
+dump has the contents of every table, so restoring it into an empty database
+(e.g. fresh from ``ironblogger init-db``) gives a complete copy, even if the
+two use different database engines: this is how to move from SQLite to
+PostgreSQL, or to clone production into a staging instance.
+
+A dump is newline-delimited JSON. The first line is a header::
+
+    {"format": "ironblogger-dump", "version": 1, "revision": "<alembic rev>"}
+
+Then, for each table (in an order which respects foreign keys), a line
+naming the table and its columns, followed by one line per row, each a
+JSON list of that row's values, in the same order as the columns::
+
+    {"table": "blogger", "columns": ["id", "name", ...]}
+    [1, "alice", ...]
+    ...
+
+Dates and times are written in ISO 8601 format, and binary columns in base64.
+
+Both directions work a batch of rows at a time, so memory use doesn't depend
+on the size of the database; rows are read and written with SQLAlchemy core,
+rather than the ORM, and restored with one multi-row insert per batch.
+"""
+import base64
+import json
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from .model import db
+
+FORMAT = 'ironblogger-dump'
+VERSION = 1
+
+# Rows per batch, when reading and writing:
+BATCH_SIZE = 1000
+
+_alembic_version = sa.table('alembic_version', sa.column('version_num'))
+
+
+class RestoreError(Exception):
+    """The dump can't be restored into this database."""
+
+
+def _revision(conn):
+    """Return the database's alembic revision, or None if it isn't tracked."""
+    if not conn.dialect.has_table(conn, 'alembic_version'):
+        return None
+    return conn.execute(sa.select([_alembic_version.c.version_num]))\
+        .scalar()
+
+
+def _encoder(column):
+    if isinstance(column.type, (sa.DateTime, sa.Date)):
+        return lambda value: value.isoformat()
+    if isinstance(column.type, sa.LargeBinary):
+        return lambda value: base64.b64encode(value).decode('ascii')
+    return None
+
+
+def _decoder(column):
+    if isinstance(column.type, sa.DateTime):
+        def decode(value):
+            fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value \
+                else '%Y-%m-%dT%H:%M:%S'
+            return datetime.strptime(value, fmt)
+        return decode
+    if isinstance(column.type, sa.Date):
+        return lambda value: datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(column.type, sa.LargeBinary):
+        return lambda value: base64.b64decode(value.encode('ascii'))
+    return None
+
+
+def _convert(row, converters):
+    return [value if convert is None or value is None else convert(value)
+            for value, convert in zip(row, converters)]
+
+
+def _write(file, obj):
+    file.write(json.dumps(obj, separators=(',', ':')))
+    file.write('\n')
+
+
+def dump_db(file):
+    """Write the contents of every table to ``file``, as described above."""
+    conn = db.session.connection()
+    _write(file, {'format': FORMAT,
+                  'version': VERSION,
+                  'revision': _revision(conn)})
+    for table in db.metadata.sorted_tables:
+        columns = list(table.columns)
+        _write(file, {'table': table.name,
+                      'columns': [column.name for column in columns]})
+        encoders = [_encoder(column) for column in columns]
+        result = conn.execution_options(stream_results=True)\
+            .execute(sa.select(columns).order_by(*table.primary_key.columns))
+        while True:
+            rows = result.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                _write(file, _convert(row, encoders))
+        result.close()
+
+
+def restore_db(file):
+    """Load a dump written by `dump_db` from ``file``.
+
+    The database must already have the schema (see ``ironblogger init-db``),
+    at the same alembic revision as the one dumped, and be empty; otherwise,
+    `RestoreError` is raised. Everything is restored in one transaction.
+    """
+    conn = db.session.connection()
+    try:
+        header = json.loads(file.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise RestoreError('Not an iron blogger dump.')
+    if header.get('version') != VERSION:
+        raise RestoreError('Unsupported dump version %r.' %
+                           header.get('version'))
+    revision = _revision(conn)
+    if header['revision'] != revision:
+        raise RestoreError('The dump is from revision %s of the schema, but '
+                           'the database is at %s; upgrade whichever is older '
+                           'first.' % (header['revision'], revision))
+    for table in db.metadata.sorted_tables:
+        if conn.execute(sa.select([sa.func.count()]).select_from(table))\
+                .scalar():
+            raise RestoreError('The database must be empty, but table %r '
+                               'has rows in it.' % table.name)
+
+    table = insert = names = decoders = None
+    batch = []
+    restored = set()
+    for line in file:
+        record = json.loads(line)
+        if isinstance(record, dict):
+            _insert(conn, insert, batch)
+            batch = []
+            if record['table'] not in db.metadata.tables:
+                raise RestoreError('Unknown table %r.' % record['table'])
+            table = db.metadata.tables[record['table']]
+            names = record['columns']
+            decoders = [_decoder(table.columns[name]) for name in names]
+            insert = table.insert()
+            restored.add(table)
+            continue
+        if table is None:
+            raise RestoreError('Row before any table header.')
+        batch.append(dict(zip(names, _convert(record, decoders))))
+        if len(batch) == BATCH_SIZE:
+            _insert(conn, insert, batch)
+            batch = []
+    _insert(conn, insert, batch)
+    for table in restored:
+        _reset_sequence(conn, table)
+    db.session.commit()
+
+
+def _insert(conn, insert, batch):
+    if batch:
+        conn.execute(insert, batch)
+
+
+def _reset_sequence(conn, table):
+    """Make the next id PostgreSQL assigns in ``table`` follow the restored
+    ones; other databases go by the existing rows anyway."""
+    if conn.dialect.name != 'postgresql':
+        return
+    for column in table.primary_key.columns:
+        if not (column.autoincrement and isinstance(column.type, sa.Integer)):
+            continue
+        last = conn.execute(sa.select([sa.func.max(column)])).scalar()
+        conn.execute(sa.text(
+            'SELECT setval(pg_get_serial_sequence(:table, :column), '
+            ':value, :called)'),
+            # e.g. "user" needs quoting:
+            table=conn.dialect.identifier_preparer.quote(table.name),
+            column=column.name,
+            value=last or 1,
+            called=last is not None)
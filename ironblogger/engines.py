@@ -0,0 +1,239 @@
+"""Database engine configuration and routing.
+
+Nearly all of the traffic iron blogger sees is anonymous reads of the public
+pages; the only things that write to the database are the tasks (chiefly
+`sync`) and the admin interface. This module lets the read-only views use a
+separate engine from everything else:
+
+* Views decorated with `read_only` run their queries through the *read*
+  engine.
+* Everything else (tasks, admin, login) uses the usual engine, which is the
+  only one that writes.
+
+It also provides a tuned profile for running on SQLite in production,
+enabled by setting ``IB2_SQLITE_PRODUCTION``. With the profile enabled:
+
+* The database is put in WAL mode, which lets readers continue while a
+  writer (e.g. a long-running sync) has a transaction open.
+* Each connection gets a busy timeout, so that brief lock contention waits
+  rather than raising "database is locked."
+* The read engine is a separate pool of connections with ``query_only``
+  set.
+
+The following config options tune the profile:
+
+    IB2_SQLITE_SYNCHRONOUS  - Value for PRAGMA synchronous. NORMAL is safe
+                              in WAL mode, and much cheaper than FULL.
+    IB2_SQLITE_CACHE_SIZE   - Value for PRAGMA cache_size; negative values
+                              are in KiB.
+    IB2_SQLITE_MMAP_SIZE    - Value for PRAGMA mmap_size, in bytes.
+    IB2_SQLITE_BUSY_TIMEOUT - Busy timeout, in milliseconds.
+
+On PostgreSQL, the read engine can instead be a read replica, configured
+via the ``replica`` key of ``SQLALCHEMY_BINDS``, e.g.:
+
+    SQLALCHEMY_BINDS={
+        'replica': 'postgresql://ib2@replica.example.com/ironblogger',
+    }
+
+The replica is checked periodically; if it can't be reached, or it lags
+behind the primary by too much, read-only views fall back to the primary
+until the next check. The following options control this:
+
+    IB2_REPLICA_MAX_LAG        - Maximum acceptable replication lag, in
+                                 seconds.
+    IB2_REPLICA_CHECK_INTERVAL - How often to check the replica's health, in
+                                 seconds.
+
+Any database SQLAlchemy supports can be used as the "replica," which is
+handy for testing locally (e.g. with two SQLite files); replication lag is
+only measured on PostgreSQL.
+
+If neither a replica nor the SQLite profile is configured, the read engine
+is just the usual engine.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+import flask
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import orm
+
+# Key in SQLALCHEMY_BINDS for the read replica:
+REPLICA_BIND = 'replica'
+
+
+def read_only(view):
+    """Decorator marking ``view`` as not writing to the database."""
+    view.ib2_read_only = True
+    return view
+
+
+def is_read_only_request():
+    """Return whether we're handling a request for a `read_only` view."""
+    if not flask.has_request_context():
+        return False
+    view = flask.current_app.view_functions.get(flask.request.endpoint)
+    return getattr(view, 'ib2_read_only', False)
+
+
+def _is_sqlite_file(url):
+    return url.drivername.startswith('sqlite') and \
+        url.database not in (None, '', ':memory:')
+
+
+class RoutingSession(SignallingSession):
+    """Session which sends queries from read-only views to the read engine."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if is_read_only_request():
+            return self._ib2_db.get_read_engine(self.app)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """`SQLAlchemy` extension using `RoutingSession`."""
+
+    def __init__(self, *args, **kwargs):
+        self._read_engines = {}
+        self._read_engines_lock = threading.Lock()
+        # Maps replica urls to (time of last check, healthy?)
+        self._replica_status = {}
+        # Maps apps to their 'connect' listeners; see get_engine:
+        self._connect_listeners = {}
+        SQLAlchemy.__init__(self, *args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('IB2_SQLITE_PRODUCTION', False)
+        app.config.setdefault('IB2_SQLITE_SYNCHRONOUS', 'NORMAL')
+        app.config.setdefault('IB2_SQLITE_CACHE_SIZE', -20000)
+        app.config.setdefault('IB2_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+        app.config.setdefault('IB2_SQLITE_BUSY_TIMEOUT', 5000)
+        app.config.setdefault('IB2_REPLICA_MAX_LAG', 30)
+        app.config.setdefault('IB2_REPLICA_CHECK_INTERVAL', 10)
+        SQLAlchemy.init_app(self, app)
+
+        def configure_sqlite(dbapi_connection, connection_record):
+            if isinstance(dbapi_connection, sqlite3.Connection) and \
+                    app.config['IB2_SQLITE_PRODUCTION']:
+                _apply_sqlite_profile(app.config, dbapi_connection)
+        self._connect_listeners[app] = configure_sqlite
+
+    def get_engine(self, app=None, bind=None):
+        app = self.get_app(app)
+        engine = SQLAlchemy.get_engine(self, app, bind)
+        # Engines are created lazily (and again if the config changes), so
+        # we attach the listener to each one the first time we see it,
+        # rather than to every Engine in the process:
+        self._listen_for_connect(app, engine)
+        return engine
+
+    def _listen_for_connect(self, app, engine):
+        listener = self._connect_listeners[app]
+        if not event.contains(engine, 'connect', listener):
+            event.listen(engine, 'connect', listener)
+
+    def create_session(self, options):
+        session_cls = type('RoutingSession', (RoutingSession,),
+                           {'_ib2_db': self})
+        return orm.sessionmaker(class_=session_cls, db=self, **options)
+
+    def get_read_engine(self, app=None):
+        """Return the engine used by read-only views."""
+        app = self.get_app(app)
+        if REPLICA_BIND in (app.config['SQLALCHEMY_BINDS'] or {}):
+            replica = self.get_engine(app, REPLICA_BIND)
+            if self.replica_healthy(app, replica):
+                return replica
+            return self.get_engine(app)
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        if not (app.config['IB2_SQLITE_PRODUCTION'] and _is_sqlite_file(url)):
+            return self.get_engine(app)
+        key = str(url)
+        with self._read_engines_lock:
+            if key not in self._read_engines:
+                # Unlike the writer, readers benefit from keeping their
+                # connections (and thus their page caches) around, so we
+                # pool them:
+                engine = create_engine(
+                    url,
+                    poolclass=QueuePool,
+                    connect_args={'check_same_thread': False},
+                )
+                self._listen_for_connect(app, engine)
+                event.listen(engine, 'connect', _set_query_only)
+                self._read_engines[key] = engine
+            return self._read_engines[key]
+
+    def replica_healthy(self, app, replica):
+        """Return whether the ``replica`` engine is fit to use.
+
+        The result is cached for ``IB2_REPLICA_CHECK_INTERVAL`` seconds.
+        """
+        key = str(replica.url)
+        checked_at, healthy = self._replica_status.get(key, (None, False))
+        now = time.time()
+        if checked_at is not None and \
+                now - checked_at < app.config['IB2_REPLICA_CHECK_INTERVAL']:
+            return healthy
+        try:
+            conn = replica.connect()
+            try:
+                lag = _replica_lag(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.warning('Read replica unavailable: %s', e)
+            healthy = False
+        else:
+            healthy = lag is None or lag <= app.config['IB2_REPLICA_MAX_LAG']
+            if not healthy:
+                logging.warning('Read replica is lagging by %.1f seconds', lag)
+        self._replica_status[key] = (now, healthy)
+        return healthy
+
+
+def _replica_lag(conn):
+    """Return the replication lag of the database ``conn`` is connected to.
+
+    The lag is in seconds. Returns None if we don't know how to measure it.
+    """
+    if conn.dialect.name != 'postgresql':
+        return None
+    if conn.dialect.server_version_info >= (10,):
+        receive, replay = 'pg_last_wal_receive_lsn', 'pg_last_wal_replay_lsn'
+    else:
+        receive, replay = ('pg_last_xlog_receive_location',
+                           'pg_last_xlog_replay_location')
+    # If the replica has replayed everything it has received, it isn't
+    # behind, even if the primary has been idle for a while (which would
+    # otherwise show up as an ever-increasing lag):
+    return conn.execute(
+        'SELECT CASE'
+        ' WHEN NOT pg_is_in_recovery() THEN 0'
+        ' WHEN %s() = %s() THEN 0'
+        ' ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'
+        ' END' % (receive, replay)
+    ).scalar()
+
+
+def _apply_sqlite_profile(config, dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=%s' % config['IB2_SQLITE_SYNCHRONOUS'])
+    cursor.execute('PRAGMA cache_size=%d' % config['IB2_SQLITE_CACHE_SIZE'])
+    cursor.execute('PRAGMA mmap_size=%d' % config['IB2_SQLITE_MMAP_SIZE'])
+    cursor.execute('PRAGMA busy_timeout=%d' %
+                   config['IB2_SQLITE_BUSY_TIMEOUT'])
+    cursor.close()
+
+
+def _set_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
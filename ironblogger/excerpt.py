@@ -0,0 +1,112 @@
+"""Excerpts of post summaries, for the listing pages.
+
+Summaries can be whole posts, and the listing pages (``/posts`` and
+``/rss``) show dozens of them at a time. Instead, they show an excerpt:
+the start of the summary, cut off after `EXCERPT_LENGTH` characters of
+text. Excerpts are computed once, when the summary is stored (see
+`ironblogger.model.Post`).
+
+The summary has already been sanitized, so all `make_excerpt` has to do is
+cut it off without breaking the markup: tags left open at the cut are
+closed, and nothing is cut in the middle of a tag or an entity.
+"""
+from six.moves.html_parser import HTMLParser
+
+# Characters of text to keep. Changing this only affects posts stored (or
+# updated) afterwards:
+EXCERPT_LENGTH = 500
+
+ELLIPSIS = u'\u2026'
+
+# Elements which have no end tag:
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+class _Truncator(HTMLParser):
+
+    def __init__(self, length):
+        try:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        except TypeError:
+            # Python 2 never converts them:
+            HTMLParser.__init__(self)
+        self.remaining = length
+        self.truncated = False
+        self.out = []
+        self.open_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.truncated:
+            return
+        self.out.append(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.truncated:
+            self.out.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self.truncated or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.out.append('</%s>' % open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.truncated:
+            return
+        # Trailing whitespace doesn't need cutting off:
+        if len(data.rstrip()) <= self.remaining:
+            self.out.append(data)
+            self.remaining -= min(len(data), self.remaining)
+            return
+        cut = data[:self.remaining]
+        # Don't cut a word in half, if we can help it:
+        if not data[self.remaining].isspace() and ' ' in cut:
+            cut = cut[:cut.rindex(' ')]
+        self.out.append(cut.rstrip() + ELLIPSIS)
+        self._truncate()
+
+    def _entity(self, text):
+        if self.truncated:
+            return
+        if self.remaining == 0:
+            self.out.append(ELLIPSIS)
+            self._truncate()
+            return
+        self.out.append(text)
+        self.remaining -= 1
+
+    def handle_entityref(self, name):
+        self._entity('&%s;' % name)
+
+    def handle_charref(self, name):
+        self._entity('&#%s;' % name)
+
+    def _truncate(self):
+        self.truncated = True
+        while self.open_tags:
+            self.out.append('</%s>' % self.open_tags.pop())
+
+
+def make_excerpt(html, length=EXCERPT_LENGTH):
+    """Return the start of ``html``, with at most ``length`` characters of
+    text (entities count as one).
+
+    If the text is no longer than that, ``html`` is returned unchanged.
+    Otherwise, it's cut off (at a word boundary, where possible), an
+    ellipsis is appended, and any tags still open are closed. Comments and
+    the like are dropped.
+    """
+    truncator = _Truncator(length)
+    truncator.feed(html)
+    truncator.close()
+    if not truncator.truncated:
+        return html
+    return u''.join(truncator.out)
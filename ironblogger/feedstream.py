@@ -0,0 +1,447 @@
+"""Incremental parsing of feeds, as they're downloaded.
+
+`feedparser.parse` reads the whole document, then builds every entry, with
+all of its content, before we see the first one. For multi-megabyte
+full-content feeds, that's a lot of memory for entries we mostly already
+have, or which are too old to count for anything. This module parses the
+common cases -- RSS 2.0 and Atom 1.0 -- with expat, a chunk at a time, and
+hands back one entry at a time, so the caller can stop reading as soon as
+it has seen enough (see `ironblogger.fetch.stream_feed`).
+
+Entries come out in the same shape feedparser gives them, with links and
+ids resolved, and HTML content sanitized, by the same (private) feedparser
+functions, so the posts they make are the same whichever parser was used.
+Anything this module doesn't handle -- other formats, DOCTYPEs (and so
+entity declarations), undeclared entities, inline XHTML content, unusual
+encodings, malformed XML -- raises `UnsupportedFeedError`, and the caller
+falls back to feedparser. The raw body is kept in a spool as it's read
+(see `BodyReader`), so falling back doesn't mean downloading it again.
+"""
+import re
+import tempfile
+import time
+import zlib
+from xml.parsers import expat
+
+import feedparser
+import six
+
+# Bytes to read from the network at a time:
+CHUNK_SIZE = 64 * 1024
+# Bodies bigger than this are spooled to disk, rather than kept in memory:
+SPOOL_MEMORY = 512 * 1024
+
+ATOM = 'http://www.w3.org/2005/Atom'
+CONTENT = 'http://purl.org/rss/1.0/modules/content/'
+DC = 'http://purl.org/dc/elements/1.1/'
+XML_BASE = 'http://www.w3.org/XML/1998/namespace base'
+
+# Element names are "<namespace> <local name>" (or just the local name, for
+# elements with no namespace); these map the entry's children to the
+# feedparser keys they fill in:
+RSS_FIELDS = {
+    'title': 'title',
+    'link': 'link',
+    'guid': 'id',
+    'pubDate': 'published',
+    DC + ' date': 'updated',
+    'description': 'summary',
+    CONTENT + ' encoded': 'content',
+}
+ATOM_FIELDS = {
+    ATOM + ' title': 'title',
+    ATOM + ' id': 'id',
+    ATOM + ' published': 'published',
+    ATOM + ' updated': 'updated',
+    ATOM + ' summary': 'summary',
+    ATOM + ' content': 'content',
+}
+# Fields whose content is text (possibly escaped HTML), and mustn't contain
+# elements:
+TEXT_FIELDS = ('title', 'summary', 'content')
+DATE_FIELDS = ('published', 'updated')
+
+HTML_TYPES = (u'text/html', u'application/xhtml+xml')
+
+# Charsets (from the Content-Type header) which mean the same thing to
+# expat and to feedparser:
+SAFE_CHARSETS = ('', 'utf-8', 'utf8', 'us-ascii', 'ascii')
+
+
+class UnsupportedFeedError(Exception):
+    """Raised if a feed can't be parsed incrementally."""
+
+
+class FeedTooLargeError(Exception):
+    """Raised if a feed is larger than the configured maximum."""
+
+
+class BodyReader(object):
+    """Reads the body of a downloaded feed, a chunk at a time.
+
+    ``resource`` is as returned by ``feedparser._open_resource``. At most
+    ``max_size`` bytes are read; past that, `read` raises
+    `FeedTooLargeError`. A copy of everything read is kept, so the whole
+    body can be had from `read_all`, however much was read already.
+
+    If ``timer`` is not None, it's called to get a context manager around
+    each read from the network. ``size`` is the number of bytes read so
+    far, and ``duration`` the time spent reading them.
+    """
+
+    def __init__(self, resource, max_size, timer=None):
+        self.resource = resource
+        self.max_size = max_size
+        self.size = 0
+        self.duration = 0.0
+        self._timer = timer
+        self._spool = tempfile.SpooledTemporaryFile(SPOOL_MEMORY)
+        self._eof = False
+
+    def read(self, size=CHUNK_SIZE):
+        """Read and return the next chunk; returns an empty string at the
+        end of the body."""
+        if self._eof:
+            return b''
+        if self.max_size is not None:
+            # One byte past the limit is enough to know we're over it:
+            size = min(size, self.max_size + 1 - self.size)
+        start = time.time()
+        if self._timer is None:
+            chunk = self.resource.read(size)
+        else:
+            with self._timer():
+                chunk = self.resource.read(size)
+        self.duration += time.time() - start
+        if not chunk:
+            self._eof = True
+            return b''
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise FeedTooLargeError('Feed is larger than %d bytes' %
+                                    self.max_size)
+        self._spool.write(chunk)
+        return chunk
+
+    def read_all(self):
+        """Read the rest of the body, and return all of it."""
+        while self.read():
+            pass
+        self._spool.seek(0)
+        return self._spool.read()
+
+    def close(self):
+        self._spool.close()
+
+
+def _decoded_chunks(reader, headers):
+    """Yield the chunks of ``reader``'s body, decompressed if need be."""
+    encoding = headers.get('content-encoding', '')
+    if 'gzip' in encoding:
+        # 16 + MAX_WBITS tells zlib to expect a gzip header:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif 'deflate' in encoding:
+        # Servers disagree on whether this has a zlib header; leave the
+        # guessing to feedparser:
+        raise UnsupportedFeedError('deflate-encoded feed')
+    else:
+        decompressor = None
+    size = 0
+    while True:
+        data = reader.read()
+        if not data:
+            break
+        while data:
+            if decompressor is None:
+                chunk, data = data, b''
+            else:
+                # A small body can decompress to a huge one, so we never
+                # ask for more than one byte past the limit at a time:
+                limit = 0
+                if reader.max_size is not None:
+                    limit = reader.max_size + 1 - size
+                try:
+                    chunk = decompressor.decompress(data, limit)
+                except zlib.error as e:
+                    raise UnsupportedFeedError('bad gzip data: %s' % e)
+                data = decompressor.unconsumed_tail
+            size += len(chunk)
+            if reader.max_size is not None and size > reader.max_size:
+                raise FeedTooLargeError('Feed is larger than %d bytes' %
+                                        reader.max_size)
+            if chunk:
+                yield chunk
+
+
+def _headers(resource):
+    if not hasattr(resource, 'headers'):
+        return {}
+    return dict((k.lower(), v) for k, v in dict(resource.headers).items())
+
+
+def _charset(content_type):
+    match = re.search(r'charset\s*=\s*["\']?([^"\';\s]+)', content_type, re.I)
+    return match.group(1).lower() if match else ''
+
+
+def start(resource):
+    """Return the feedparser-style result for ``resource``, before any of
+    its entries have been read.
+
+    This has everything feedparser would put in its result, except the
+    entries (and the feed's ``links``, and ``version``, which are filled
+    in by `entries` as they're seen).
+    """
+    result = feedparser.FeedParserDict()
+    result['feed'] = feedparser.FeedParserDict(links=[])
+    result['entries'] = []
+    result['bozo'] = 0
+    headers = _headers(resource)
+    if hasattr(resource, 'headers'):
+        result['headers'] = dict(resource.headers)
+    if headers.get('etag'):
+        result['etag'] = headers['etag'].decode('utf-8', 'ignore') \
+            if isinstance(headers['etag'], bytes) else headers['etag']
+    if headers.get('last-modified'):
+        result['modified'] = headers['last-modified']
+        result['modified_parsed'] = \
+            feedparser._parse_date(headers['last-modified'])
+    if hasattr(resource, 'url'):
+        url = resource.url
+        result['href'] = url.decode('utf-8', 'ignore') \
+            if isinstance(url, bytes) else url
+        result['status'] = 200
+    if hasattr(resource, 'status'):
+        result['status'] = resource.status
+    return result
+
+
+def entries(result, resource, reader):
+    """Parse the body of ``resource`` incrementally, yielding its entries.
+
+    ``result`` is as returned by `start`; its ``version`` and the feed's
+    ``links`` are filled in along the way. ``reader`` is a `BodyReader`
+    for ``resource``. Raises `UnsupportedFeedError` if the feed should be
+    parsed by feedparser instead.
+    """
+    headers = _headers(resource)
+    if result.get('status', 200) >= 300:
+        raise UnsupportedFeedError('HTTP status %d' % result['status'])
+    if _charset(headers.get('content-type', '')) not in SAFE_CHARSETS:
+        raise UnsupportedFeedError('charset %r' %
+                                   _charset(headers['content-type']))
+    href = result.get('href', u'')
+    contentloc = headers.get('content-location', u'')
+    base = feedparser._makeSafeAbsoluteURI(href, contentloc) or \
+        feedparser._makeSafeAbsoluteURI(contentloc) or href
+    parser = _StreamParser(base, result)
+    for chunk in _decoded_chunks(reader, headers):
+        for entry in parser.feed(chunk):
+            yield entry
+    for entry in parser.close():
+        yield entry
+
+
+class _StreamParser(object):
+    """Turns expat's callbacks into a list of finished entries per chunk."""
+
+    def __init__(self, base, result):
+        self._result = result
+        self._parser = expat.ParserCreate(namespace_separator=' ')
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._chars
+        self._parser.StartDoctypeDeclHandler = self._doctype
+        self._parser.EntityDeclHandler = self._doctype
+        self._stack = []
+        self._bases = [base]
+        self._fields = None
+        self._entry = None
+        self._field = None
+        self._done = []
+
+    def feed(self, chunk):
+        return self._parse(chunk, False)
+
+    def close(self):
+        return self._parse(b'', True)
+
+    def _parse(self, chunk, final):
+        try:
+            self._parser.Parse(chunk, final)
+        except expat.ExpatError as e:
+            raise UnsupportedFeedError('XML error: %s' % e)
+        done, self._done = self._done, []
+        return done
+
+    def _doctype(self, *args):
+        raise UnsupportedFeedError('feed has a DOCTYPE')
+
+    def _start(self, name, attrs):
+        depth = len(self._stack)
+        self._stack.append(name)
+        base = self._bases[-1]
+        if XML_BASE in attrs:
+            base = feedparser._urljoin(base, attrs[XML_BASE])
+        self._bases.append(base)
+
+        if depth == 0:
+            if name == 'rss':
+                self._result['version'] = u'rss20'
+                self._fields = RSS_FIELDS
+            elif name == ATOM + ' feed':
+                self._result['version'] = u'atom10'
+                self._fields = ATOM_FIELDS
+            else:
+                raise UnsupportedFeedError('root element %r' % name)
+            return
+
+        if self._entry is None:
+            if self._is_entry(name, depth):
+                self._entry = feedparser.FeedParserDict(links=[])
+                self._entry_depth = depth
+            elif self._is_feed_link(name, depth):
+                self._result['feed']['links'].append(self._link(attrs, base))
+            return
+
+        if self._field is not None:
+            if self._field['key'] in TEXT_FIELDS:
+                raise UnsupportedFeedError('markup in <%s>' % self._field['key'])
+            return
+        if depth != self._entry_depth + 1:
+            return
+        if name == ATOM + ' link':
+            link = self._link(attrs, base)
+            self._entry['links'].append(link)
+            if link['rel'] == u'alternate' and 'href' in link and \
+                    link['type'].lower() in HTML_TYPES:
+                self._entry['link'] = link['href']
+            return
+        key = self._fields.get(name)
+        if key is None:
+            return
+        self._field = {
+            'key': key,
+            'depth': depth,
+            'base': base,
+            'type': self._content_type(key, attrs),
+            'permalink': attrs.get('isPermaLink', 'true') == 'true',
+            'parts': [],
+        }
+
+    def _is_entry(self, name, depth):
+        if self._fields is RSS_FIELDS:
+            return name == 'item' and depth == 2 and \
+                self._stack[1] == 'channel'
+        return name == ATOM + ' entry' and depth == 1
+
+    def _is_feed_link(self, name, depth):
+        if name != ATOM + ' link':
+            return False
+        if self._fields is RSS_FIELDS:
+            return depth == 2 and self._stack[1] == 'channel'
+        return depth == 1
+
+    def _link(self, attrs, base):
+        link = feedparser.FeedParserDict(attrs)
+        link.setdefault('rel', u'alternate')
+        if link['rel'] == u'self':
+            link.setdefault('type', u'application/atom+xml')
+        else:
+            link.setdefault('type', u'text/html')
+        if 'href' in link:
+            link['href'] = feedparser._urljoin(base, link['href'])
+        return link
+
+    def _content_type(self, key, attrs):
+        if key not in TEXT_FIELDS:
+            return None
+        if 'mode' in attrs or 'src' in attrs:
+            raise UnsupportedFeedError('out-of-line or encoded content')
+        if self._fields is RSS_FIELDS:
+            # feedparser's defaults; RSS has no type attribute:
+            return u'text/plain' if key == 'title' else u'text/html'
+        mimetype = attrs.get('type', u'text').lower()
+        mimetype = {u'text': u'text/plain',
+                    u'html': u'text/html'}.get(mimetype, mimetype)
+        if mimetype not in (u'text/plain', u'text/html'):
+            raise UnsupportedFeedError('%s content in <%s>' % (mimetype, key))
+        return mimetype
+
+    def _chars(self, data):
+        if self._field is not None and \
+                len(self._stack) == self._field['depth'] + 1:
+            self._field['parts'].append(data)
+
+    def _end(self, name):
+        depth = len(self._stack) - 1
+        self._stack.pop()
+        self._bases.pop()
+        if self._field is not None and depth == self._field['depth']:
+            self._finish_field(self._field)
+            self._field = None
+        elif self._entry is not None and depth == self._entry_depth:
+            self._done.append(self._entry)
+            self._entry = None
+
+    def _finish_field(self, field):
+        entry = self._entry
+        key = field['key']
+        value = u''.join(field['parts']).strip()
+        if key == 'link':
+            value = feedparser._urljoin(field['base'], value)
+            # feedparser undoes a common mangling of query strings:
+            entry['link'] = re.sub('&([A-Za-z0-9_]+);', r'&\g<1>', value)
+        elif key == 'id':
+            entry['id'] = feedparser._urljoin(field['base'], value) \
+                if value else value
+            if self._fields is RSS_FIELDS and field['permalink']:
+                # Like feedparser, a permalink guid stands in for a missing
+                # <link>:
+                entry.setdefault('link', entry['id'])
+        elif key in DATE_FIELDS:
+            entry[key] = value
+            entry[key + '_parsed'] = feedparser._parse_date(value)
+        else:
+            self._finish_text(entry, key, value, field)
+
+    def _finish_text(self, entry, key, value, field):
+        mimetype = field['type']
+        if key == 'title' and self._fields is RSS_FIELDS and \
+                feedparser._FeedParserMixin.lookslikehtml(value):
+            mimetype = u'text/html'
+        if mimetype in HTML_TYPES:
+            value = feedparser._resolveRelativeURIs(value, field['base'],
+                                                    'utf-8', mimetype)
+            value = feedparser._sanitizeHTML(value, 'utf-8', mimetype)
+            if not isinstance(value, six.text_type):
+                value = value.decode('utf-8', 'ignore')
+        value = _fix_encoding(value)
+        detail = feedparser.FeedParserDict(type=mimetype,
+                                           base=field['base'],
+                                           language=None,
+                                           value=value)
+        if key == 'title':
+            entry['title'] = value
+            entry['title_detail'] = detail
+            return
+        if 'summary' not in entry:
+            # As far as feedparser is concerned, whichever of the summary
+            # and the content comes first is the summary:
+            entry['summary'] = value
+            entry['summary_detail'] = detail
+        if key == 'content' or entry['summary_detail'] is not detail:
+            entry.setdefault('content', []).append(detail)
+
+
+def _fix_encoding(value):
+    """Apply the clean-ups feedparser applies to all text."""
+    # Text which was UTF-8, but was decoded as ISO-8859-1 somewhere along
+    # the way:
+    try:
+        value = value.encode('iso-8859-1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        pass
+    # Windows-1252 characters in the C1 control range:
+    return value.translate(feedparser._cp1252)
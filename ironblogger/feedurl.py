@@ -0,0 +1,36 @@
+"""Spotting blogs which share a feed.
+
+Several blogs may use the same feed (e.g. group blogs), maybe spelled
+slightly differently. `normalize_feed_url` gives the canonical form used to
+tell them apart, and `feed_hash` a number derived from it, which is stored
+on each `ironblogger.model.Blog`, so that the blogs sharing a feed can be
+found, and the feeds split between hosts, in SQL.
+"""
+import zlib
+
+from six.moves.urllib.parse import urlsplit, urlunsplit
+
+
+def normalize_feed_url(url):
+    """Return a canonical form of ``url``, for spotting shared feeds.
+
+    The scheme and host are case-insensitive, default ports are redundant,
+    and the fragment is never sent to the server, so urls differing only
+    in those ways are the same feed.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    for default_scheme, default_port in ('http', ':80'), ('https', ':443'):
+        if scheme == default_scheme and netloc.endswith(default_port):
+            netloc = netloc[:-len(default_port)]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def feed_hash(url):
+    """Return a hash of the normalized form of ``url``.
+
+    It's a non-negative 31-bit integer, so it fits in an ``Integer`` column
+    on any database. Different feeds may (rarely) have the same hash.
+    """
+    return zlib.crc32(normalize_feed_url(url).encode('utf-8')) & 0x7fffffff
@@ -0,0 +1,668 @@
+# Copyright 2014-2015 Ian Denhardt <ian@zenhack.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+"""Downloading and parsing feeds.
+
+This is the part of syncing that talks to the outside world: fetching each
+blog's feed, turning its entries into `Post`s, and storing new and updated
+posts. It's only used by the tasks, so it's kept out of `model` -- the web
+app never needs to import feedparser.
+
+Blogs sometimes share a feed (group blogs, someone registered twice,
+planet-style aggregators). Blogs are grouped by their normalized feed url
+(`group_by_feed`), and each feed is downloaded and parsed once, with the
+resulting posts going to every blog in the group (`fetch_feed`). The
+ETag/Last-Modified headers are likewise kept per url, in `Feed`.
+
+Feeds which advertise a WebSub hub also have their content pushed to us
+(see `ironblogger.websub`); that content is stored by `ingest_pushed`, in
+the same way. Such feeds are only polled occasionally (see
+`ironblogger.websub.polling_due`).
+
+Feeds are parsed as they're downloaded (`stream_feed`, and see
+`ironblogger.feedstream`), and only as much is read as we need: posts
+which are too old to count for any round aren't stored (see
+`assignable_since`), and since feeds list their newest entries first,
+reading stops at the first such entry. Feeds the streaming parser can't
+handle are parsed by feedparser instead.
+
+These config options control downloads:
+
+    IB2_FETCH_STREAMING    - Parse feeds as they're downloaded. If False,
+                             each feed is downloaded in full and parsed
+                             by feedparser.
+    IB2_FETCH_MAX_SIZE     - Feeds are cut off after this many bytes.
+
+With thousands of blogs, fetching them all from one host takes a long time,
+so the work can be split between several hosts sharing a database, in
+either (or both) of two ways:
+
+* Sharding: `shard_filter` splits the blogs into N fixed groups, by a hash
+  of their feed url (`Blog.feed_hash`), so that blogs sharing a feed are in
+  the same group. Each host fetches
+  one group. This is deterministic and costs nothing,
+  but if a host dies, its group doesn't get fetched.
+* Leases: each host repeatedly claims a batch of blogs which are due to be
+  fetched (`claim_blogs`), fetches them, and releases them. Blogs sharing a
+  feed are claimed together. A claim is a
+  conditional UPDATE, so two hosts can never hold the same blog, and it
+  works the same on PostgreSQL and SQLite. Claims expire, so blogs claimed
+  by a host which died are picked up by the others.
+
+The following config options control leases:
+
+    IB2_FETCH_MIN_INTERVAL - A blog isn't due to be fetched again until
+                             this many seconds after its last fetch.
+    IB2_FETCH_LEASE_TIME   - Seconds until a claim expires. Each claim is
+                             renewed as we get to each blog in the batch.
+    IB2_FETCH_LEASE_BATCH  - Number of blogs to claim at a time.
+
+Lease expiry is judged by each host's clock, so hosts should keep their
+clocks in sync (e.g. with NTP).
+"""
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+import feedparser
+import jinja2
+from sqlalchemy import and_, or_, func
+
+from . import metrics
+from .app import app
+from .date import duedate, duedate_seek, to_dbtime, from_dbtime, \
+    from_feedtime
+from .feedurl import normalize_feed_url
+from .feedstream import BodyReader, FeedTooLargeError, UnsupportedFeedError
+from . import feedstream
+from .model import db, Blog, Blogger, Feed, Post, stage_timer
+from .websub import discover_hub, polling_due
+
+app.config.setdefault('IB2_FETCH_MIN_INTERVAL', 5 * 60)
+app.config.setdefault('IB2_FETCH_LEASE_TIME', 10 * 60)
+app.config.setdefault('IB2_FETCH_LEASE_BATCH', 10)
+app.config.setdefault('IB2_FETCH_STREAMING', True)
+app.config.setdefault('IB2_FETCH_MAX_SIZE', 10 * 1024 * 1024)
+
+feedparser.USER_AGENT = \
+        'IronBlogger/git ' + \
+        '+https://github.com/zenhack/iron-blogger2 ' + \
+        feedparser.USER_AGENT
+
+
+class MalformedPostError(Exception):
+    """Raised when parsing a post fails."""
+
+
+class DownloadedFeed(object):
+    """A feed which has already been downloaded.
+
+    feedparser.parse accepts any object with a ``read`` method, and looks at
+    the same attributes a urllib2 response has (headers, url, status, code).
+    Handing it one of these lets us time (and measure) the download
+    separately from the parsing, without changing what the parser sees.
+
+    If ``error`` is not None, ``read`` raises it, so feedparser reports it
+    just as it would have if it had done the download itself. ``size`` is
+    the length of the body, or None if the download failed.
+    """
+
+    def __init__(self, resource=None, data=None, error=None):
+        self._data = data
+        self._error = error
+        self.size = None if data is None else len(data)
+        for attr in 'headers', 'url', 'status', 'code':
+            if hasattr(resource, attr):
+                setattr(self, attr, getattr(resource, attr))
+
+    def read(self):
+        if self._error is not None:
+            raise self._error
+        return self._data
+
+
+def _open_resource(url, etag, modified):
+    # XXX: _open_resource is private to feedparser, like _sanitizeHTML
+    # (see sanitize_summary), and is covered by the same version pin.
+    # These are the arguments feedparser.parse passes it by default:
+    return feedparser._open_resource(url, etag, modified, None, None, [], {})
+
+
+def _close(resource):
+    if hasattr(resource, 'close'):
+        resource.close()
+
+
+def download_feed(url, etag, modified):
+    """Download the feed at ``url``, returning a `DownloadedFeed`.
+
+    Feeds bigger than ``IB2_FETCH_MAX_SIZE`` bytes fail to download.
+    """
+    try:
+        resource = _open_resource(url, etag, modified)
+        reader = BodyReader(resource, app.config['IB2_FETCH_MAX_SIZE'])
+        try:
+            data = reader.read_all()
+        finally:
+            reader.close()
+            _close(resource)
+    except Exception as e:
+        return DownloadedFeed(error=e)
+    return DownloadedFeed(resource, data)
+
+
+def stream_feed(url, etag, modified, since, run=None):
+    """Download and parse the feed at ``url``, a chunk at a time.
+
+    Returns a tuple ``(downloaded, feed, duration)``: the download (only
+    its ``size`` is of interest), the parsed feed, as `feedparser.parse`
+    would return it, and the time spent downloading, in seconds.
+
+    Only the entries published since ``since`` (a naive UTC datetime) are
+    kept; once the feed reaches an older entry, it's read no further,
+    unless its entries aren't in order, newest first. A feed bigger than
+    ``IB2_FETCH_MAX_SIZE`` bytes is cut off there, keeping the entries
+    read so far. Feeds `ironblogger.feedstream` can't handle are parsed by
+    feedparser instead, as a whole.
+
+    If ``run`` is not None, time spent downloading and parsing is recorded
+    there.
+    """
+    start = time.time()
+    try:
+        with stage_timer(run, 'fetch'):
+            resource = _open_resource(url, etag, modified)
+    except Exception as e:
+        downloaded = DownloadedFeed(error=e)
+        with stage_timer(run, 'parse'):
+            feed = feedparser.parse(downloaded)
+        return downloaded, feed, time.time() - start
+    opened = time.time() - start
+    reader = BodyReader(resource, app.config['IB2_FETCH_MAX_SIZE'],
+                        timer=lambda: stage_timer(run, 'fetch'))
+    try:
+        with stage_timer(run, 'parse'):
+            feed = feedstream.start(resource)
+            if feed.get('status') == 304:
+                return reader, feed, opened
+            try:
+                _read_entries(feed,
+                              feedstream.entries(feed, resource, reader),
+                              since)
+            except UnsupportedFeedError as e:
+                logging.info('Parsing feed %r with feedparser: %s', url, e)
+                try:
+                    downloaded = DownloadedFeed(resource, reader.read_all())
+                except FeedTooLargeError as e:
+                    downloaded = DownloadedFeed(error=e)
+                feed = feedparser.parse(downloaded)
+                return downloaded, feed, opened + reader.duration
+            except FeedTooLargeError as e:
+                logging.info('Feed %r was cut off: %s', url, e)
+                feed['bozo'] = 1
+                feed['bozo_exception'] = e
+    finally:
+        reader.close()
+        _close(resource)
+    return reader, feed, opened + reader.duration
+
+
+def _read_entries(feed, entries, since):
+    # We only stop early once the entries we've kept show the feed is in
+    # order; a feed whose first entry is old may just be in some other
+    # order.
+    newest_first = True
+    previous = None
+    for entry in entries:
+        try:
+            published = to_dbtime(_get_pub_date(entry))
+        except MalformedPostError:
+            # post_from_feed_entry will complain about it:
+            feed.entries.append(entry)
+            continue
+        if previous is not None and published > previous:
+            newest_first = False
+        previous = published
+        if published >= since:
+            feed.entries.append(entry)
+        elif newest_first and len(feed.entries) > 0:
+            # The rest are older still:
+            return
+
+
+def group_by_feed(blogs):
+    """Group ``blogs`` by their normalized feed url.
+
+    Returns a list of ``(url, blogs)`` pairs, in the order each url first
+    appears in ``blogs``.
+    """
+    groups = {}
+    order = []
+    for blog in blogs:
+        url = normalize_feed_url(blog.feed_url)
+        if url not in groups:
+            groups[url] = []
+            order.append(url)
+        groups[url].append(blog)
+    return [(url, groups[url]) for url in order]
+
+
+def _feed_state(url):
+    feed = db.session.query(Feed).filter_by(url=url).first()
+    if feed is None:
+        feed = Feed(url=url)
+        db.session.add(feed)
+    return feed
+
+
+def fetch_blog(blog, run=None):
+    """Download ``blog``'s feed, and store any new or updated posts.
+
+    This is `fetch_feed` for a feed with a single blog.
+    """
+    fetch_feed([blog], run)
+
+
+def fetch_feed(blogs, run=None):
+    """Download the feed shared by ``blogs``, and store any new or updated
+    posts for each of them.
+
+    The blogs' feed urls should all normalize to the same url (see
+    `group_by_feed`). The feed is downloaded and parsed only once.
+
+    If ``run`` is not None, it should be the `SyncRun` in progress; the
+    time spent in each stage, and the outcome of the download, are
+    recorded there.
+    """
+    first = blogs[0]
+    logging.info('Syncing posts for blog %r by %r%s',
+                 first.title,
+                 first.blogger.name,
+                 ' (and %d others sharing its feed)' % (len(blogs) - 1)
+                 if len(blogs) > 1 else '')
+    now = datetime.utcnow()
+    state = _feed_state(normalize_feed_url(first.feed_url))
+    # The caching info only tells us what the blogs which were fetched
+    # along with it have seen. Usually that's every blog using the feed,
+    # but if some of them are being fetched without the others (e.g. the
+    # others were claimed by another host), a 304 wouldn't mean those
+    # have all of the posts. So we only make a conditional request when
+    # every blog using the feed is here, and has been fetched before, and
+    # only save the caching info from the response when they're all here.
+    members = set(blog for blog in state.blogs
+                  if normalize_feed_url(blog.feed_url) == state.url)
+    complete = members.issubset(blogs)
+    if members == set(blogs) and \
+            all(blog.last_fetched is not None for blog in blogs):
+        etag, modified = state.etag, state.modified
+    else:
+        etag, modified = None, None
+    since = assignable_since(blogs)
+    for blog in blogs:
+        blog.last_fetched = now
+        blog.feed = state
+
+    if app.config['IB2_FETCH_STREAMING']:
+        downloaded, feed, duration = stream_feed(
+            first.feed_url, etag, modified, min(since.values()), run)
+    else:
+        start = time.time()
+        with stage_timer(run, 'fetch'):
+            downloaded = download_feed(first.feed_url, etag, modified)
+        duration = time.time() - start
+        with stage_timer(run, 'parse'):
+            feed = feedparser.parse(downloaded)
+    metrics.feeds_fetched.inc()
+    if hasattr(feed, 'status') and feed.status == 304:
+        logging.info('Feed for blog %r (by %r) was not modified.',
+                     first.title,
+                     first.blogger.name)
+        metrics.feeds_not_modified.inc()
+    elif feed.bozo and not feed.entries:
+        logging.info('Could not parse feed for blog %r (by %r): %s',
+                     first.title,
+                     first.blogger.name,
+                     feed.get('bozo_exception'))
+        metrics.parse_failures.inc()
+    elif feed.get('status', 200) < 300:
+        _discover_hub(state, feed, first.feed_url)
+
+    fetches = []
+    if run is not None:
+        fetches = run.record_fetch(blogs, duration, downloaded, feed)
+
+    try:
+        _store_entries(blogs, feed, since, run)
+    except MalformedPostError as e:
+        if run is not None:
+            for fetch in fetches:
+                fetch.error = str(e)
+            run.parse_errors += 1
+        raise
+    with stage_timer(run, 'upsert'):
+        if complete:
+            _update_caching_info(state, feed)
+        db.session.commit()
+
+
+def ingest_pushed(state, body):
+    """Store the posts in ``body``, the content a WebSub hub pushed to us
+    for the `Feed` ``state``.
+
+    The posts go to every blog using the feed, just as if it had been
+    fetched by `fetch_feed`. Hubs usually push only the new or changed
+    entries; that's fine, since existing posts are never deleted.
+    """
+    blogs = list(state.blogs)
+    if not blogs:
+        return
+    logging.info('Received pushed content for feed %r', state.url)
+    feed = feedparser.parse(DownloadedFeed(data=body))
+    if feed.bozo and not feed.entries:
+        logging.info('Could not parse pushed content for feed %r: %s',
+                     state.url, feed.get('bozo_exception'))
+        metrics.parse_failures.inc()
+        return
+    try:
+        _store_entries(blogs, feed, assignable_since(blogs))
+    except MalformedPostError as e:
+        logging.info('%s', e)
+        metrics.parse_failures.inc()
+        db.session.rollback()
+        return
+    db.session.commit()
+
+
+def _store_entries(blogs, feed, since, run=None):
+    with stage_timer(run, 'parse'):
+        feed_posts = [post_from_feed_entry(entry, run)
+                      for entry in feed.entries]
+    with stage_timer(run, 'upsert'):
+        for i, blog in enumerate(blogs):
+            posts = [post for post in feed_posts
+                     if post.timestamp >= since[blog]]
+            # Each blog needs its own copies of the posts:
+            store_posts(blog, posts if i == 0 else
+                        [_copy_post(post) for post in posts])
+
+
+def assignable_since(blogs):
+    """Return a dict mapping each of ``blogs`` to the earliest time a post
+    to it could count for a round.
+
+    A post counts for the round it was published in, or a later one, and
+    none before the blogger's first round. `ironblogger.tasks.assign_rounds`
+    also ignores posts from before anyone's start date. Older posts will
+    never count for anything, so they aren't stored.
+    """
+    earliest = db.session.query(func.min(Blogger.start_date)).scalar()
+    since = {}
+    for blog in blogs:
+        start_date = blog.blogger.start_date
+        first_round = duedate_seek(duedate(from_dbtime(start_date)), -1)
+        since[blog] = max(to_dbtime(first_round),
+                          min(earliest or start_date, start_date))
+    return since
+
+
+def _discover_hub(state, feed, url):
+    hub, topic = None, url
+    for link in feed.feed.get('links', []):
+        if link.get('rel') == 'hub' and hub is None:
+            hub = link.get('href')
+        elif link.get('rel') == 'self':
+            topic = link.get('href') or topic
+    discover_hub(state, hub, topic)
+
+
+def _copy_post(post):
+    return Post(guid=post.guid,
+                timestamp=post.timestamp,
+                title=post.title,
+                summary_z=post.summary_z,
+                excerpt=post.excerpt,
+                page_url=post.page_url)
+
+
+def shard_filter(shard):
+    """Return a filter selecting the blogs in ``shard``.
+
+    ``shard`` is a pair ``(k, n)``; the blogs are split into ``n`` shards,
+    and this selects the ``k``th of them, counting from zero. Blogs are
+    split by `Blog.feed_hash`, so that blogs sharing a feed are always
+    fetched together.
+    """
+    k, n = shard
+    return Blog.feed_hash % n == k
+
+
+def lease_owner():
+    """Return a name for this process, to identify the leases it holds."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _claimable(now):
+    due = now - timedelta(seconds=app.config['IB2_FETCH_MIN_INTERVAL'])
+    return and_(or_(Blog.last_fetched == None, Blog.last_fetched < due),
+                or_(Blog.lease_expires == None, Blog.lease_expires < now),
+                polling_due(now))
+
+
+def claim_blogs(owner, shard=None):
+    """Claim a batch of blogs which are due to be fetched, for ``owner``.
+
+    Returns the list of blogs claimed, which is empty once there's nothing
+    left to do. If ``shard`` is not None, only blogs in that shard (see
+    `shard_filter`) are claimed.
+
+    Blogs sharing a feed are claimed together, so that the feed is only
+    downloaded once; a batch is ``IB2_FETCH_LEASE_BATCH`` feeds, so it may
+    have a few more blogs than that.
+    """
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=app.config['IB2_FETCH_LEASE_TIME'])
+    batch = app.config['IB2_FETCH_LEASE_BATCH']
+    while True:
+        feeds = db.session.query(Blog.feed_hash).filter(_claimable(now))
+        if shard is not None:
+            feeds = feeds.filter(shard_filter(shard))
+        feeds = [row[0] for row in
+                 feeds.group_by(Blog.feed_hash)
+                      .order_by(func.min(Blog.id))
+                      .limit(batch).all()]
+        if not feeds:
+            return []
+        # Each feed's blogs (there may be more than one feed with the same
+        # hash, but that's harmless):
+        candidates = db.session.query(Blog.id, Blog.feed_url)\
+            .filter(Blog.feed_hash.in_(feeds), _claimable(now))\
+            .order_by(Blog.id)
+        claimed = []
+        for url, rows in group_by_feed(candidates):
+            ids = [row.id for row in rows]
+            # Re-checking the condition in the UPDATE is what makes this
+            # safe: if someone else claimed a blog since we looked, its row
+            # doesn't match.
+            if db.session.query(Blog)\
+                    .filter(Blog.id.in_(ids), _claimable(now))\
+                    .update({'lease_owner': owner, 'lease_expires': expires},
+                            synchronize_session=False):
+                claimed.extend(ids)
+            db.session.commit()
+        if claimed:
+            return db.session.query(Blog)\
+                .filter(Blog.id.in_(claimed), Blog.lease_owner == owner)\
+                .order_by(Blog.id).all()
+        # Other hosts beat us to all of them; try the next ones.
+
+
+def renew_lease(blog, owner):
+    """Extend ``owner``'s claim on ``blog``.
+
+    Returns False if the claim has been lost (i.e. it expired, and another
+    host claimed the blog).
+    """
+    expires = datetime.utcnow() + \
+        timedelta(seconds=app.config['IB2_FETCH_LEASE_TIME'])
+    count = db.session.query(Blog)\
+        .filter(Blog.id == blog.id, Blog.lease_owner == owner)\
+        .update({'lease_expires': expires}, synchronize_session=False)
+    db.session.commit()
+    return count == 1
+
+
+def release_lease(blog, owner, fetched=True):
+    """Release ``owner``'s claim on ``blog``.
+
+    If ``fetched`` is true, the blog is marked as having been fetched, so
+    nobody claims it again until it's due. Otherwise, it's left for someone
+    else to pick up right away.
+    """
+    values = {'lease_owner': None, 'lease_expires': None}
+    if fetched:
+        values['last_fetched'] = datetime.utcnow()
+    db.session.query(Blog)\
+        .filter(Blog.id == blog.id, Blog.lease_owner == owner)\
+        .update(values, synchronize_session=False)
+    db.session.commit()
+
+
+def store_posts(blog, feed_posts):
+    """Add the posts in ``feed_posts`` to ``blog``.
+
+    Posts which are already in the database are updated instead.
+    """
+    for post in feed_posts:
+        # Check if the post is already in the db:
+        prev_version = db.session.query(Post).filter(or_(
+            # If any of the below attributes match a post already in
+            # the db, we consider it to be the same post. Note that
+            # guid can be NULL, so we need to check for that.
+            and_(Post.guid != None, Post.guid == post.guid),
+            Post.page_url == post.page_url,
+        )).filter(Post.blog_id == blog.id).first()
+
+        if prev_version is not None:
+            # Override the information in the previous version:
+            logging.info('Update existing post %r', post.page_url)
+            prev_version.title = post.title
+            prev_version.guid = post.guid
+            prev_version.page_url = post.page_url
+            prev_version.summary_z = post.summary_z
+            prev_version.excerpt = post.excerpt
+            metrics.posts_updated.inc()
+            continue
+
+        post.blog = blog
+        db.session.add(post)
+        logging.info('Added new post %r', post.page_url)
+        metrics.posts_inserted.inc()
+
+
+def _update_caching_info(state, feed):
+    if hasattr(feed, 'etag'):
+        state.etag = feed.etag
+    if hasattr(feed, 'modified'):
+        state.modified = feed.modified
+
+
+def _get_pub_date(feed_entry):
+    """Return a an arrow object for the post's publication date.
+
+    ``feed_entry`` should be a post object as returned by
+    ``feedparser.parse``.
+
+    If the post does not have a publication date, raise a
+    ``MalformedPostError``.
+    """
+    for key in 'published', 'created', 'updated':
+        key += '_parsed'
+        if key in feed_entry and feed_entry[key] is not None:
+            return from_feedtime(feed_entry[key])
+    raise MalformedPostError("No valid publication date in post: %r" %
+                             feed_entry)
+
+
+def post_from_feed_entry(entry, run=None):
+    """Read and construct Post object from ``entry``.
+
+    ``entry`` should be a post object as returned by ``feedparser.parse``.
+    If ``run`` is not None, the time spent sanitizing the summary is
+    recorded there (see `SyncRun`).
+
+    If the post is invalid, raise a ``MalformedPostError`.
+
+    This leaves the `blog` field emtpy; this must be filled in before the
+    post is added to the database.
+    """
+    for field in 'title', 'summary', 'link':
+        if field not in entry:
+            raise MalformedPostError("Post has no %s: %r" % (field, entry))
+    post = Post()
+    post.timestamp = to_dbtime(_get_pub_date(entry))
+    post.title = entry['title']
+    if hasattr(entry, 'id'):
+        post.guid = entry.id
+
+    # The summary detail attribute lets us find the mime type of the
+    # summary. feedparser doesn't escape it if it's text/plain, so we need
+    # to do it ourselves. Unfortunately, there's a bug (likely #412) in
+    # feedparser, and sometimes this attribute is unavailable. If it's
+    # there, great, use it. Otherwise, we'll just assume it's html, and
+    # sanitize it ourselves.
+    with stage_timer(run, 'sanitize'):
+        sanitize_summary(post, entry)
+    post.page_url = entry['link']
+
+    return post
+
+
+def sanitize_summary(post, entry):
+    """Set ``post``'s summary to the sanitized summary of ``entry``.
+
+    The summary is only set once it's sanitized, since setting it also
+    compresses it and computes the excerpt.
+    """
+    summary = entry['summary']
+    if hasattr(entry, 'summary_detail'):
+        mimetype = entry.summary_detail.type
+    else:
+        mimetype = 'application/xhtml'
+        # Sanitize the html; who knows what feedparser did or didn't do.
+        # XXX: _sanitizeHTML is a private function to the feedparser
+        # library! unfortunately, we don't have many better options. This
+        # statement is the reason the version number for the feedparser
+        # dependency is fixed at 5.1.3; any alternate version will need to
+        # be vetted carefully, as by doing this we lose any api stability
+        # guarantees.
+        summary = unicode(feedparser._sanitizeHTML(
+            # _sanitizeHTML expects an encoding, so rather than do more
+            # guesswork than we alredy have...
+            summary.encode('utf-8'),
+            'utf-8',
+            # _sanitizeHTML is only ever called within the library with
+            # this value:
+            u'text/html',
+        ), 'utf-8')
+
+    if mimetype == 'text/plain':
+        # feedparser doesn't sanitize the summary if it's plain text, so we
+        # need to do it manually. We're using jijna2's autoscape feature
+        # for this, which feels like a bit of a hack to me (Ian), but it
+        # works -- there's probably a cleaner way to do this.
+        tmpl = jinja2.Template('{{ text }}', autoescape=True)
+        summary = tmpl.render(text=summary)
+    post.summary = summary
@@ -0,0 +1,148 @@
+"""Per-request instrumentation.
+
+We keep track of the following for each request:
+
+* The number of SQL statements executed, and the total time spent in them.
+* The time spent rendering templates (which includes any queries the
+  templates trigger, e.g. by following relationships).
+* The total time spent handling the request, and the size of the response
+  body.
+
+When ``IB2_INSTRUMENT`` is set, these are reported to the client in a
+``Server-Timing`` header (which browsers' developer tools know how to
+display), and logged as a line of JSON.
+
+When ``IB2_METRICS`` is set, the request latency and SQL time are also
+recorded in `ironblogger.metrics`, and served at ``/metrics``. That page
+has no access control, so it's off by default; when turning it on, keep
+it private (e.g. by having the front-end proxy refuse it).
+
+If a request executes more statements than its budget, a warning is logged;
+this is a cheap way to catch accidental N+1 query patterns. The budget is
+``IB2_QUERY_BUDGET``, unless overridden for a particular endpoint via the
+dictionary ``IB2_QUERY_BUDGETS``, e.g.:
+
+    IB2_QUERY_BUDGETS={'show_status': 50}
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+import flask
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+
+class Instrumentation(object):
+    """Flask extension recording per-request statistics."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('IB2_INSTRUMENT', False)
+        app.config.setdefault('IB2_QUERY_BUDGET', 25)
+        app.config.setdefault('IB2_QUERY_BUDGETS', {})
+        app.config.setdefault('IB2_METRICS', False)
+        app.config.setdefault('IB2_METRICS_FILE', None)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_execute)
+
+    def _stats(self):
+        """Return the stats for the current request, or None.
+
+        None is returned if both instrumentation and metrics are disabled, or if
+        we're not handling a request.
+        """
+        if not flask.has_request_context():
+            return None
+        return getattr(g, 'ib2_stats', None)
+
+    def before_request(self):
+        if self.app.config['IB2_INSTRUMENT'] or self.app.config['IB2_METRICS']:
+            g.ib2_stats = {
+                'start': time.time(),
+                'queries': 0,
+                'sql_time': 0.0,
+                'template_time': 0.0,
+            }
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager adding the time spent in its body to ``name``."""
+        stats = self._stats()
+        start = time.time()
+        try:
+            yield
+        finally:
+            if stats is not None:
+                stats[name] += time.time() - start
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        # The start time lives on the statement's execution context, so
+        # nothing is left behind if the statement fails:
+        if context is not None and self._stats() is not None:
+            context._ib2_query_start = time.time()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        stats = self._stats()
+        start = getattr(context, '_ib2_query_start', None)
+        if stats is None or start is None:
+            return
+        stats['queries'] += 1
+        stats['sql_time'] += time.time() - start
+
+    def after_request(self, response):
+        stats = self._stats()
+        if stats is None:
+            return response
+        total = time.time() - stats['start']
+        if self.app.config['IB2_METRICS']:
+            endpoint = request.endpoint or 'unknown'
+            metrics.request_latency.observe(total, endpoint=endpoint)
+            metrics.request_db_time.observe(stats['sql_time'],
+                                            endpoint=endpoint)
+        if not self.app.config['IB2_INSTRUMENT']:
+            return response
+
+        if response.direct_passthrough:
+            size = response.content_length
+        else:
+            size = len(response.get_data())
+
+        response.headers['Server-Timing'] = ', '.join([
+            'db;dur=%.1f;desc="%d queries"' % (stats['sql_time'] * 1000,
+                                               stats['queries']),
+            'tmpl;dur=%.1f' % (stats['template_time'] * 1000),
+            'total;dur=%.1f' % (total * 1000),
+        ])
+
+        record = {
+            'endpoint': request.endpoint,
+            'path': request.full_path,
+            'status': response.status_code,
+            'queries': stats['queries'],
+            'sql_ms': round(stats['sql_time'] * 1000, 1),
+            'template_ms': round(stats['template_time'] * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'size': size,
+        }
+        logging.info('request %s', json.dumps(record, sort_keys=True))
+
+        budget = self.app.config['IB2_QUERY_BUDGETS'].get(
+            request.endpoint,
+            self.app.config['IB2_QUERY_BUDGET'])
+        if budget is not None and stats['queries'] > budget:
+            logging.warning('%s executed %d queries (budget is %d)',
+                            request.endpoint, stats['queries'], budget)
+        return response
@@ -0,0 +1,300 @@
+"""Load testing for the public pages.
+
+`bench_web` (the ``bench-web`` command) sends a mix of requests for the
+public pages to the wsgi application from several threads at once, and
+reports the throughput and latency percentiles for each route. The
+requests are made either in-process, by calling the application directly,
+or over a socket to a local server, which includes the cost of http
+parsing and the like.
+
+It's best run against a large database, e.g. one generated by the
+`benchmarks.scale` script:
+
+    python -m benchmarks.scale --preset medium --database /tmp/medium.db
+    ironblogger bench-web --database /tmp/medium.db --socket
+
+The load is run twice: once as configured, and once with the caching
+layers (see `CACHING_LAYERS`) disabled, to show what they're buying us.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from six.moves import http_client
+from werkzeug.serving import make_server, WSGIRequestHandler
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from .app import app, compress, db
+from .model import Post
+from . import template_filters
+
+# Relative frequency of requests for each route. '/posts' requests are for
+# a random page:
+ROUTE_WEIGHTS = [
+    ('/posts', 50),
+    ('/status', 20),
+    ('/ledger', 10),
+    ('/rss', 10),
+    ('/bloggers', 10),
+]
+
+PERCENTILES = (50, 90, 99)
+
+
+@contextmanager
+def _compress_cache_disabled():
+    size = app.config['IB2_COMPRESS_CACHE_SIZE']
+    app.config['IB2_COMPRESS_CACHE_SIZE'] = 0
+    compress._cache.clear()
+    try:
+        yield
+    finally:
+        app.config['IB2_COMPRESS_CACHE_SIZE'] = size
+
+
+@contextmanager
+def _filter_memo_disabled():
+    size = template_filters.MAX_MEMO_SIZE
+    # The memo is cleared whenever it reaches this size, so with a size of
+    # zero it never holds on to anything:
+    template_filters.MAX_MEMO_SIZE = 0
+    template_filters._memo.clear()
+    try:
+        yield
+    finally:
+        template_filters.MAX_MEMO_SIZE = size
+
+
+# Context managers which each turn off one of our caches:
+CACHING_LAYERS = [
+    ('compress', _compress_cache_disabled),
+    ('filter_memo', _filter_memo_disabled),
+]
+
+
+@contextmanager
+def caching_disabled():
+    """Context manager disabling all of the `CACHING_LAYERS`."""
+    managers = [disable() for name, disable in CACHING_LAYERS]
+    for manager in managers:
+        manager.__enter__()
+    try:
+        yield
+    finally:
+        for manager in reversed(managers):
+            manager.__exit__(None, None, None)
+
+
+def make_urls(rand, count, num_pages):
+    """Return a list of ``count`` urls, in the proportions `ROUTE_WEIGHTS`."""
+    routes = []
+    for route, weight in ROUTE_WEIGHTS:
+        routes += [route] * weight
+    urls = []
+    for i in range(count):
+        route = rand.choice(routes)
+        if route == '/posts':
+            route += '?page=%d' % rand.randrange(num_pages)
+        urls.append(route)
+    return urls
+
+
+def _route(url):
+    return url.split('?')[0]
+
+
+class _InProcessClient(object):
+
+    def __init__(self, application):
+        self.client = Client(application, BaseResponse)
+
+    def get(self, url):
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        resp.get_data()
+        return resp.status_code
+
+
+class _SocketClient(object):
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def get(self, url):
+        conn = http_client.HTTPConnection(self.host, self.port)
+        try:
+            conn.request('GET', url, headers={'Accept-Encoding': 'gzip'})
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        finally:
+            conn.close()
+
+
+def run_load(make_client, urls, concurrency):
+    """Fetch ``urls`` using ``concurrency`` threads.
+
+    ``make_client`` is called once per thread, and should return an object
+    with a ``get(url)`` method, returning the http status. Returns a tuple
+    ``(elapsed, latencies, errors)``, where ``latencies`` maps each route to
+    a list of latencies in seconds, and ``errors`` maps routes to the
+    number of non-200 responses.
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    queue = list(reversed(urls))
+
+    def worker():
+        client = make_client()
+        while True:
+            with lock:
+                if not queue:
+                    return
+                url = queue.pop()
+            start = time.time()
+            status = client.get(url)
+            elapsed = time.time() - start
+            with lock:
+                latencies[_route(url)].append(elapsed)
+                if status != 200:
+                    errors[_route(url)] += 1
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, latencies, errors
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def summarize(elapsed, latencies, errors):
+    """Turn the results of `run_load` into a json-friendly dict."""
+    routes = {}
+    total = 0
+    for route, values in sorted(latencies.items()):
+        total += len(values)
+        routes[route] = {
+            'requests': len(values),
+            'errors': errors.get(route, 0),
+            'per_sec': len(values) / elapsed,
+        }
+        for p in PERCENTILES:
+            routes[route]['p%d' % p] = _percentile(values, p)
+    return {
+        'elapsed': elapsed,
+        'requests': total,
+        'per_sec': total / elapsed,
+        'routes': routes,
+    }
+
+
+def _report(name, summary, out):
+    out.write('%s: %d requests in %.1fs (%.1f/sec)\n' % (
+        name, summary['requests'], summary['elapsed'], summary['per_sec']))
+    out.write('  %-10s %7s %7s %9s %9s %9s\n' % (
+        'route', 'reqs', 'errors', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)'))
+    for route, stats in sorted(summary['routes'].items()):
+        out.write('  %-10s %7d %7d %9.1f %9.1f %9.1f\n' % (
+            route, stats['requests'], stats['errors'],
+            stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000))
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@contextmanager
+def _local_server(application):
+    server = make_server('127.0.0.1', 0, application, threaded=True,
+                         request_handler=_QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+
+
+def bench_web(database=None, requests=1000, concurrency=8, socket=False,
+              seed=0, output=None):
+    """Load test the public pages, and report the results.
+
+    ``database`` is the path to a SQLite database to use instead of the
+    configured one. A summary is printed to stderr; if ``output`` is given,
+    the full results are also written there as JSON.
+    """
+    from .wsgi import application
+    if database is not None:
+        application.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.abspath(database)
+    num_posts = db.session.query(Post).count()
+    num_pages = max(1, -(-num_posts // application.config['IB2_POSTS_PER_PAGE']))
+    urls = make_urls(random.Random(seed), requests, num_pages)
+    # Don't hold a connection open while the load runs:
+    db.session.remove()
+
+    results = {}
+    with _maybe_server(application, socket) as make_client:
+        # Warm up, so we're not measuring one-time costs like compiling
+        # templates:
+        run_load(make_client, sorted(set(_route(url) for url in urls)), 1)
+        for name in 'cached', 'uncached':
+            with _maybe_caching_disabled(name == 'uncached'):
+                summary = summarize(*run_load(make_client, urls,
+                                              concurrency))
+            _report(name, summary, sys.stderr)
+            results[name] = summary
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({
+                'params': {
+                    'requests': requests,
+                    'concurrency': concurrency,
+                    'socket': socket,
+                    'seed': seed,
+                    'posts': num_posts,
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+    return results
+
+
+@contextmanager
+def _maybe_server(application, socket):
+    """Yield a function returning clients for ``application``.
+
+    If ``socket`` is true, the clients talk to a local server.
+    """
+    if not socket:
+        yield lambda: _InProcessClient(application)
+        return
+    with _local_server(application) as server:
+        host, port = server.server_address
+        yield lambda: _SocketClient(host, port)
+
+
+@contextmanager
+def _maybe_caching_disabled(disable):
+    if disable:
+        with caching_disabled():
+            yield
+    else:
+        yield
@@ -0,0 +1,242 @@
+"""In-process metrics.
+
+This module defines a minimal registry of counters and histograms, which can
+be rendered in the Prometheus text exposition format. There are two
+registries:
+
+* `web`, for the web app: request latency, database time, and the like.
+* `tasks`, for the background jobs: feeds fetched, posts added, etc.
+
+The web app serves both at ``/metrics``. The tasks normally run in a
+separate process (launched by cron), so at the end of each sync the tasks
+registry is written to the file named by ``IB2_METRICS_FILE``, and the web
+app reports the contents of that file as the metrics for the latest run.
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Metric(object):
+    """Base class for metrics.
+
+    Subclasses must set `type` and define `samples`, which returns a list of
+    ``(name, labels, value)`` tuples.
+    """
+
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+class Counter(_Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values:
+            return [(self.name, {}, 0)]
+        return [(self.name, dict(key), value) for key, value in values]
+
+
+class Histogram(_Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, num = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [count + (value <= bound)
+                      for count, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value, num + 1)
+
+    def count(self, **labels):
+        """Return the number of observations with the given labels."""
+        return self._values.get(self._key(labels), (None, None, 0))[2]
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        result = []
+        for key, (counts, total, num) in values:
+            labels = dict(key)
+            for count, bound in zip(counts, self.buckets):
+                result.append((self.name + '_bucket',
+                               dict(labels, le=repr(float(bound))),
+                               count))
+            result.append((self.name + '_bucket', dict(labels, le='+Inf'), num))
+            result.append((self.name + '_sum', labels, total))
+            result.append((self.name + '_count', labels, num))
+        return result
+
+
+class Registry(object):
+    """A collection of metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def families(self):
+        """Return a list of ``(name, type, help, samples)`` tuples."""
+        return [(m.name, m.type, m.help, m.samples()) for m in self.metrics]
+
+
+def render(families):
+    """Render ``families`` (as returned by `Registry.families`) as text."""
+    lines = []
+    for name, type, help, samples in families:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, type))
+        for sample_name, labels, value in samples:
+            lines.append('%s%s %s' % (sample_name,
+                                      _format_labels(labels),
+                                      _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, _escape(value))
+        for key, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')\
+        .replace('\n', r'\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def write_last_run(path):
+    """Save the `tasks` metrics to ``path``, for the web app to report."""
+    data = {
+        'finished': time.time(),
+        'families': tasks.families(),
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp, path)
+
+
+def read_last_run(path):
+    """Return the metric families saved by `write_last_run`.
+
+    Includes a gauge with the time the run finished. If there is no saved
+    run, returns an empty list.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return []
+    return [(
+        'ironblogger_last_sync_timestamp_seconds',
+        'gauge',
+        'Time at which the latest sync finished.',
+        [('ironblogger_last_sync_timestamp_seconds', {}, data['finished'])],
+    )] + [tuple(family) for family in data['families']]
+
+
+def render_all(last_run_path=None):
+    """Render the web app's metrics, plus those from the latest sync.
+
+    ``last_run_path`` is the file the latest sync's metrics were saved to,
+    if any.
+    """
+    families = web.families()
+    if last_run_path is not None:
+        families += read_last_run(last_run_path)
+    return render(families)
+
+
+web = Registry()
+request_latency = web.histogram(
+    'ironblogger_request_duration_seconds',
+    'Time spent handling requests, by endpoint.')
+request_db_time = web.histogram(
+    'ironblogger_request_db_duration_seconds',
+    'Time spent executing SQL while handling requests, by endpoint.')
+compress_cache_hits = web.counter(
+    'ironblogger_compress_cache_hits_total',
+    'Responses whose compressed body was found in the cache.')
+compress_cache_misses = web.counter(
+    'ironblogger_compress_cache_misses_total',
+    'Responses which had to be compressed.')
+websub_received = web.counter(
+    'ironblogger_websub_received_total',
+    'Content pushed to us by WebSub hubs.')
+websub_rejected = web.counter(
+    'ironblogger_websub_rejected_total',
+    'Pushed content ignored because of a bad signature.')
+
+tasks = Registry()
+feeds_fetched = tasks.counter(
+    'ironblogger_feeds_fetched_total',
+    'Feeds downloaded.')
+feeds_not_modified = tasks.counter(
+    'ironblogger_feeds_not_modified_total',
+    'Feeds for which the server responded 304 Not Modified.')
+parse_failures = tasks.counter(
+    'ironblogger_parse_failures_total',
+    'Feeds or posts which could not be parsed.')
+posts_inserted = tasks.counter(
+    'ironblogger_posts_inserted_total',
+    'New posts added to the database.')
+posts_updated = tasks.counter(
+    'ironblogger_posts_updated_total',
+    'Existing posts updated from their feeds.')
+round_assignment_time = tasks.histogram(
+    'ironblogger_round_assignment_duration_seconds',
+    'Time spent assigning posts to rounds.')
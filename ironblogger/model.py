@@ -12,33 +12,24 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
-import logging
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
 
 from flask.ext.login import UserMixin
 from passlib.hash import sha512_crypt
-import feedparser
-import jinja2
 
 from .app import db
 from .date import duedate, round_diff, to_dbtime, from_dbtime, \
-    duedate_seek, from_feedtime
-
-from sqlalchemy import and_, or_
+    duedate_seek
+from .excerpt import make_excerpt
+from .feedurl import feed_hash
 
 MAX_DEBT = 3000
 DEBT_PER_POST = 500
 LATE_PENALTY = 100
 
-feedparser.USER_AGENT = \
-        'IronBlogger/git ' + \
-        '+https://github.com/zenhack/iron-blogger2 ' + \
-        feedparser.USER_AGENT
-
-
-class MalformedPostError(Exception):
-    """Raised when parsing a post fails."""
-
-
 class User(db.Model, UserMixin):
     """A user of Iron Blogger.
 
@@ -81,7 +72,7 @@ class Blogger(db.Model):
     # a straightforward way to rename columns, and so writing a migration script
     # will take a bit of work.
     name       = db.Column(db.String,   nullable=False, unique=True)
-    start_date = db.Column(db.DateTime, nullable=False)
+    start_date = db.Column(db.DateTime, nullable=False, index=True)
     email      = db.Column(db.String)
 
     # This isn't currently really used by anything (and isn't displayed
@@ -96,64 +87,59 @@ class Blogger(db.Model):
 class Blog(db.Model):
     """A blog. bloggers may have more than one of these."""
     id         = db.Column(db.Integer, primary_key=True)
-    blogger_id = db.Column(db.Integer, db.ForeignKey('blogger.id'), nullable=False)
+    blogger_id = db.Column(db.Integer, db.ForeignKey('blogger.id'), nullable=False,
+                           index=True)
     title      = db.Column(db.String, nullable=False)
     page_url   = db.Column(db.String, nullable=False)  # Human readable webpage
     feed_url   = db.Column(db.String, nullable=False)  # Atom/RSS feed
-    # Metadata for caching:
-    etag       = db.Column(db.String)  # see: https://pythonhosted.org/feedparser/http-etag.html
-    modified   = db.Column(db.String)  # We don't bother parsing this; it's only for the server's
-                                       # Benefit.
+    # See ironblogger/feedurl.py; kept up to date with feed_url:
+    feed_hash  = db.Column(db.Integer, nullable=False, index=True)
+    # When we last tried to download the feed:
+    last_fetched  = db.Column(db.DateTime)
+    # When several hosts share the work of fetching feeds, the one which
+    # has claimed this blog, and when its claim runs out (see
+    # ironblogger/fetch.py):
+    lease_owner   = db.Column(db.String)
+    lease_expires = db.Column(db.DateTime)
+    # The Feed for feed_url; set the first time it's fetched:
+    feed_id       = db.Column(db.Integer, db.ForeignKey('feed.id'), index=True)
 
     blogger = db.relationship(
         'Blogger',
         backref=db.backref('blogs', cascade='all, delete-orphan')
     )
+    feed = db.relationship('Feed', backref='blogs')
 
-    def fetch_posts(self):
-        logging.info('Syncing posts for blog %r by %r',
-                     self.title,
-                     self.blogger.name)
-        feed = feedparser.parse(self.feed_url,
-                                etag=self.etag,
-                                modified=self.modified)
-        if hasattr(feed, 'status') and feed.status == 304:
-            logging.info('Feed for blog %r (by %r) was not modified.',
-                         self.title,
-                         self.blogger.name)
-
-        feed_posts = map(Post.from_feed_entry, feed.entries)
-
-        for post in feed_posts:
-            # Check if the post is already in the db:
-            prev_version = db.session.query(Post).filter(or_(
-                # If any of the below attributes match a post already in
-                # the db, we consider it to be the same post. Note that
-                # guid can be NULL, so we need to check for that.
-                and_(Post.guid != None, Post.guid == post.guid),
-                Post.page_url == post.page_url,
-            )).filter(Blog.id == self.id).first()
-
-            if prev_version is not None:
-                # Override the information in the previous version:
-                logging.info('Update existing post %r', post.page_url)
-                prev_version.title = post.title
-                prev_version.guid = post.guid
-                prev_version.page_url = post.page_url
-                prev_version.summary = post.summary
-                continue
-
-            post.blog = self
-            db.session.add(post)
-            logging.info('Added new post %r', post.page_url)
-        self._update_caching_info(feed)
-        db.session.commit()
-
-    def _update_caching_info(self, feed):
-        if hasattr(feed, 'etag'):
-            self.etag = feed.etag
-        if hasattr(feed, 'modified'):
-            self.modified = feed.modified
+    @db.validates('feed_url')
+    def _update_feed_hash(self, key, feed_url):
+        self.feed_hash = feed_hash(feed_url)
+        return feed_url
+
+
+class Feed(db.Model):
+    """Caching and WebSub metadata for a feed.
+
+    Several blogs may share a feed (e.g. group blogs), and it's only
+    downloaded once per sync, so this is kept per url rather than per blog.
+    ``url`` is normalized; see `ironblogger.fetch.normalize_feed_url`.
+
+    If the feed advertises a WebSub hub, we subscribe to it, and the hub
+    pushes new content to us; see `ironblogger.websub`.
+    """
+    id       = db.Column(db.Integer, primary_key=True)
+    url      = db.Column(db.String, nullable=False, unique=True)
+    etag     = db.Column(db.String)  # see: https://pythonhosted.org/feedparser/http-etag.html
+    modified = db.Column(db.String)  # We don't bother parsing this; it's only for the server's
+                                     # Benefit.
+    # The hub and topic (the feed's self url) advertised by the feed, if any:
+    hub      = db.Column(db.String)
+    topic    = db.Column(db.String)
+    # Shared with the hub, to sign the content it pushes:
+    secret   = db.Column(db.String)
+    # When we last asked the hub to subscribe us, and when the subscription
+    # the hub confirmed runs out:
+    push_requested = db.Column(db.DateTime)
+    push_expires   = db.Column(db.DateTime)
 
 
 class Party(db.Model):
@@ -181,18 +167,28 @@ class Payment(db.Model):
         backref=db.backref('payments', cascade='all, delete-orphan')
     )
 
+    __table_args__ = (
+        db.Index('ix_payment_blogger_id_duedate', 'blogger_id', 'duedate'),
+    )
+
 
 class Post(db.Model):
     """A blog post."""
     id         = db.Column(db.Integer,  primary_key=True)
     blog_id    = db.Column(db.Integer,  db.ForeignKey('blog.id'), nullable=False)
     guid       = db.Column(db.String)
-    timestamp  = db.Column(db.DateTime, nullable=False)
-    counts_for = db.Column(db.DateTime)
+    timestamp  = db.Column(db.DateTime, nullable=False, index=True)
+    counts_for = db.Column(db.DateTime, index=True)
     title      = db.Column(db.String,   nullable=False)
     # The *sanitized* description/summary field from the feed entry. This will
-    # be copied directly to the generated html, so sanitization is critical:
-    summary    = db.Column(db.Text,     nullable=False)
+    # be copied directly to the generated html, so sanitization is critical.
+    # It's stored zlib-compressed, and only loaded when needed; use the
+    # `summary` property rather than this. NULL if the excerpt is the whole
+    # summary:
+    summary_z  = db.deferred(db.Column(db.LargeBinary))
+    # The start of the summary, for the listing pages. Kept up to date by
+    # the `summary` property; see `ironblogger.excerpt`:
+    excerpt    = db.Column(db.Text,     nullable=False)
     page_url   = db.Column(db.String,   nullable=False)
 
     blog  = db.relationship(
@@ -211,81 +207,19 @@ class Post(db.Model):
         db.UniqueConstraint('counts_for', 'blog_id'),
     )
 
-    @staticmethod
-    def _get_pub_date(feed_entry):
-        """Return a an arrow object for the post's publication date.
-
-        ``feed_entry`` should be a post object as returned by
-        ``feedparser.parse``.
-
-        If the post does not have a publication date, raise a
-        ``MalformedPostError``.
-        """
-        for key in 'published', 'created', 'updated':
-            key += '_parsed'
-            if key in feed_entry and feed_entry[key] is not None:
-                return from_feedtime(feed_entry[key])
-        raise MalformedPostError("No valid publication date in post: %r" %
-                                 feed_entry)
-
-    @staticmethod
-    def from_feed_entry(entry):
-        """Read and construct Post object from ``entry``.
-
-        ``entry`` should be a post object as returned by ``feedparser.parse``.
-
-        If the post is invalid, raise a ``MalformedPostError`.
-
-        This leaves the `blog` field emtpy; this must be filled in before the
-        post is added to the database.
-        """
-        for field in 'title', 'summary', 'link':
-            if field not in entry:
-                raise MalformedPostError("Post has no %s: %r" % (field, entry))
-        post = Post()
-        post.timestamp = to_dbtime(Post._get_pub_date(entry))
-        post.title = entry['title']
-        post.summary = entry['summary']
-        if hasattr(entry, 'id'):
-            post.guid = entry.id
-
-        # The summary detail attribute lets us find the mime type of the
-        # summary. feedparser doesn't escape it if it's text/plain, so we need
-        # to do it ourselves. Unfortunately, there's a bug (likely #412) in
-        # feedparser, and sometimes this attribute is unavailable. If it's
-        # there, great, use it. Otherwise, we'll just assume it's html, and
-        # sanitize it ourselves.
-        if hasattr(entry, 'summary_detail'):
-            mimetype = entry.summary_detail.type
+    @property
+    def summary(self):
+        if self.summary_z is None:
+            return self.excerpt
+        return zlib.decompress(self.summary_z).decode('utf-8')
+
+    @summary.setter
+    def summary(self, summary):
+        self.excerpt = make_excerpt(summary)
+        if self.excerpt == summary:
+            self.summary_z = None
         else:
-            mimetype = 'application/xhtml'
-            # Sanitize the html; who knows what feedparser did or didn't do.
-            # XXX: _sanitizeHTML is a private function to the feedparser
-            # library! unfortunately, we don't have many better options. This
-            # statement is the reason the version number for the feedparser
-            # dependency is fixed at 5.1.3; any alternate version will need to
-            # be vetted carefully, as by doing this we lose any api stability
-            # guarantees.
-            post.summary = unicode(feedparser._sanitizeHTML(
-                # _sanitizeHTML expects an encoding, so rather than do more
-                # guesswork than we alredy have...
-                post.summary.encode('utf-8'),
-                'utf-8',
-                # _sanitizeHTML is only ever called within the library with
-                # this value:
-                u'text/html',
-            ), 'utf-8')
-
-        if mimetype == 'text/plain':
-            # feedparser doesn't sanitize the summary if it's plain text, so we
-            # need to do it manually. We're using jijna2's autoscape feature
-            # for this, which feels like a bit of a hack to me (Ian), but it
-            # works -- there's probably a cleaner way to do this.
-            tmpl = jinja2.Template('{{ text }}', autoescape=True)
-            post.summary = tmpl.render(text=post.summary)
-        post.page_url = entry['link']
-
-        return post
+            self.summary_z = zlib.compress(summary.encode('utf-8'))
 
     def _oldest_valid_duedate(self):
         ret = duedate_seek(duedate(from_dbtime(self.timestamp)),
@@ -365,3 +299,145 @@ class Post(db.Model):
 
         return round_diff(duedate(from_dbtime(self.timestamp)),
                           from_dbtime(self.counts_for))
+
+
+class SyncRun(db.Model):
+    """A record of one run of the sync task.
+
+    Besides when the run started and finished, we keep the total time spent
+    in each stage of the sync:
+
+    * fetch:    downloading feeds.
+    * parse:    parsing feeds and their entries (excluding sanitization).
+    * sanitize: sanitizing the summaries of posts.
+    * upsert:   storing new & updated posts in the database.
+    * assign:   assigning posts to rounds.
+
+    Details about each feed that was downloaded are kept in `FeedFetch`.
+    """
+    STAGES = ('fetch', 'parse', 'sanitize', 'upsert', 'assign')
+
+    id         = db.Column(db.Integer,  primary_key=True)
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
+    # NULL if the run is still going (or was killed):
+    end_time   = db.Column(db.DateTime)
+
+    fetch_time    = db.Column(db.Float, nullable=False)
+    parse_time    = db.Column(db.Float, nullable=False)
+    sanitize_time = db.Column(db.Float, nullable=False)
+    upsert_time   = db.Column(db.Float, nullable=False)
+    assign_time   = db.Column(db.Float, nullable=False)
+
+    feeds_fetched = db.Column(db.Integer, nullable=False)
+    bytes_fetched = db.Column(db.Integer, nullable=False)
+    # Feeds which could not be downloaded (or parsed at all):
+    fetch_errors  = db.Column(db.Integer, nullable=False)
+    # Feeds containing a malformed post:
+    parse_errors  = db.Column(db.Integer, nullable=False)
+    # The exception which aborted the run, if any:
+    error         = db.Column(db.String)
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('start_time', datetime.utcnow())
+        for stage in self.STAGES:
+            kwargs.setdefault(stage + '_time', 0.0)
+        for column in ('feeds_fetched', 'bytes_fetched',
+                       'fetch_errors', 'parse_errors'):
+            kwargs.setdefault(column, 0)
+        db.Model.__init__(self, **kwargs)
+
+    def __repr__(self):
+        return 'SyncRun(%s)' % self.start_time
+
+    @property
+    def duration(self):
+        """Length of the run in seconds, or None if it hasn't finished."""
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time).total_seconds()
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager adding the time spent in its body to ``stage``.
+
+        Timers may be nested; time spent in an inner timer is not counted
+        towards the outer one.
+        """
+        if not hasattr(self, '_timers'):
+            self._timers = []
+        # Each entry is the time spent in timers nested inside that one:
+        self._timers.append(0.0)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            nested = self._timers.pop()
+            column = stage + '_time'
+            setattr(self, column, getattr(self, column) + elapsed - nested)
+            if self._timers:
+                self._timers[-1] += elapsed
+
+    def record_fetch(self, blogs, duration, downloaded, feed):
+        """Record the download of the feed shared by ``blogs``.
+
+        ``downloaded`` is the `ironblogger.fetch.DownloadedFeed`, and ``feed``
+        is the result of parsing it. Each blog gets a `FeedFetch`, but the
+        download is only counted once in the run's totals. Returns the list
+        of new `FeedFetch`es.
+        """
+        status = feed.get('status')
+        error = None
+        if status is not None and status >= 400:
+            error = 'HTTP status %d' % status
+        elif feed.bozo and not feed.entries and status != 304:
+            error = str(feed.get('bozo_exception'))
+        with db.session.no_autoflush:
+            fetches = [FeedFetch(run=self,
+                                 blog=blog,
+                                 duration=duration,
+                                 bytes=downloaded.size,
+                                 status=status,
+                                 error=error)
+                       for blog in blogs]
+        if downloaded.size is not None:
+            self.bytes_fetched += downloaded.size
+        if error is not None:
+            self.fetch_errors += 1
+        self.feeds_fetched += 1
+        return fetches
+
+
+class FeedFetch(db.Model):
+    """A download of a blog's feed, during a `SyncRun`."""
+    id       = db.Column(db.Integer, primary_key=True)
+    run_id   = db.Column(db.Integer, db.ForeignKey('sync_run.id'),
+                         nullable=False, index=True)
+    blog_id  = db.Column(db.Integer, db.ForeignKey('blog.id'),
+                         nullable=False, index=True)
+    # Time taken to download the feed, in seconds:
+    duration = db.Column(db.Float,   nullable=False)
+    # Size of the response body; NULL if the download failed:
+    bytes    = db.Column(db.Integer)
+    # HTTP status; NULL for feeds which aren't fetched over HTTP:
+    status   = db.Column(db.Integer)
+    error    = db.Column(db.String)
+
+    run = db.relationship(
+        'SyncRun',
+        backref=db.backref('fetches', cascade='all, delete-orphan')
+    )
+    blog = db.relationship(
+        'Blog',
+        backref=db.backref('fetches', cascade='all, delete-orphan')
+    )
+
+
+@contextmanager
+def stage_timer(run, stage):
+    """Like ``run.timer(stage)``, but does nothing if ``run`` is None."""
+    if run is None:
+        yield
+    else:
+        with run.timer(stage):
+            yield
@@ -0,0 +1,102 @@
+"""Profiling helpers for the command line tasks.
+
+These back the ``--profile`` and ``--trace-memory`` options to the
+``ironblogger`` command, e.g.:
+
+    ironblogger --profile sync
+    ironblogger --profile=fetch.prof --trace-memory fetch-posts
+
+Reports are written to stderr, so they don't get mixed up with the output
+of commands like ``export``.
+"""
+import cProfile
+import pstats
+import sys
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python < 3.4
+    tracemalloc = None
+
+# Default file to save profiles to:
+DEFAULT_PROFILE_PATH = 'ironblogger.prof'
+
+# Number of entries to show in reports:
+TOP_ENTRIES = 25
+
+
+@contextmanager
+def profiled(path, stream=None):
+    """Context manager profiling its body.
+
+    The stats are saved to ``path`` (they can be loaded with `pstats`, or a
+    viewer like snakeviz), and the entries with the most cumulative time are
+    printed to ``stream`` (default: stderr).
+
+    If ``path`` is None, this does nothing.
+    """
+    if path is None:
+        yield
+        return
+    if stream is None:
+        stream = sys.stderr
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        stream.write('Profile saved to %s\n' % path)
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+
+
+@contextmanager
+def memory_traced(enabled=True, stream=None):
+    """Context manager reporting the memory allocated in its body.
+
+    The lines responsible for the most memory still live at exit (not at
+    the peak; memory freed before the end doesn't show up), and the peak
+    amount allocated, are printed to ``stream``
+    (default: stderr). This requires tracemalloc (Python 3.4+); without it,
+    we can only report the peak RSS of the process.
+
+    If ``enabled`` is false, this does nothing.
+    """
+    if not enabled:
+        yield
+        return
+    if stream is None:
+        stream = sys.stderr
+    if tracemalloc is None:
+        try:
+            yield
+        finally:
+            _report_peak_rss(stream)
+        return
+
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stream.write('Top allocations still live at exit, by line:\n')
+        for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]:
+            stream.write('  %s\n' % stat)
+        stream.write('Peak traced memory: %.1f KiB\n' % (peak / 1024.0))
+
+
+def _report_peak_rss(stream):
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # ru_maxrss is in bytes on OS X, rather than KiB:
+        peak /= 1024
+    stream.write('tracemalloc is not available (it requires Python 3.4+), '
+                 'so allocations by line cannot be reported.\n')
+    stream.write('Peak RSS: %d KiB\n' % peak)
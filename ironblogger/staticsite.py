@@ -0,0 +1,257 @@
+"""Render the public pages of the site to static files.
+
+The public pages only change when the database does (i.e. after a sync), so
+it's possible to have a front-end web server serve them directly, without
+involving python at all. `export_site` writes the following layout:
+
+    posts/<N>.html    - /posts?page=N
+    status/<N>.html   - /status?page=N
+    ledger.html       - /ledger
+    bloggers.html     - /bloggers
+    about.html        - /about
+    rss.xml           - /rss
+
+Each file also gets a gzip-compressed copy with an additional ``.gz``
+extension, suitable for e.g. nginx's ``gzip_static``. Requests for paginated
+pages can be mapped onto the files with something like:
+
+    location = /posts { try_files /posts/${arg_page}.html /posts/0.html; }
+
+Only pages with the default page size are exported.
+
+Exports are incremental: for each page we compute a fingerprint of the data
+it is rendered from, and store these in a manifest in the output directory.
+Pages whose fingerprint hasn't changed since the last export are skipped.
+
+The post table is by far the biggest, so the ledger and rss feed (which are
+rendered from all of it) are fingerprinted from aggregates over it (the
+count, and the largest id and timestamps) rather than its contents, plus
+the contents of the most recent page of posts, which is where updates from
+the feeds usually land. An edit to an older post which changes none of
+those is only picked up with ``force``. The posts pages are fingerprinted
+from their contents, walking the listing a page at a time by
+(timestamp, id), rather than with ever larger offsets.
+"""
+import errno
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from .app import app
+from .model import db, Blogger, Blog, Post, Payment, Party
+from .date import duedate, duedate_seek, round_diff, from_dbtime, to_dbtime, \
+    now
+from .view import STATUS_PAGE_SIZE
+from sqlalchemy import and_, or_, func
+
+MANIFEST_NAME = '.ib2-export.json'
+
+
+def export_site(dest, force=False, base_url='http://localhost/'):
+    """Export the public pages to the directory ``dest``.
+
+    If ``force`` is true, every page is re-rendered, regardless of whether it
+    has changed. ``base_url`` is used for the absolute links in the rss feed.
+
+    Returns a list of the (relative) paths of the pages that were rendered.
+    """
+    manifest_path = os.path.join(dest, MANIFEST_NAME)
+    old_manifest = {}
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old_manifest = json.load(f)
+
+    client = app.test_client()
+    new_manifest = {}
+    rendered = []
+    for relpath, url, fingerprint in _pages():
+        new_manifest[relpath] = fingerprint
+        if old_manifest.get(relpath) == fingerprint and \
+                os.path.exists(os.path.join(dest, relpath)):
+            continue
+        resp = client.get(url, base_url=base_url)
+        if resp.status_code != 200:
+            raise RuntimeError('Got status %d rendering %r' %
+                               (resp.status_code, url))
+        _write_page(os.path.join(dest, relpath), resp.data)
+        rendered.append(relpath)
+        logging.info('Rendered %r to %r', url, relpath)
+
+    # Pages can disappear, e.g. if posts are deleted. Clean them up:
+    for relpath in set(old_manifest) - set(new_manifest):
+        for path in relpath, relpath + '.gz':
+            try:
+                os.remove(os.path.join(dest, path))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    _write_file(manifest_path, json.dumps(new_manifest,
+                                          sort_keys=True,
+                                          indent=2).encode('utf-8'))
+    return rendered
+
+
+def _pages():
+    """Yield a ``(relpath, url, fingerprint)`` tuple for each page to export."""
+    config = _config_digest()
+    yield 'about.html', '/about', config
+    yield 'bloggers.html', '/bloggers', _digest(
+        config,
+        _rows(db.session.query(Blogger.id, Blogger.name, Blogger.start_date)
+              .order_by(Blogger.id)),
+        _rows(db.session.query(Blog.id, Blog.blogger_id, Blog.title,
+                               Blog.page_url).order_by(Blog.id)),
+    )
+    yield 'ledger.html', '/ledger', _digest(
+        config,
+        duedate(now()),
+        _rows(db.session.query(Blogger.id, Blogger.name, Blogger.start_date)
+              .order_by(Blogger.id)),
+        _rows(db.session.query(Blog.id, Blog.blogger_id).order_by(Blog.id)),
+        _post_aggregates(func.count(Post.counts_for),
+                         func.max(Post.counts_for)),
+        _rows(db.session.query(Payment.id, Payment.blogger_id,
+                               Payment.duedate, Payment.amount)
+              .order_by(Payment.id)),
+        _rows(db.session.query(Party.id, Party.date, Party.spent,
+                               Party.first_duedate, Party.last_duedate)
+              .order_by(Party.id)),
+    )
+    yield 'rss.xml', '/rss', _digest(
+        config,
+        _post_aggregates(),
+        _rows(_listing_query().limit(app.config['IB2_POSTS_PER_PAGE'])),
+    )
+    for page in _posts_pages(config):
+        yield page
+    for page in _status_pages(config):
+        yield page
+
+
+def _listing_query():
+    """Query for the post data shown in the posts listing and the rss feed."""
+    return db.session.query(Post.id,
+                            Post.timestamp,
+                            Post.title,
+                            Post.excerpt,
+                            Post.page_url,
+                            Blog.title,
+                            Blog.page_url,
+                            Blogger.name)\
+        .filter(Post.blog_id == Blog.id,
+                Blog.blogger_id == Blogger.id)\
+        .order_by(Post.timestamp.desc(), Post.id.desc())
+
+
+def _post_aggregates(*extra):
+    """Return a summary of the post table, for fingerprinting pages rendered
+    from all of it; ``extra`` are further aggregates to include."""
+    return tuple(db.session.query(func.count(Post.id),
+                                  func.max(Post.id),
+                                  func.max(Post.timestamp),
+                                  *extra).one())
+
+
+def _posts_pages(config):
+    size = app.config['IB2_POSTS_PER_PAGE']
+    post_count = db.session.query(Post).count()
+    last = None
+    for num in range(_num_pages(post_count, size)):
+        posts = _listing_query()
+        if last is not None:
+            # Carry on from the last post on the previous page:
+            posts = posts.filter(or_(
+                Post.timestamp < last[1],
+                and_(Post.timestamp == last[1], Post.id < last[0]),
+            ))
+        posts = _rows(posts.limit(size))
+        if posts:
+            last = posts[-1]
+        yield ('posts/%d.html' % num,
+               '/posts?page=%d' % num,
+               _digest(config, post_count, posts))
+
+
+def _status_pages(config):
+    size = STATUS_PAGE_SIZE
+    current_round = duedate(now())
+    first_round = db.session.query(Blogger.start_date)\
+        .order_by(Blogger.start_date.asc()).first()
+    if first_round is None:
+        num_rounds = 0
+    else:
+        num_rounds = round_diff(current_round,
+                                duedate(from_dbtime(first_round[0])))
+    bloggers = _rows(db.session.query(Blogger.name).order_by(Blogger.name))
+
+    for num in range(_num_pages(num_rounds, size)):
+        # This is a (slight) superset of the posts actually shown on the
+        # page; see show_status for the details.
+        start_round = duedate_seek(current_round, -(size * num))
+        stop_round = duedate_seek(start_round, -size)
+        start_round, stop_round = to_dbtime(start_round), to_dbtime(stop_round)
+        posts = db.session.query(Post.id,
+                                 Post.timestamp,
+                                 Post.counts_for,
+                                 Post.title,
+                                 Post.page_url,
+                                 Blog.title,
+                                 Blog.page_url,
+                                 Blogger.name)\
+            .filter(Post.blog_id == Blog.id,
+                    Blog.blogger_id == Blogger.id)\
+            .filter(or_(
+                and_(Post.timestamp <= start_round,
+                     Post.timestamp > stop_round),
+                and_(Post.counts_for <= start_round,
+                     Post.counts_for > stop_round),
+            )).order_by(Post.id)
+        yield ('status/%d.html' % num,
+               '/status?page=%d' % num,
+               _digest(config, current_round, num_rounds, bloggers,
+                       _rows(posts)))
+
+
+def _num_pages(item_count, size):
+    """Return the number of pages `_page_args` will accept for ``item_count``."""
+    return int(max(item_count, 0) // size) + 1
+
+
+def _config_digest():
+    """Digest of the configuration; changes to it may affect any page."""
+    return _digest(sorted((key, value) for key, value in app.config.items()
+                          if key.startswith('IB2_')))
+
+
+def _rows(query):
+    return [tuple(row) for row in query]
+
+
+def _digest(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def _write_page(path, data):
+    """Write ``data`` to ``path``, and a gzipped copy to ``path`` + '.gz'."""
+    _write_file(path, data)
+    tmp = path + '.gz.tmp'
+    # Fixing mtime keeps the output deterministic:
+    with open(tmp, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                           compresslevel=9, mtime=0) as f:
+            f.write(data)
+    os.rename(tmp, path + '.gz')
+
+
+def _write_file(path, data):
+    """Atomically replace the contents of ``path`` with ``data``."""
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
@@ -6,26 +6,50 @@ similar.
 
 Routines defined here do not assume they're running in an application context.
 Those which need one create one themselves.
+
+Dependencies which only one routine needs (yaml, alembic, flask_mail) are
+imported by that routine, so the ``ironblogger`` command doesn't pay to
+load them for every invocation.
+
+The routines which work through every blog or post (`fetch_posts` and
+`assign_rounds`) do so in chunks of ``IB2_SYNC_CHUNK_SIZE`` rows (blogs or
+posts, respectively), committing each chunk before loading the next.
+The session only holds weak references to unmodified objects, so once a
+chunk is committed and we let go of it, it can be freed: memory use
+doesn't grow with the size of the database. (Objects aren't expunged,
+since the caller may be holding some of them.)
+
+The history of sync runs (`SyncRun` and `FeedFetch`) is kept for
+``IB2_SYNC_HISTORY_DAYS`` days; older runs are deleted at the end of each
+sync. Set it to None to keep them forever.
 """
 
-import yaml
 import json
 import arrow
 import logging
+import time
 from getpass import getpass
-from datetime import datetime
+from datetime import datetime, timedelta
 from os import path
 
+from sqlalchemy import and_, or_
+
 import ironblogger
+from . import metrics
 from .app import app, mail
-from .model import Blogger, Blog, Post, User, MalformedPostError, db
-from flask_mail import Message
+from .model import Blogger, Blog, Post, User, SyncRun, FeedFetch, db, \
+    stage_timer
+from .fetch import fetch_feed, group_by_feed, MalformedPostError, \
+    shard_filter, lease_owner, claim_blogs, renew_lease, release_lease
+from . import websub
 
-from alembic.config import Config
-from alembic import command
+app.config.setdefault('IB2_SYNC_CHUNK_SIZE', 200)
+app.config.setdefault('IB2_SYNC_HISTORY_DAYS', 30)
 
 
 def init_db():
+    from alembic.config import Config
+    from alembic import command
     db.create_all()
     alembic_cfg = Config(path.join(
         path.dirname(ironblogger.__file__),
@@ -35,8 +59,20 @@ def init_db():
     command.stamp(alembic_cfg, 'head')
 
 
-def assign_rounds(since=None, until=None):
-    """Assign posts to rounds."""
+def assign_rounds(since=None, until=None, run=None):
+    """Assign posts to rounds.
+
+    If ``run`` is not None, the time taken is recorded in that `SyncRun`.
+    """
+    start = time.time()
+    try:
+        with stage_timer(run, 'assign'):
+            _assign_rounds(since, until)
+    finally:
+        metrics.round_assignment_time.observe(time.time() - start)
+
+
+def _assign_rounds(since, until):
     if until is None:
         until = datetime.utcnow()
     if since is None:
@@ -49,16 +85,34 @@ def assign_rounds(since=None, until=None):
         # Rows are returned as tuples; we want the raw value:
         since = since[0]
 
-    posts = db.session.query(Post)\
+    pending = db.session.query(Post)\
         .filter(Post.counts_for == None,
                 Post.timestamp >= since,
                 Post.timestamp <= until)\
-        .order_by(Post.timestamp.asc()).all()
+        .order_by(Post.timestamp.asc(), Post.id.asc())
+
+    # Posts which can't be assigned stay pending, so we page through them
+    # by (timestamp, id), rather than by offset. Committing as we go rules
+    # out yield_per, which needs the cursor to stay open:
+    last = None
+    while True:
+        chunk = pending
+        if last is not None:
+            chunk = chunk.filter(or_(Post.timestamp > last[0],
+                                     and_(Post.timestamp == last[0],
+                                          Post.id > last[1])))
+        posts = chunk.limit(app.config['IB2_SYNC_CHUNK_SIZE']).all()
+        if not posts:
+            break
+        for post in posts:
+            post.assign_round()
+        last = posts[-1].timestamp, posts[-1].id
+        db.session.commit()
 
-    for post in posts:
-        post.assign_round()
 
-    db.session.commit()
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 def import_bloggers(file):
@@ -83,6 +137,7 @@ def import_bloggers(file):
     ``import_bloggers`` will create the database if it does not exist, and
     populate it with the contents of ``file``.
     """
+    import yaml
     session = db.session
 
     yml = yaml.load(file)
@@ -133,6 +188,7 @@ def export_bloggers(file):
 
 
 def send_reminders():
+    from flask_mail import Message
     text = (
         "Greetings!\n"
         "\n"
@@ -172,25 +228,180 @@ def shell():
         code.interact(local=locals())
 
 
-def sync():
+def sync(stop=None):
     """Combination of fetch_posts() and assign_rounds().
 
     Doing these in one transaction is the norm, so having a single
     wrapper function is useful.
+
+    Each run is recorded as a `SyncRun`, along with how long each stage
+    took and the outcome of each feed's download.
+
+    If ``IB2_METRICS_FILE`` is set, the metrics for the run are saved there
+    afterwards, so the web app can report them. They're reset first, so
+    that a process running many syncs (see `ironblogger.daemon`) still
+    saves the metrics for just the latest one.
+
+    ``stop`` is passed on to `fetch_posts`. If it is set before all of the
+    feeds have been fetched, rounds aren't assigned; the next sync will
+    take care of the posts that were fetched.
+
+    If ``IB2_WEBSUB_CALLBACK_BASE`` is set, WebSub subscriptions are
+    requested or renewed afterwards (see `manage_subscriptions`).
+
+    Finally, runs older than ``IB2_SYNC_HISTORY_DAYS`` are deleted (see
+    `prune_sync_history`).
     """
-    fetch_posts()
-    assign_rounds()
+    metrics.tasks.reset()
+    run = SyncRun()
+    db.session.add(run)
+    db.session.commit()
+    try:
+        fetch_posts(run, stop)
+        if stop is not None and stop.is_set():
+            logging.info('Sync stopped early; not assigning rounds.')
+        else:
+            assign_rounds(run=run)
+            if websub.enabled():
+                manage_subscriptions(stop)
+        prune_sync_history()
+    except Exception as e:
+        db.session.rollback()
+        run.error = repr(e)
+        raise
+    finally:
+        run.end_time = datetime.utcnow()
+        db.session.commit()
+        logging.info('Sync finished in %.1f seconds (%s)', run.duration,
+                     ', '.join('%s: %.1f' % (stage,
+                                             getattr(run, stage + '_time'))
+                               for stage in SyncRun.STAGES))
+        if app.config['IB2_METRICS_FILE'] is not None:
+            metrics.write_last_run(app.config['IB2_METRICS_FILE'])
+
+
+def prune_sync_history(days=None):
+    """Delete the sync runs which started more than ``days`` days ago
+    (by default, ``IB2_SYNC_HISTORY_DAYS``), along with their fetches."""
+    if days is None:
+        days = app.config['IB2_SYNC_HISTORY_DAYS']
+        if days is None:
+            return
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    old_runs = db.session.query(SyncRun.id)\
+        .filter(SyncRun.start_time < cutoff)
+    # Bulk deletes don't cascade, so the fetches go first:
+    fetches = db.session.query(FeedFetch)\
+        .filter(FeedFetch.run_id.in_(old_runs.subquery()))\
+        .delete(synchronize_session=False)
+    runs = db.session.query(SyncRun)\
+        .filter(SyncRun.start_time < cutoff)\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    if runs:
+        logging.info('Deleted %d old sync runs (and %d feed fetches).',
+                     runs, fetches)
+
+
+def fetch_posts(run=None, stop=None, shard=None, lease=False):
+    """Download new posts
+
+    If ``run`` is not None, statistics are recorded in that `SyncRun`.
 
+    Blogs which share a feed url are grouped together, and the feed is
+    only downloaded once (see `ironblogger.fetch.fetch_feed`).
 
-def fetch_posts():
-    """Download new posts"""
+    If ``stop`` is not None, it should be a `threading.Event`; once it is
+    set, we finish the feed in progress and then return, leaving the rest
+    for next time.
+
+    ``shard`` and ``lease`` split the work between several hosts; see
+    `ironblogger.fetch`. If ``shard`` is not None, it is a pair ``(k, n)``,
+    and only the ``k``th of ``n`` shards of the blogs is fetched. If
+    ``lease`` is true, blogs are claimed a batch at a time, and only those
+    which are due to be fetched (and not claimed by anyone else) are.
+
+    Either way, blogs whose content is pushed to us via WebSub are only
+    polled every ``IB2_WEBSUB_POLL_INTERVAL`` seconds (see
+    `ironblogger.websub`).
+    """
     logging.info('Syncing posts')
-    blogs = db.session.query(Blog).all()
-    for blog in blogs:
-        try:
-            blog.fetch_posts()
-        except MalformedPostError as e:
-            logging.info('%s', e)
+    if lease:
+        _fetch_leased(run, stop, shard)
+        return
+    chunk_size = app.config['IB2_SYNC_CHUNK_SIZE']
+    # Only the ids and urls are needed to group the blogs by feed; the
+    # blogs themselves are loaded a chunk at a time:
+    blogs = db.session.query(Blog.id, Blog.feed_url)\
+        .filter(websub.polling_due(datetime.utcnow()))
+    if shard is not None:
+        blogs = blogs.filter(shard_filter(shard))
+    feeds = group_by_feed(blogs.yield_per(chunk_size))
+    done = 0
+    for chunk in _chunks(feeds, chunk_size):
+        ids = [row.id for url, rows in chunk for row in rows]
+        loaded = dict((blog.id, blog) for blog in
+                      db.session.query(Blog).filter(Blog.id.in_(ids)))
+        for url, rows in chunk:
+            if stop is not None and stop.is_set():
+                logging.info('Stopping; %d feeds were not fetched.',
+                             len(feeds) - done)
+                db.session.commit()
+                return
+            # Blogs deleted since we listed them are skipped:
+            blogs = [loaded[row.id] for row in rows if row.id in loaded]
+            if blogs:
+                _fetch_feed(blogs, run)
+            done += 1
+        # A feed which failed to parse leaves its changes uncommitted:
+        db.session.commit()
+
+
+def _fetch_leased(run, stop, shard):
+    owner = lease_owner()
+    while True:
+        claimed = claim_blogs(owner, shard)
+        if not claimed:
+            return
+        feeds = group_by_feed(claimed)
+        for i, (url, blogs) in enumerate(feeds):
+            if stop is not None and stop.is_set():
+                logging.info('Stopping; releasing %d claimed feeds.',
+                             len(feeds) - i)
+                for url, unfetched in feeds[i:]:
+                    for blog in unfetched:
+                        release_lease(blog, owner, fetched=False)
+                return
+            blogs = [blog for blog in blogs if renew_lease(blog, owner)]
+            if not blogs:
+                logging.info('Lost our claim on feed %r; skipping it.', url)
+                continue
+            _fetch_feed(blogs, run)
+            for blog in blogs:
+                release_lease(blog, owner)
+
+
+def _fetch_feed(blogs, run):
+    try:
+        fetch_feed(blogs, run)
+    except MalformedPostError as e:
+        logging.info('%s', e)
+        metrics.parse_failures.inc()
+
+
+def manage_subscriptions(stop=None):
+    """Subscribe to the WebSub hubs advertised by our feeds.
+
+    Subscriptions which haven't been requested yet, or which are about to
+    run out, are requested from the hubs; the hubs then verify them with
+    the web app (see `ironblogger.websub`). ``stop`` is as for
+    `fetch_posts`.
+    """
+    feeds = websub.needs_subscription(datetime.utcnow()).all()
+    for feed in feeds:
+        if stop is not None and stop.is_set():
+            break
+        websub.request_subscription(feed)
 
 
 def make_admin():
@@ -1,30 +1,96 @@
+from datetime import datetime
+
+from arrow.arrow import Arrow
+from arrow.parser import TzinfoParser
 
 from .app import app
-from .date import rssdate, from_dbtime
 from .currency import format_usd
 
 
 format_usd = app.template_filter('currency')(format_usd)
 
+# The listing pages format the same handful of timestamps many times over
+# (e.g. every round on /status has the same duedate), and strftime isn't
+# cheap, so we memoize the results. Once the memo gets this big, we just
+# start over:
+MAX_MEMO_SIZE = 4096
+
+_memo = {}
+_tzinfos = {}
+_utc = TzinfoParser.parse('UTC')
+
+
+def _memo_key(date, fmt):
+    """Return a key for `_memo` that distinguishes ``date`` from any value
+    which would format differently.
+
+    Arrows (and aware datetimes) which represent the same instant compare
+    equal even if their timezones differ, so we need to include the timezone
+    in the key.
+    """
+    if isinstance(date, Arrow):
+        return (Arrow, date.naive, str(date.tzinfo), fmt)
+    if isinstance(date, datetime) and date.tzinfo is not None:
+        return (datetime, date.replace(tzinfo=None), str(date.tzinfo), fmt)
+    return (type(date), date, None, fmt)
+
+
+def _memoized(key, fn, *args):
+    """Return ``fn(*args)``, memoized under ``key``."""
+    try:
+        return _memo[key]
+    except KeyError:
+        pass
+    if len(_memo) >= MAX_MEMO_SIZE:
+        _memo.clear()
+    result = _memo[key] = fn(*args)
+    return result
+
+
+def _strftime(date, fmt):
+    return _memoized(_memo_key(date, fmt), date.strftime, fmt)
+
+
+def _local_tzinfo():
+    name = app.config['IB2_TIMEZONE']
+    try:
+        return _tzinfos[name]
+    except KeyError:
+        # Use the same parser as arrow, so we get exactly the same
+        # tzinfo as from_dbtime would:
+        tzinfo = _tzinfos[name] = TzinfoParser.parse(name)
+        return tzinfo
+
 
 @app.template_filter()
 def timestamp_rss(date):
     # XXX: This filter is currently only used on database objects, so we need
     # this to be a dbtime, but it's a bit ugly, since we normally try to avoid
     # doing logic with dbtimes.
-    return rssdate(from_dbtime(date))
+    #
+    # This is equivalent to rssdate(from_dbtime(date)), but skips building
+    # an arrow and all of the sanity checks that go with it; it's called
+    # once for every post in the feed. (It also gets the utc offset right
+    # during the hour repeated at the end of DST, which arrow doesn't.)
+    key = ('rss', date, app.config['IB2_TIMEZONE'])
+    return _memoized(key, _rssdate_from_dbtime, date)
+
+
+def _rssdate_from_dbtime(date):
+    local = date.replace(tzinfo=_utc).astimezone(_local_tzinfo())
+    return local.strftime('%d %b %Y %T %z')
 
 
 @app.template_filter()
 def timestamp_long(date):
-    return date.strftime(app.config['IB2_TIMESTAMP_LONG'])
+    return _strftime(date, app.config['IB2_TIMESTAMP_LONG'])
 
 
 @app.template_filter()
 def timestamp_short(date):
-    return date.strftime(app.config['IB2_TIMESTAMP_SHORT'])
+    return _strftime(date, app.config['IB2_TIMESTAMP_SHORT'])
 
 
 @app.template_filter()
 def datestamp(date):
-    return date.strftime(app.config['IB2_DATESTAMP'])
+    return _strftime(date, app.config['IB2_DATESTAMP'])
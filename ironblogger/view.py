@@ -38,8 +38,11 @@ import flask
 from flask import make_response, request, url_for
 from flask.ext.login import login_user, logout_user, login_required, LoginManager
 
-from .app import app
-from .model import db, Blogger, Blog, Post, Payment, Party, User
+from .app import app, instrumentation
+from . import metrics
+from . import websub
+from .engines import read_only
+from .model import db, Blogger, Blog, Feed, Post, Payment, Party, User
 from .model import DEBT_PER_POST, LATE_PENALTY, MAX_DEBT
 from .date import duedate, round_diff, \
     from_dbtime, to_dbtime, duedate_seek, now
@@ -50,6 +53,10 @@ from sqlalchemy import and_, or_
 from . import template_filters
 
 
+# Number of rounds shown on each page of /status:
+STATUS_PAGE_SIZE = 5
+
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 
@@ -62,7 +69,8 @@ def load_user(user_id):
 
 def render_template(*args, **kwargs):
     kwargs['cfg'] = app.config
-    return flask.render_template(*args, **kwargs)
+    with instrumentation.timer('template_time'):
+        return flask.render_template(*args, **kwargs)
 
 
 class PostStatus(object):
@@ -143,9 +151,8 @@ class RoundStatus(object):
 
 
 @app.route('/status')
+@read_only
 def show_status():
-    DEFAULT_PAGE_SIZE = 5
-
     # Find the first round:
     first_round = db.session.query(Blogger.start_date)\
         .order_by(Blogger.start_date.asc()).first()
@@ -154,7 +161,7 @@ def show_status():
         return render_template('status.html',
                                rounds=[],
                                pageinfo=_page_args(item_count=0,
-                                                   size=DEFAULT_PAGE_SIZE))
+                                                   size=STATUS_PAGE_SIZE))
     # SQLAlchemy returns a tuple of the rows, so to actually get the date
     # object, we need to extract it:
     first_round = first_round[0]
@@ -168,7 +175,7 @@ def show_status():
     # Work out how many pages there are, and what the bounds of the current page
     # are:
     num_rounds = round_diff(current_round, first_round)
-    pageinfo = _page_args(item_count=num_rounds, size=DEFAULT_PAGE_SIZE)
+    pageinfo = _page_args(item_count=num_rounds, size=STATUS_PAGE_SIZE)
     start_round = duedate_seek(current_round, -(pageinfo['size'] * pageinfo['num']))
     stop_round = duedate_seek(start_round, -pageinfo['size'])
 
@@ -269,6 +276,7 @@ def build_ledger(start, stop):
 
 
 @app.route('/ledger')
+@read_only
 def show_ledger():
     info = []
     parties = db.session.query(Party).order_by(Party.date.desc()).all()
@@ -292,14 +300,17 @@ def show_ledger():
 
 
 @app.route('/bloggers')
+@read_only
 def show_bloggers():
     return render_template('bloggers.html',
                            bloggers=db.session.query(Blogger).order_by(Blogger.name).all())
 
 
 @app.route('/rss')
+@read_only
 def show_rss():
-    posts = db.session.query(Post).order_by(Post.timestamp.desc())
+    posts = db.session.query(Post).order_by(Post.timestamp.desc(),
+                                            Post.id.desc())
     resp = make_response(render_template('rss.xml', posts=posts), 200)
     resp.headers['Content-Type'] = 'application/rss+xml'
     return resp
@@ -363,11 +374,13 @@ def _page_filter(query, page):
 
 
 @app.route('/posts')
+@read_only
 def show_posts():
     post_count = db.session.query(Post).count()
     pageinfo = _page_args(item_count=post_count)
+    # Ties are broken by id, as the static site export expects:
     posts = db.session.query(Post)\
-        .order_by(Post.timestamp.desc())
+        .order_by(Post.timestamp.desc(), Post.id.desc())
     posts = _page_filter(posts, pageinfo).all()
     return render_template('posts.html',
                            pageinfo=pageinfo,
@@ -380,10 +393,47 @@ def show_index():
 
 
 @app.route('/about')
+@read_only
 def show_about():
     return render_template('about.html')
 
 
+@app.route('/metrics')
+def show_metrics():
+    if not app.config['IB2_METRICS']:
+        flask.abort(404)
+    resp = make_response(metrics.render_all(app.config['IB2_METRICS_FILE']),
+                         200)
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return resp
+
+
+@app.route('/websub/<int:feed_id>', methods=['GET', 'POST'])
+def websub_callback(feed_id):
+    """Callback for WebSub hubs; see `ironblogger.websub`."""
+    feed = db.session.query(Feed).get(feed_id)
+    if feed is None:
+        flask.abort(404)
+    if request.method == 'GET':
+        challenge = websub.verify_intent(feed, request.args)
+        if challenge is None:
+            flask.abort(404)
+        resp = make_response(challenge, 200)
+        resp.headers['Content-Type'] = 'text/plain'
+        return resp
+    # Don't buffer more than we'd download when polling the feed:
+    limit = app.config['IB2_FETCH_MAX_SIZE']
+    if request.content_length is not None and request.content_length > limit:
+        flask.abort(413)
+    body = request.stream.read(limit + 1)
+    if len(body) > limit:
+        flask.abort(413)
+    websub.receive(feed, body, request.headers.get('X-Hub-Signature'))
+    # The hub gets a success response even if we ignored the content; the
+    # spec doesn't want it to learn whether the signature was any good:
+    return make_response('', 202)
+
+
 @app.route('/login', methods=['POST'])
 def do_login():
     user = load_user(request.form['username'])
@@ -0,0 +1,245 @@
+"""Push-based ingestion, via WebSub (formerly PubSubHubbub).
+
+Many blog platforms advertise a WebSub hub in their feeds: rather than
+polling the feed, a subscriber asks the hub to POST new content to a
+callback url whenever the feed changes. This module is the subscriber side:
+
+* When a feed is fetched, the hub and topic it advertises (if any) are
+  recorded in its `Feed` (see `ironblogger.fetch`).
+* `ironblogger.tasks.manage_subscriptions` (run as part of `sync`) asks the
+  hubs to subscribe us to each such feed, and to renew subscriptions
+  before they run out (`request_subscription`).
+* The hub then checks that we really asked, by making a GET request to our
+  callback (``/websub/<feed id>``, see `verify_intent`). Once verified,
+  the subscription is active until ``push_expires``.
+* Pushed content arrives as a POST to the same url. It's signed with the
+  secret we gave the hub (`check_signature`), and stored through the same
+  path as polled content (`receive`).
+
+Blogs whose feed has an active subscription are still polled, but only
+every ``IB2_WEBSUB_POLL_INTERVAL`` seconds, as a safety net against hubs
+which drop notifications.
+
+The following config options are recognized:
+
+    IB2_WEBSUB_CALLBACK_BASE - The public base url of the app, e.g.
+                               ``https://ironblogger.example.com``; the
+                               hub has to be able to reach our callbacks
+                               there. Defaults to None, which disables
+                               subscribing.
+    IB2_WEBSUB_LEASE_SECONDS - How long to ask the hub to keep each
+                               subscription. Hubs may choose otherwise.
+    IB2_WEBSUB_POLL_INTERVAL - Seconds between polls of push-enabled feeds.
+
+Pushed content bigger than ``IB2_FETCH_MAX_SIZE`` (see `ironblogger.fetch`)
+is refused.
+
+Like the rest of the web app, this module doesn't import feedparser; only
+receiving pushed content does.
+"""
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+from datetime import datetime, timedelta
+
+import six
+from six.moves.urllib.parse import urlencode
+from six.moves.urllib.request import urlopen
+from sqlalchemy import or_
+
+from . import metrics
+from .app import app
+from .model import db, Blog, Feed
+
+app.config.setdefault('IB2_WEBSUB_CALLBACK_BASE', None)
+app.config.setdefault('IB2_WEBSUB_LEASE_SECONDS', 7 * 24 * 60 * 60)
+app.config.setdefault('IB2_WEBSUB_POLL_INTERVAL', 24 * 60 * 60)
+# Also set by ironblogger.fetch, which the web app doesn't import:
+app.config.setdefault('IB2_FETCH_MAX_SIZE', 10 * 1024 * 1024)
+
+# Subscriptions are renewed this long before they run out:
+RENEW_MARGIN = timedelta(days=1)
+# If a hub hasn't verified a request after this long, we ask again:
+RETRY_INTERVAL = timedelta(hours=1)
+# Seconds to wait for a hub to answer a subscription request:
+HUB_TIMEOUT = 30
+
+SIGNATURE_ALGORITHMS = {
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'sha384': hashlib.sha384,
+    'sha512': hashlib.sha512,
+}
+
+
+def enabled():
+    return app.config['IB2_WEBSUB_CALLBACK_BASE'] is not None
+
+
+def callback_url(feed):
+    """Return the url at which the hub should notify us about ``feed``."""
+    return '%s/websub/%d' % (app.config['IB2_WEBSUB_CALLBACK_BASE']
+                             .rstrip('/'), feed.id)
+
+
+def push_active(now):
+    """Return a filter selecting the feeds with an active subscription."""
+    return Feed.push_expires > now
+
+
+def polling_due(now):
+    """Return a filter selecting the blogs which should be polled.
+
+    That's all of them, except those whose feed has an active subscription
+    and which were polled less than ``IB2_WEBSUB_POLL_INTERVAL`` ago.
+    """
+    due = now - timedelta(seconds=app.config['IB2_WEBSUB_POLL_INTERVAL'])
+    pushed = db.session.query(Feed.id).filter(push_active(now))
+    return or_(Blog.feed_id == None,
+               Blog.last_fetched == None,
+               Blog.last_fetched < due,
+               ~Blog.feed_id.in_(pushed))
+
+
+def discover_hub(feed, hub, topic):
+    """Record the ``hub`` and ``topic`` advertised by ``feed``.
+
+    If they've changed, any existing subscription is forgotten; a new one
+    will be requested on the next sync. ``hub`` is None if the feed no
+    longer advertises one, in which case we go back to polling it.
+    """
+    if (hub, topic) == (feed.hub, feed.topic):
+        return
+    if hub is None:
+        logging.info('Feed %r no longer advertises a hub.', feed.url)
+    else:
+        logging.info('Feed %r advertises hub %r.', feed.url, hub)
+    feed.hub = hub
+    feed.topic = topic
+    feed.push_requested = None
+    feed.push_expires = None
+
+
+def needs_subscription(now):
+    """Return a query for the feeds we should (re)subscribe to."""
+    return db.session.query(Feed)\
+        .filter(Feed.hub != None,
+                Feed.blogs.any(),
+                or_(Feed.push_expires == None,
+                    Feed.push_expires < now + RENEW_MARGIN),
+                or_(Feed.push_requested == None,
+                    Feed.push_requested < now - RETRY_INTERVAL))\
+        .order_by(Feed.id)
+
+
+def request_subscription(feed):
+    """Ask ``feed``'s hub to subscribe us to it.
+
+    The hub verifies the request asynchronously (see `verify_intent`).
+    Returns whether the hub accepted the request.
+    """
+    if feed.secret is None:
+        feed.secret = binascii.hexlify(os.urandom(20)).decode('ascii')
+    feed.push_requested = datetime.utcnow()
+    db.session.commit()
+    params = {
+        'hub.callback': callback_url(feed),
+        'hub.mode': 'subscribe',
+        'hub.topic': feed.topic,
+        'hub.lease_seconds': str(app.config['IB2_WEBSUB_LEASE_SECONDS']),
+        'hub.secret': feed.secret,
+    }
+    try:
+        response = urlopen(feed.hub, urlencode(params).encode('ascii'),
+                           HUB_TIMEOUT)
+        response.close()
+    except Exception as e:
+        logging.info('Subscribing to %r via %r failed: %s',
+                     feed.topic, feed.hub, e)
+        return False
+    logging.info('Requested subscription to %r via %r.', feed.topic, feed.hub)
+    return True
+
+
+def verify_intent(feed, args):
+    """Handle a verification request from the hub.
+
+    ``args`` are the request's query parameters. Returns the challenge to
+    echo back if we agree to the request, or None if we don't.
+    """
+    mode = args.get('hub.mode')
+    topic = args.get('hub.topic')
+    wanted = feed.hub is not None and topic == feed.topic
+    if mode == 'denied':
+        # Anyone can make this request, so it only counts for the topic
+        # we've asked about:
+        if not wanted or feed.push_requested is None:
+            return None
+        logging.info('Hub %r denied our subscription to %r: %s',
+                     feed.hub, topic, args.get('hub.reason'))
+        feed.push_expires = None
+        db.session.commit()
+        return ''
+    challenge = args.get('hub.challenge')
+    if challenge is None:
+        return None
+    if mode == 'subscribe':
+        if not wanted or feed.push_requested is None:
+            return None
+        try:
+            lease = int(args.get('hub.lease_seconds'))
+        except (TypeError, ValueError):
+            lease = app.config['IB2_WEBSUB_LEASE_SECONDS']
+        feed.push_expires = datetime.utcnow() + timedelta(seconds=lease)
+        feed.push_requested = None
+        db.session.commit()
+        logging.info('Subscribed to %r for %d seconds.', topic, lease)
+        return challenge
+    if mode == 'unsubscribe':
+        # We never ask to unsubscribe ourselves, but we don't mind if the
+        # feed has moved on to another hub or topic:
+        if wanted:
+            return None
+        return challenge
+    return None
+
+
+def check_signature(feed, body, header):
+    """Return whether ``header`` (the X-Hub-Signature header) is a valid
+    signature of ``body``, with ``feed``'s secret."""
+    if feed.secret is None:
+        # We always send a secret, so unsigned content isn't from our hub:
+        return False
+    if header is None or '=' not in header:
+        return False
+    algorithm, signature = header.split('=', 1)
+    digestmod = SIGNATURE_ALGORITHMS.get(algorithm.lower())
+    if digestmod is None:
+        return False
+    expected = hmac.new(feed.secret.encode('utf-8'), body,
+                        digestmod).hexdigest()
+    try:
+        return hmac.compare_digest(six.text_type(expected),
+                                   six.text_type(signature.strip().lower()))
+    except (TypeError, UnicodeDecodeError):
+        # Non-ascii garbage:
+        return False
+
+
+def receive(feed, body, signature):
+    """Store the content pushed to us for ``feed``.
+
+    Returns whether the content was accepted. Content which isn't signed
+    with our secret is ignored, as the spec requires.
+    """
+    if not check_signature(feed, body, signature):
+        logging.info('Ignoring content for %r with a bad signature.',
+                     feed.url)
+        metrics.websub_rejected.inc()
+        return False
+    metrics.websub_received.inc()
+    from .fetch import ingest_pushed
+    ingest_pushed(feed, body)
+    return True
@@ -9,12 +9,50 @@ wsgi-prescribed name "application." The actual wsgi script can just do:
     application.config.update(
     ...
     )
+
+The admin interface is the exception: since the config isn't known until
+after this module is imported, it's loaded (if ``IB2_ENABLE_ADMIN`` is set)
+at the start of the first request instead. When it's disabled, workers
+never import flask_admin (or wtforms) at all.
 """
-from .app import app as application
+import threading
+
+from .app import app as application, assets as _assets
+from .assets import LAYOUT_ASSETS
 from . import view as _view
 from . import model as _model
-from . import admin as _admin
+from . import bytecode_cache as _bytecode_cache
+
+# Hash the static assets up front, rather than on the first request:
+_assets.warm(LAYOUT_ASSETS)
 
 # Some tools will complain about the unused imports, so we use them in a dummy
 # statement to silence these warnings:
-application, _view, _model, _admin
+application, _view, _model, _bytecode_cache
+
+
+def _load_admin_first(wsgi_app):
+    """Wrap ``wsgi_app`` so that the admin module is loaded before the first
+    request is routed.
+
+    Flask's before_first_request hooks run too late for this; by the time
+    they're called, the first request has already been matched against the
+    URL map.
+    """
+    lock = threading.Lock()
+    loaded = []
+
+    def wrapper(environ, start_response):
+        if not loaded:
+            with lock:
+                if not loaded:
+                    if application.config['IB2_ENABLE_ADMIN']:
+                        # Imported for the side effect of registering the
+                        # admin views:
+                        from . import admin
+                    loaded.append(True)
+        return wsgi_app(environ, start_response)
+    return wrapper
+
+
+application.wsgi_app = _load_admin_first(application.wsgi_app)
@@ -50,4 +50,7 @@ setup(name='ironblogger',
           #
           # for postgresql:
           # 'psycopg2',
+          #
+          # Optional; enables brotli compression of responses:
+          # 'brotli',
       ])
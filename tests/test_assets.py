@@ -0,0 +1,95 @@
+"""Tests for fingerprinting of static assets."""
+import os
+
+import pytest
+from flask import url_for
+
+from ironblogger.app import app, assets
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_url_for_fingerprinted():
+    url = url_for('static', filename='style.css')
+    assert url == '/static/style.css?v=' + assets.fingerprint('style.css')
+    assert assets.asset_url('style.css') == url
+
+
+def test_missing_file_not_fingerprinted():
+    assert url_for('static', filename='no-such-file.css') == \
+        '/static/no-such-file.css'
+
+
+def test_layout_uses_fingerprints(client):
+    resp = client.get('/about')
+    assert assets.fingerprint('style.css').encode('ascii') in resp.data
+
+
+def test_fingerprinted_url_cached_forever(client):
+    resp = client.get(url_for('static', filename='style.css'))
+    assert resp.status_code == 200
+    assert 'immutable' in resp.headers['Cache-Control']
+    assert 'max-age=31536000' in resp.headers['Cache-Control']
+
+
+@pytest.mark.parametrize('url', [
+    '/static/style.css',
+    '/static/style.css?v=stale',
+])
+def test_other_urls_not_cached_forever(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert 'immutable' not in resp.headers.get('Cache-Control', '')
+
+
+@pytest.fixture
+def static_folder(monkeypatch, tmpdir):
+    """Serve static files from a temporary directory, with a stylesheet
+    referencing a font by absolute and relative urls."""
+    tmpdir.join('fonts', 'font.woff').write(b'font', ensure=True)
+    tmpdir.join('css', 'style.css').write(
+        u"@font-face { src: url('/static/fonts/font.woff?#iefix'), "
+        u"url(../fonts/font.woff?v=4.7.0), url(missing.woff), "
+        u"url(data:font/woff;base64,AAAA); }", ensure=True)
+    monkeypatch.setattr(app, 'static_folder', str(tmpdir))
+    monkeypatch.setattr(assets, '_cache', {})
+    return tmpdir
+
+
+def test_stylesheet_references_fingerprinted(client, static_folder):
+    font = assets.fingerprint('fonts/font.woff')
+    resp = client.get(url_for('static', filename='css/style.css'))
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/css'
+    assert 'immutable' in resp.headers['Cache-Control']
+    assert resp.data.decode('utf-8') == (
+        "@font-face { src: url('/static/fonts/font.woff?v=%s#iefix'), "
+        "url(../fonts/font.woff?v=%s), url(missing.woff), "
+        "url(data:font/woff;base64,AAAA); }" % (font, font))
+
+    resp = client.get('/static/css/style.css',
+                      headers={'If-None-Match': resp.headers['ETag']})
+    assert resp.status_code == 304
+
+
+def test_fingerprints_cached(static_folder):
+    """Outside of debug mode, files aren't looked at again."""
+    font = assets.fingerprint('fonts/font.woff')
+    before = assets.fingerprint('css/style.css')
+    os.remove(str(static_folder.join('fonts', 'font.woff')))
+    assert assets.fingerprint('fonts/font.woff') == font
+    assert assets.fingerprint('css/style.css') == before
+
+
+def test_debug_not_cached(monkeypatch, static_folder):
+    monkeypatch.setattr(app, 'debug', True)
+    before = assets.fingerprint('css/style.css')
+    static_folder.join('fonts', 'font.woff').write(b'changed')
+    # The stylesheet's digest covers the fonts it references:
+    assert assets.fingerprint('css/style.css') != before
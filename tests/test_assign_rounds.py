@@ -1,9 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from random import Random
 import unittest
 import pytest
 from .util import fresh_context
 from .util.example_data import databases as example_databases
 
+from ironblogger.app import app
 from ironblogger.model import db, Blogger, Blog, Post
 from ironblogger.date import duedate, from_dbtime, to_dbtime
 from ironblogger import tasks
@@ -104,3 +106,41 @@ class Test_assign_rounds(unittest.TestCase):
         self.verify_assignment(datetime(2016, 11, 5), "neigh", 0)
         self.verify_assignment(datetime(2016, 11, 10), "over",  0)
         assert posts[2].counts_for is None
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_chunked(monkeypatch, seed):
+    """Assigning rounds a few posts at a time gives the same results as
+    doing them all at once."""
+    rand = Random(seed)
+    first = datetime(2015, 1, 1)
+    for n in range(3):
+        blogger = Blogger(name='Blogger %d' % n,
+                          start_date=first + timedelta(rand.randint(0, 60)))
+        blog = Blog(blogger=blogger,
+                    title='Blog %d' % n,
+                    page_url='http://example.com/%d/' % n,
+                    feed_url='http://example.com/%d/feed.xml' % n)
+        timestamp = first
+        for i in range(40):
+            # Some posts share a timestamp, which chunks mustn't split:
+            if rand.random() < 0.8:
+                timestamp = first + timedelta(
+                    seconds=rand.randint(0, 120 * 24 * 60 * 60))
+            db.session.add(Post(blog=blog,
+                                timestamp=timestamp,
+                                title='Post %d' % i,
+                                summary='Lorem ipsum.',
+                                page_url='%s%d.html' % (blog.page_url, i)))
+    db.session.commit()
+
+    def assignments(chunk_size):
+        monkeypatch.setitem(app.config, 'IB2_SYNC_CHUNK_SIZE', chunk_size)
+        db.session.query(Post).update({Post.counts_for: None})
+        tasks.assign_rounds(until=datetime(2015, 6, 1))
+        return db.session.query(Post.id, Post.counts_for)\
+            .order_by(Post.id).all()
+
+    assigned = assignments(10000)
+    assert len([a for a in assigned if a[1] is not None]) > 10
+    assert assignments(3) == assigned
@@ -0,0 +1,43 @@
+"""Tests for the template bytecode cache."""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from ironblogger.app import app
+from ironblogger.bytecode_cache import precompile_templates
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.yield_fixture
+def cache_dir():
+    path = tempfile.mkdtemp()
+    old_dir = app.config['IB2_TEMPLATE_CACHE_DIR']
+    app.config['IB2_TEMPLATE_CACHE_DIR'] = os.path.join(path, 'cache')
+    yield app.config['IB2_TEMPLATE_CACHE_DIR']
+    app.config['IB2_TEMPLATE_CACHE_DIR'] = old_dir
+    app.jinja_env.bytecode_cache = None
+    shutil.rmtree(path)
+
+
+def test_precompile_templates(cache_dir):
+    # The cache is consulted when a template is loaded, so make sure
+    # nothing is already loaded:
+    app.jinja_env.cache.clear()
+    names = precompile_templates()
+    for name in 'layout.html', 'posts.html', 'status.html', 'rss.xml':
+        assert name in names
+    assert len(os.listdir(cache_dir)) == len(names)
+
+
+def test_cache_disabled(cache_dir):
+    app.config['IB2_TEMPLATE_CACHE'] = False
+    try:
+        app.jinja_env.cache.clear()
+        precompile_templates()
+        assert not os.path.exists(cache_dir)
+    finally:
+        app.config['IB2_TEMPLATE_CACHE'] = True
@@ -1,5 +1,136 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from .util import fresh_context
+
+# Budget for starting the ironblogger command and parsing its arguments, in
+# seconds. This is on the order of 10x what it actually takes, so slow
+# machines don't cause spurious failures, but pulling in e.g. flask or
+# sqlalchemy will blow it.
+STARTUP_BUDGET = 0.3
+
+# Modules which no command needs just to start up:
+HEAVY_MODULES = ['alembic', 'yaml', 'feedparser', 'flask', 'flask_admin',
+                 'flask_mail', 'sqlalchemy', 'werkzeug', 'jinja2']
+
+# Modules which only the web app needs:
+WEB_MODULES = ['ironblogger.wsgi', 'ironblogger.view', 'ironblogger.admin',
+               'ironblogger.bytecode_cache', 'flask_admin']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'scripts', 'ironblogger')
+
+# Runs the ironblogger script with the arguments given, and prints the time
+# it took and the modules it loaded:
+_script_runner = """
+import atexit, sys, time
+start = time.time()
+def report():
+    sys.stderr.write('\\n%%f %%s\\n' %% (time.time() - start,
+                                       ' '.join(sorted(sys.modules))))
+atexit.register(report)
+sys.argv = ['ironblogger'] + %r
+__file__ = %r
+exec(compile(open(__file__).read(), __file__, 'exec'))
+"""
+
 
 def test_import():
     """Basic sanity: import the cli module without exploding."""
     # Most of the logic happens at import time, so this isn't totally trivial.
     import ironblogger.cli
+
+
+def _run_python(script):
+    return subprocess.check_output([sys.executable, '-c', script])\
+        .decode('ascii').strip()
+
+
+def _run_script(args, env={}):
+    """Run the ironblogger script with ``args``.
+
+    Returns the time it took, and the set of modules it loaded.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, **env)
+    proc = subprocess.Popen([sys.executable, '-W', 'ignore', '-c',
+                             _script_runner % (args, SCRIPT)],
+                            env=env, cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    elapsed, modules = err.decode('utf-8').strip().splitlines()[-1]\
+        .split(' ', 1)
+    return float(elapsed), set(modules.split())
+
+
+def test_startup_time():
+    """Starting the command is fast, and doesn't import the world."""
+    elapsed = min(_run_script(['--help'])[0] for i in range(3))
+    assert elapsed < STARTUP_BUDGET
+    loaded = _run_script(['--help'])[1]
+    assert [name for name in HEAVY_MODULES if name in loaded] == []
+
+
+def test_config_file(tmpdir):
+    """With IB2_CONFIG, commands run without the web app."""
+    config = tmpdir.join('ib2.cfg')
+    config.write("IB2_TIMEZONE = 'US/Eastern'\n"
+                 "SQLALCHEMY_DATABASE_URI = 'sqlite:///%s'\n" %
+                 tmpdir.join('ib2.db'))
+    env = {'IB2_CONFIG': str(config)}
+    _run_script(['init-db'], env)
+    loaded = _run_script(['export'], env)[1]
+    assert [name for name in WEB_MODULES if name in loaded] == []
+
+
+def test_tasks_defer_imports():
+    """Dependencies of individual tasks aren't imported with the module."""
+    loaded = _run_python(
+        'import sys, warnings; warnings.simplefilter("ignore"); '
+        'import ironblogger.tasks; print(" ".join(sorted(sys.modules)))')\
+        .split()
+    assert [name for name in ['alembic', 'yaml'] if name in loaded] == []
+
+
+def test_commands_resolve():
+    """Every command's function can be imported."""
+    from ironblogger.cli import commands, resolve
+    for cmd in commands.values():
+        assert callable(resolve(cmd['fn']))
+
+
+context = pytest.yield_fixture(fresh_context)
+
+
+def test_profile(context, tmpdir, capsys):
+    """--profile saves stats, and prints a report to stderr."""
+    import pstats
+    from ironblogger.cli import main
+    path = str(tmpdir.join('out.prof'))
+    main(['--profile=' + path, 'export'])
+    out, err = capsys.readouterr()
+    assert 'cumulative' in err
+    # The report shouldn't end up in the command's output:
+    assert 'cumulative' not in out
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_bare_profile_flag():
+    """A bare --profile doesn't swallow the command name."""
+    from ironblogger.cli import main_parser, _expand_profile_flag
+    from ironblogger.profiling import DEFAULT_PROFILE_PATH
+    args = main_parser.parse_args(_expand_profile_flag(['--profile', 'sync']))
+    assert args.profile == DEFAULT_PROFILE_PATH
+    args = main_parser.parse_args(_expand_profile_flag(['sync']))
+    assert args.profile is None
+
+
+def test_trace_memory(capsys):
+    from ironblogger.profiling import memory_traced
+    with memory_traced():
+        [object() for i in range(1000)]
+    out, err = capsys.readouterr()
+    assert 'Peak' in err
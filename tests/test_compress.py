@@ -0,0 +1,82 @@
+"""Tests for compression of response bodies."""
+import gzip
+from io import BytesIO
+
+import pytest
+
+from ironblogger import compress as compress_module
+from ironblogger.app import app, compress
+from .util.example_data import databases as example_databases
+from .util import fresh_context
+from ironblogger.model import db
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+
+@pytest.mark.parametrize('path', ['/posts', '/rss', '/about'])
+def test_gzip(client, path):
+    db.session.add(example_databases[1]())
+    db.session.commit()
+    plain = client.get(path)
+    assert 'Content-Encoding' not in plain.headers
+    resp = client.get(path, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in resp.headers['Vary']
+    assert _gunzip(resp.data) == plain.data
+
+
+def test_gzip_refused(client):
+    resp = client.get('/about', headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_small_body_not_compressed(client):
+    app.config['IB2_COMPRESS_MIN_SIZE'] = 10 ** 9
+    try:
+        resp = client.get('/about', headers={'Accept-Encoding': 'gzip'})
+    finally:
+        app.config['IB2_COMPRESS_MIN_SIZE'] = 500
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_repeat_hits_use_cache(client, monkeypatch):
+    first = client.get('/about', headers={'Accept-Encoding': 'gzip'})
+
+    def fail(data, level):
+        assert False, "Compressed the same body twice."
+    monkeypatch.setitem(compress_module._compressors, 'gzip', fail)
+    second = client.get('/about', headers={'Accept-Encoding': 'gzip'})
+    assert first.data == second.data
+
+
+def test_cache_bounded():
+    app.config['IB2_COMPRESS_CACHE_SIZE'] = 2
+    try:
+        for i in range(5):
+            compress.compress(('body %d' % i).encode('ascii'), 'gzip')
+        assert len(compress._cache) == 2
+    finally:
+        app.config['IB2_COMPRESS_CACHE_SIZE'] = 128
+
+
+def test_brotli_level(monkeypatch):
+    qualities = []
+
+    class FakeBrotli(object):
+        @staticmethod
+        def compress(data, quality=11):
+            qualities.append(quality)
+            return data
+    monkeypatch.setattr(compress_module, 'brotli', FakeBrotli)
+    monkeypatch.setitem(app.config, 'IB2_COMPRESS_LEVEL', 4)
+    compress.compress(b'brotli level', 'br')
+    assert qualities == [4]
@@ -0,0 +1,91 @@
+"""Tests for the sync daemon."""
+import threading
+from datetime import datetime
+
+import pytest
+
+from ironblogger import tasks
+from ironblogger.daemon import Scheduler, PidLock, AlreadyRunningError, \
+    every, before_deadline, make_scheduler
+from ironblogger.date import duedate, now
+from ironblogger.model import db, Blog, Blogger, SyncRun
+from .util import fresh_context
+from .util.feedserver import FeedServer
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+def test_scheduler():
+    """Jobs run until stopped, and a failing job doesn't stop the others."""
+    scheduler = Scheduler()
+    calls = []
+
+    def fail():
+        calls.append('fail')
+        raise Exception('Oops')
+
+    def count():
+        calls.append('count')
+        if calls.count('count') == 3:
+            scheduler.stop.set()
+
+    scheduler.add('fail', fail, every(0))
+    scheduler.add('count', count, every(0))
+    scheduler.run()
+    assert calls.count('count') == 3
+    assert calls.count('fail') >= 2
+
+
+def test_every():
+    next_time = every(60)
+    assert next_time(1000) == 1000
+    assert next_time(1010) == 1060
+    # If a run overruns the interval, the next one starts right away:
+    assert next_time(1200) == 1200
+
+
+def test_before_deadline():
+    current = now().timestamp
+    when = before_deadline(24)(current)
+    assert when > current
+    due = duedate(now()).timestamp
+    assert when - due in (-24 * 60 * 60, 6 * 24 * 60 * 60)
+
+
+def test_pid_lock(tmpdir):
+    path = str(tmpdir.join('daemon.lock'))
+    with PidLock(path):
+        with pytest.raises(AlreadyRunningError):
+            PidLock(path).acquire()
+    # Once released, it can be taken again:
+    with PidLock(path):
+        pass
+
+
+def test_stop_finishes_current_feed(monkeypatch):
+    """Once stopped, the sync finishes the feed in progress, and no more."""
+    stop = threading.Event()
+    fetch_feed = tasks.fetch_feed
+
+    def fetch_then_stop(blogs, run):
+        stop.set()
+        fetch_feed(blogs, run)
+    monkeypatch.setattr(tasks, 'fetch_feed', fetch_then_stop)
+
+    with FeedServer(num_feeds=3, posts_per_feed=2) as server:
+        blogger = Blogger(name='Alice', start_date=datetime(2015, 1, 1))
+        for n in range(server.num_feeds):
+            db.session.add(Blog(blogger=blogger,
+                                title='Blog %d' % n,
+                                page_url=server.page_url(n),
+                                feed_url=server.feed_url(n)))
+        db.session.commit()
+        scheduler = make_scheduler(stop)
+        scheduler.run()
+
+    run = db.session.query(SyncRun).one()
+    assert run.feeds_fetched == 1
+    assert run.end_time is not None
+    # Rounds weren't assigned, since the sync was cut short:
+    assert run.assign_time == 0
+    assert sum(len(blog.posts) for blog in db.session.query(Blog)) == 2
@@ -9,6 +9,7 @@ from jinja2 import Template
 from .util import fresh_context
 from .util.feed import feedtext_to_blog
 from ironblogger.model import db, Post
+from ironblogger.fetch import fetch_blog
 
 fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
 
@@ -57,7 +58,7 @@ changes = {
 def test_detect_change(to_keep):
     blog = feedtext_to_blog(feed_template.render(**original_post))
     db.session.add(blog)
-    blog.fetch_posts()
+    fetch_blog(blog)
     assert Post.query.count() == 1, "Wrong number of posts on initial import"
 
     new_post = original_post.copy()
@@ -66,17 +67,17 @@ def test_detect_change(to_keep):
             new_post[key] = changes[key]
     with open(blog.feed_url, 'w') as f:
         f.write(feed_template.render(**new_post))
-    blog.fetch_posts()
+    fetch_blog(blog)
     assert Post.query.count() == 1, "Post dedup failed"
 
 
 def test_no_dedup_new():
     blog = feedtext_to_blog(feed_template.render(**original_post))
     db.session.add(blog)
-    blog.fetch_posts()
+    fetch_blog(blog)
     assert Post.query.count() == 1, "Wrong number of posts on initial import"
 
     with open(blog.feed_url, 'w') as f:
         f.write(feed_template.render(**changes))
-    blog.fetch_posts()
+    fetch_blog(blog)
     assert Post.query.count() == 2, "New post was not counted correctly."
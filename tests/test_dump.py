@@ -0,0 +1,93 @@
+"""Tests for dumping and restoring the whole database."""
+from datetime import date, datetime
+
+import pytest
+import sqlalchemy as sa
+from six import StringIO
+
+from ironblogger import dump
+from ironblogger.date import duedate, duedate_seek, from_dbtime, to_dbtime
+from ironblogger.dump import dump_db, restore_db, RestoreError
+from ironblogger.model import db, Blog, Blogger, Party, Payment, Post, User
+from ironblogger.tasks import sync
+from .util import fresh_context
+from .util.example_data import databases as example_databases
+from .util.feedserver import FeedServer
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+def populate():
+    for database in example_databases:
+        db.session.add(database())
+    alice = db.session.query(Blogger).filter_by(name='Alice').one()
+    first = duedate(from_dbtime(datetime(2015, 4, 6)))
+    last = duedate_seek(first, 3)
+    db.session.add(Payment(blogger=alice, duedate=to_dbtime(first),
+                           amount=500))
+    db.session.add(Party(date=date(2015, 5, 2), spent=2500,
+                         first_duedate=to_dbtime(first),
+                         last_duedate=to_dbtime(last)))
+    user = User(name='alice', is_admin=True, blogger=alice)
+    user.set_password('hunter2')
+    db.session.add(user)
+    db.session.commit()
+    # This fills in feeds, sync runs, and compressed summaries:
+    with FeedServer(num_feeds=2, posts_per_feed=3) as server:
+        for n in range(server.num_feeds):
+            db.session.add(Blog(blogger=alice,
+                                title='Blog %d' % n,
+                                page_url=server.page_url(n),
+                                feed_url=server.feed_url(n)))
+        db.session.commit()
+        sync()
+
+
+def contents():
+    """Return the rows of every table."""
+    return dict((table.name, db.session.execute(
+        sa.select([table]).order_by(*table.primary_key.columns)).fetchall())
+        for table in db.metadata.sorted_tables)
+
+
+@pytest.mark.parametrize('batch_size', [2, 1000])
+def test_round_trip(monkeypatch, batch_size):
+    monkeypatch.setattr(dump, 'BATCH_SIZE', batch_size)
+    populate()
+    before = contents()
+    assert all(before.values())
+
+    out = StringIO()
+    dump_db(out)
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    restore_db(StringIO(out.getvalue()))
+    assert contents() == before
+
+    # New rows get fresh ids:
+    blog = db.session.query(Blog).first()
+    post = Post(blog=blog, timestamp=datetime(2015, 5, 1), title='New',
+                summary='Hello', page_url='http://example.com/new.html')
+    db.session.add(post)
+    db.session.commit()
+    assert post.id == max(row.id for row in before['post']) + 1
+
+
+def test_not_empty():
+    populate()
+    out = StringIO()
+    dump_db(out)
+    with pytest.raises(RestoreError):
+        restore_db(StringIO(out.getvalue()))
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    'bloggers:\n  alice: {}\n',
+    '{"format": "ironblogger-dump", "version": 2, "revision": null}\n',
+    '{"format": "ironblogger-dump", "version": 1, "revision": "abc"}\n',
+])
+def test_not_a_dump(text):
+    with pytest.raises(RestoreError):
+        restore_db(StringIO(text))
@@ -0,0 +1,143 @@
+"""Tests for the engine routing and the SQLite production profile."""
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from ironblogger import engines
+from ironblogger.app import app, db
+from ironblogger.model import Blogger
+from .util.example_data import databases as example_databases
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.yield_fixture
+def sqlite_file():
+    """Switch to an on-disk SQLite database with the production profile."""
+    path = tempfile.mkdtemp()
+    old_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    db.session.remove()
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(path, 'ib2.db'),
+        IB2_SQLITE_PRODUCTION=True,
+        IB2_SQLITE_BUSY_TIMEOUT=100,
+    )
+    db.create_all()
+    db.session.add(example_databases[0]())
+    db.session.commit()
+    yield
+    db.session.remove()
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=old_uri,
+        IB2_SQLITE_PRODUCTION=False,
+    )
+    shutil.rmtree(path)
+
+
+def test_pragmas(sqlite_file):
+    conn = db.engine.connect()
+    try:
+        assert conn.execute('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.execute('PRAGMA busy_timeout').scalar() == 100
+        assert conn.execute('PRAGMA synchronous').scalar() == 1  # NORMAL
+    finally:
+        conn.close()
+
+
+def test_no_profile_same_engine():
+    assert db.get_read_engine() is db.engine
+
+
+def test_read_only_views_use_read_engine(sqlite_file):
+    with app.test_request_context('/posts'):
+        assert db.session.get_bind() is db.get_read_engine()
+        with pytest.raises(OperationalError):
+            db.session.execute("DELETE FROM blogger")
+        db.session.rollback()
+    with app.test_request_context('/login'):
+        assert db.session.get_bind() is db.engine
+
+
+def test_reads_during_write(sqlite_file):
+    """Public pages keep working while a sync has a write open."""
+    conn = db.engine.connect()
+    trans = conn.begin()
+    try:
+        conn.execute(Blogger.__table__.update().values(name='Mallory'))
+        client = app.test_client()
+        for path in '/posts', '/status', '/bloggers':
+            resp = client.get(path)
+            assert resp.status_code == 200
+            assert b'Mallory' not in resp.data
+    finally:
+        trans.rollback()
+        conn.close()
+
+
+@pytest.yield_fixture
+def replica():
+    """Configure a second SQLite database as a read replica.
+
+    The replica has different contents from the primary, so that we can tell
+    which one a query went to.
+    """
+    path = tempfile.mkdtemp()
+    db.session.remove()
+    app.config.update(
+        SQLALCHEMY_BINDS={
+            'replica': 'sqlite:///' + os.path.join(path, 'replica.db'),
+        },
+        IB2_REPLICA_CHECK_INTERVAL=0,
+    )
+    db.metadata.create_all(bind=db.get_engine(app, 'replica'))
+    db.session.add(example_databases[0]())  # Alice, on the primary
+    db.session.commit()
+    db.get_engine(app, 'replica').execute(
+        Blogger.__table__.insert().values(name='Replicated Randy',
+                                          start_date=datetime(2015, 4, 1)))
+    yield path
+    db.session.remove()
+    app.config.update(SQLALCHEMY_BINDS=None)
+    shutil.rmtree(path)
+
+
+def test_replica_serves_read_only_views(replica):
+    resp = app.test_client().get('/bloggers')
+    assert b'Replicated Randy' in resp.data
+    assert b'Alice' not in resp.data
+    with app.test_request_context('/login'):
+        assert db.session.get_bind() is db.engine
+
+
+def test_replica_unavailable_fallback(replica):
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': 'sqlite:///' + os.path.join(replica, 'no', 'such.db'),
+    }
+    resp = app.test_client().get('/bloggers')
+    assert resp.status_code == 200
+    assert b'Alice' in resp.data
+
+
+def test_replica_lagging_fallback(replica, monkeypatch):
+    monkeypatch.setattr(engines, '_replica_lag', lambda conn: 3600)
+    resp = app.test_client().get('/bloggers')
+    assert b'Alice' in resp.data
+    monkeypatch.setattr(engines, '_replica_lag', lambda conn: 1)
+    resp = app.test_client().get('/bloggers')
+    assert b'Replicated Randy' in resp.data
+
+
+def test_other_engines_untouched(sqlite_file):
+    """The profile only applies to our own engines."""
+    engine = create_engine('sqlite://')
+    conn = engine.connect()
+    try:
+        assert conn.execute('PRAGMA synchronous').scalar() == 2  # FULL
+    finally:
+        conn.close()
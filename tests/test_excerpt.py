@@ -0,0 +1,67 @@
+"""Tests for post excerpts and compressed summaries."""
+from datetime import datetime
+
+import pytest
+
+from ironblogger.app import app
+from ironblogger.excerpt import make_excerpt, ELLIPSIS
+from ironblogger.model import db, Blog, Blogger, Post
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.mark.parametrize('html,length,excerpt', [
+    # Short enough already:
+    (u'<p>Hello, world</p>', 12, u'<p>Hello, world</p>'),
+    (u'<p>Hi </p> <!-- there -->', 2, u'<p>Hi </p> <!-- there -->'),
+    # Cut at a word boundary, closing any open tags:
+    (u'<p>Hello, <b>big world</b></p>', 12,
+     u'<p>Hello, <b>big' + ELLIPSIS + u'</b></p>'),
+    (u'<div><p>Hello</p><p>world</p></div>', 7,
+     u'<div><p>Hello</p><p>wo' + ELLIPSIS + u'</p></div>'),
+    # Entities count as one character, and are never split:
+    (u'<p>a &amp; b &#233;t&eacute;</p>', 7,
+     u'<p>a &amp; b &#233;' + ELLIPSIS + u'</p>'),
+    # Void elements don't need closing; attributes are left alone:
+    (u'<p>See <img src="a.png?x=1&amp;y=2"><br> this text</p>', 9,
+     u'<p>See <img src="a.png?x=1&amp;y=2"><br> this' + ELLIPSIS + u'</p>'),
+])
+def test_make_excerpt(html, length, excerpt):
+    assert make_excerpt(html, length) == excerpt
+
+
+def test_compressed_summary():
+    """The summary is stored compressed, and isn't loaded along with the
+    rest of the post."""
+    summary = u'<p>%s</p>' % (u'Lorem ipsum dolor sit amet. ' * 100)
+    blog = Blog(blogger=Blogger(name='Alice', start_date=datetime(2015, 1, 1)),
+                title='Alice', page_url='http://example.com/',
+                feed_url='http://example.com/rss.xml')
+    db.session.add(Post(blog=blog,
+                        timestamp=datetime(2015, 1, 2),
+                        title='Lorem',
+                        summary=summary,
+                        page_url='http://example.com/lorem.html'))
+    db.session.commit()
+    db.session.expunge_all()
+
+    post = db.session.query(Post).one()
+    assert 'summary_z' not in post.__dict__
+    assert post.excerpt == make_excerpt(summary)
+    assert len(post.summary_z) < len(summary) / 10
+    assert post.summary == summary
+
+    # Short summaries are only stored once, as the excerpt:
+    post.summary = u'<p>Lorem ipsum.</p>'
+    db.session.commit()
+    assert post.summary_z is None
+    assert post.summary == post.excerpt == u'<p>Lorem ipsum.</p>'
+    post.summary = summary
+    db.session.commit()
+
+    # The listing page shows just the excerpt:
+    resp = app.test_client().get('/posts')
+    assert resp.status_code == 200
+    assert post.excerpt.encode('utf-8') in resp.data
+    assert summary.encode('utf-8') not in resp.data
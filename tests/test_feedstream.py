@@ -0,0 +1,188 @@
+"""Tests for incremental feed parsing (`ironblogger.feedstream`)."""
+import gzip
+import os
+import tempfile
+import zlib
+from datetime import datetime, timedelta
+from email.utils import formatdate
+from io import BytesIO
+
+import feedparser
+import pytest
+
+from ironblogger import feedstream
+from ironblogger.app import app
+from ironblogger.fetch import stream_feed, download_feed, assignable_since
+from ironblogger.feedstream import BodyReader, FeedTooLargeError, \
+    UnsupportedFeedError
+from ironblogger.model import db, Blog, Blogger, Post
+from ironblogger.tasks import sync
+from .util import fresh_context, example_data
+from .util.feed import rss_feed_template
+from .util.feedserver import FeedServer
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+# The entry fields `ironblogger.fetch` cares about:
+FIELDS = ['title', 'link', 'id', 'summary', 'content', 'published',
+          'published_parsed', 'updated', 'updated_parsed']
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def stream_entries(url):
+    """Parse ``url`` with feedstream alone, without falling back."""
+    resource = feedparser._open_resource(url, None, None, None, None, [], {})
+    result = feedstream.start(resource)
+    return list(feedstream.entries(result, resource,
+                                   BodyReader(resource, 10 * 1024 * 1024)))
+
+
+def assert_same_entries(streamed, parsed):
+    assert len(streamed) == len(parsed)
+    for mine, theirs in zip(streamed, parsed):
+        for field in FIELDS:
+            assert mine.get(field) == theirs.get(field), field
+
+
+@pytest.yield_fixture
+def write_feed():
+    """Return a function writing a feed with ``items`` to a temporary file,
+    and returning its name. The files are removed afterwards."""
+    names = []
+
+    def write(items):
+        f = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+        with f:
+            f.write(rss_feed_template.render(items=items).encode('utf-8'))
+        names.append(f.name)
+        return f.name
+    yield write
+    for name in names:
+        os.remove(name)
+
+
+def dated_items(dates):
+    return [{'title': 'Post %d' % i,
+             'link': 'http://example.com/posts/%d.html' % i,
+             'pubDate': formatdate((date - EPOCH).total_seconds()),
+             # Enough text to spread the feed over several chunks:
+             'description': 'Lorem ipsum. ' * 500}
+            for i, date in enumerate(dates)]
+
+
+@pytest.mark.parametrize('gzip', [False, True])
+def test_matches_feedparser(gzip):
+    """Both RSS and Atom feeds come out the same as from feedparser."""
+    with FeedServer(num_feeds=2, posts_per_feed=5, gzip=gzip) as server:
+        for n in range(server.num_feeds):
+            url = server.feed_url(n)
+            assert_same_entries(stream_entries(url),
+                                feedparser.parse(url).entries)
+
+
+@pytest.mark.parametrize('posts', ['good_posts', 'malformed_posts'])
+def test_example_data(write_feed, posts):
+    url = write_feed(getattr(example_data, posts))
+    assert_same_entries(stream_entries(url), feedparser.parse(url).entries)
+
+
+def test_fallback(write_feed):
+    """Feeds feedstream can't handle are parsed by feedparser instead."""
+    url = write_feed(example_data.malicious_posts)
+    with pytest.raises(UnsupportedFeedError):
+        stream_entries(url)
+    downloaded, feed, duration = stream_feed(url, None, None, EPOCH)
+    assert feed.bozo == 0
+    assert_same_entries(feed.entries, feedparser.parse(url).entries)
+
+
+def test_max_size(write_feed, monkeypatch):
+    """Feeds are cut off at IB2_FETCH_MAX_SIZE, keeping what was read."""
+    now = datetime.utcnow()
+    url = write_feed(dated_items([now - timedelta(days=i)
+                                  for i in range(50)]))
+    monkeypatch.setitem(app.config, 'IB2_FETCH_MAX_SIZE', 100 * 1024)
+    downloaded, feed, duration = stream_feed(url, None, None, EPOCH)
+    assert feed.bozo == 1
+    assert isinstance(feed.bozo_exception, feedstream.FeedTooLargeError)
+    assert 0 < len(feed.entries) < 50
+    # It reads just enough to know the feed is too big:
+    assert downloaded.size == 100 * 1024 + 1
+    assert download_feed(url, None, None).size is None
+
+
+def test_early_stop(write_feed):
+    """Reading stops at the first entry older than the cutoff, but only
+    if the entries are newest-first."""
+    now = datetime.utcnow()
+    dates = [now - timedelta(days=i) for i in range(50)]
+    url = write_feed(dated_items(dates))
+    since = now - timedelta(days=9, hours=12)
+    downloaded, feed, duration = stream_feed(url, None, None, since)
+    assert [e.title for e in feed.entries] == \
+        ['Post %d' % i for i in range(10)]
+    assert feed.bozo == 0
+    assert downloaded.size < len(open(url, 'rb').read()) / 2
+
+    # Out of order, the old entries are skipped instead:
+    dates[0], dates[1] = dates[1], dates[0]
+    dates[40] = now - timedelta(hours=1)
+    url = write_feed(dated_items(dates))
+    downloaded, feed, duration = stream_feed(url, None, None, since)
+    assert [e.title for e in feed.entries] == \
+        ['Post %d' % i for i in list(range(10)) + [40]]
+    assert downloaded.size == len(open(url, 'rb').read())
+
+
+def test_gzip_bomb(monkeypatch):
+    """A small gzipped body is never decompressed much past the limit."""
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(b'\0' * (10 * 1024 * 1024))
+    outputs = []
+    decompressobj = zlib.decompressobj
+
+    class Decompressor(object):
+        def __init__(self, *args):
+            self._decompressor = decompressobj(*args)
+
+        def decompress(self, data, max_length=0):
+            output = self._decompressor.decompress(data, max_length)
+            outputs.append(len(output))
+            return output
+
+        @property
+        def unconsumed_tail(self):
+            return self._decompressor.unconsumed_tail
+    monkeypatch.setattr(feedstream.zlib, 'decompressobj', Decompressor)
+
+    reader = BodyReader(BytesIO(buf.getvalue()), 100 * 1024)
+    with pytest.raises(FeedTooLargeError):
+        list(feedstream._decoded_chunks(reader,
+                                        {'content-encoding': 'gzip'}))
+    assert sum(outputs) == 100 * 1024 + 1
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_assignable_posts(monkeypatch, streaming):
+    """Posts too old to count for any round aren't stored."""
+    monkeypatch.setitem(app.config, 'IB2_FETCH_STREAMING', streaming)
+    with FeedServer(num_feeds=2, posts_per_feed=20) as server:
+        blogger = Blogger(name='Alice',
+                          start_date=datetime.utcnow() - timedelta(days=20))
+        for n in range(server.num_feeds):
+            db.session.add(Blog(blogger=blogger,
+                                title='Blog %d' % n,
+                                page_url=server.page_url(n),
+                                feed_url=server.feed_url(n)))
+        db.session.commit()
+        sync()
+        blogs = db.session.query(Blog).all()
+        since = assignable_since(blogs)
+        for blog in blogs:
+            expected = [e for e in feedparser.parse(blog.feed_url).entries
+                        if datetime(*e.published_parsed[:6]) >= since[blog]]
+            assert 0 < len(expected) < 20
+            assert len(blog.posts) == len(expected)
+    assert db.session.query(Post).count() < 40
@@ -0,0 +1,77 @@
+"""Tests for fetching feeds over http, against a local feed server."""
+from datetime import datetime
+
+import pytest
+
+from ironblogger import tasks
+from ironblogger.app import app
+from ironblogger.model import db, Blog, Blogger, FeedFetch, Post, SyncRun
+from ironblogger.tasks import sync
+from .util import fresh_context
+from .util.feedserver import FeedServer
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+def add_blogs(server):
+    blogger = Blogger(name='Alice', start_date=datetime(2015, 1, 1))
+    for n in range(server.num_feeds):
+        db.session.add(Blog(blogger=blogger,
+                            title='Blog %d' % n,
+                            page_url=server.page_url(n),
+                            feed_url=server.feed_url(n)))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('gzip', [False, True])
+def test_fetch(gzip):
+    with FeedServer(num_feeds=4, posts_per_feed=3, gzip=gzip) as server:
+        add_blogs(server)
+        sync()
+    for blog in db.session.query(Blog).all():
+        assert len(blog.posts) == 3
+    for fetch in db.session.query(FeedFetch).all():
+        assert fetch.status == 200
+        assert fetch.error is None
+        assert fetch.bytes > 0
+
+
+def test_not_modified():
+    with FeedServer(num_feeds=2) as server:
+        add_blogs(server)
+        sync()
+        sync()
+        assert server.statuses == {200: 2, 304: 2}
+    second = db.session.query(SyncRun).order_by(SyncRun.id.desc()).first()
+    assert [f.status for f in second.fetches] == [304, 304]
+    assert second.fetch_errors == 0
+
+
+def test_errors():
+    with FeedServer(num_feeds=4, error_every=2) as server:
+        add_blogs(server)
+        sync()
+    run = db.session.query(SyncRun).one()
+    assert run.fetch_errors == 2
+    errors = db.session.query(FeedFetch).filter(FeedFetch.error != None)
+    assert sorted(f.status for f in errors) == [500, 500]
+
+
+def test_chunked(monkeypatch):
+    """Blogs are loaded a chunk at a time, and let go of afterwards."""
+    monkeypatch.setitem(app.config, 'IB2_SYNC_CHUNK_SIZE', 2)
+    sizes = []
+    fetch_feed = tasks.fetch_feed
+
+    def recording_fetch_feed(blogs, run=None):
+        fetch_feed(blogs, run)
+        sizes.append(len(db.session.identity_map))
+    monkeypatch.setattr(tasks, 'fetch_feed', recording_fetch_feed)
+
+    with FeedServer(num_feeds=6, posts_per_feed=5) as server:
+        add_blogs(server)
+        sync()
+    assert len(sizes) == 6
+    assert db.session.query(Post).count() == 30
+    # The chunk's blogs, their blogger, and the SyncRun:
+    assert max(sizes) <= 4
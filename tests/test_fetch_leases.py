@@ -0,0 +1,114 @@
+"""Tests for splitting the work of fetching feeds between several hosts."""
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from ironblogger.model import db, Blog, Blogger
+from ironblogger.tasks import fetch_posts
+from .util import fresh_context
+from .util.feedserver import FeedServer
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+def add_blogs(server):
+    blogger = Blogger(name='Alice', start_date=datetime(2015, 1, 1))
+    for n in range(server.num_feeds):
+        db.session.add(Blog(blogger=blogger,
+                            title='Blog %d' % n,
+                            page_url=server.page_url(n),
+                            feed_url=server.feed_url(n)))
+    db.session.commit()
+
+
+def test_shards():
+    """Each blog belongs to exactly one shard."""
+    with FeedServer(num_feeds=7, posts_per_feed=1) as server:
+        add_blogs(server)
+        for k in range(3):
+            fetch_posts(shard=(k, 3))
+        assert server.statuses[200] == 7
+    for blog in db.session.query(Blog).all():
+        assert len(blog.posts) == 1
+
+
+def test_leases():
+    """Live claims are respected, and expired ones are reclaimed."""
+    now = datetime.utcnow()
+    with FeedServer(num_feeds=3, posts_per_feed=1) as server:
+        add_blogs(server)
+        dead, alive, free = db.session.query(Blog).order_by(Blog.id).all()
+        dead.lease_owner = 'dead-host:1'
+        dead.lease_expires = now - timedelta(minutes=1)
+        alive.lease_owner = 'live-host:1'
+        alive.lease_expires = now + timedelta(minutes=1)
+        db.session.commit()
+
+        fetch_posts(lease=True)
+        assert server.statuses[200] == 2
+        # Nothing is due again yet:
+        fetch_posts(lease=True)
+        assert server.statuses[200] == 2
+
+    assert [len(blog.posts) for blog in (dead, alive, free)] == [1, 0, 1]
+    assert alive.lease_owner == 'live-host:1'
+    for blog in dead, free:
+        assert blog.lease_owner is None
+        assert blog.last_fetched is not None
+
+
+_setup_script = '''
+import warnings
+warnings.simplefilter('ignore')
+from datetime import datetime
+from ironblogger.wsgi import application
+from ironblogger.model import db, Blog, Blogger
+application.config.update(SQLALCHEMY_DATABASE_URI=%(uri)r,
+                          IB2_TIMEZONE='US/Eastern')
+with application.test_request_context():
+    db.create_all()
+    blogger = Blogger(name='Alice', start_date=datetime(2015, 1, 1))
+    for url in %(urls)r:
+        db.session.add(Blog(blogger=blogger, title=url, page_url=url,
+                            feed_url=url))
+    db.session.commit()
+'''
+
+_fetch_script = '''
+import warnings
+warnings.simplefilter('ignore')
+from ironblogger.wsgi import application
+from ironblogger.tasks import fetch_posts
+application.config.update(SQLALCHEMY_DATABASE_URI=%(uri)r,
+                          IB2_TIMEZONE='US/Eastern',
+                          IB2_SQLITE_PRODUCTION=True,
+                          IB2_FETCH_LEASE_BATCH=2)
+with application.test_request_context():
+    fetch_posts(lease=True)
+'''
+
+
+def test_lease_processes(tmpdir):
+    """Several processes sharing a database fetch each feed exactly once."""
+    path = str(tmpdir.join('ib2.db'))
+    params = {'uri': 'sqlite:///' + path}
+    with FeedServer(num_feeds=20, posts_per_feed=1, latency=0.01) as server:
+        params['urls'] = [server.feed_url(n) for n in range(server.num_feeds)]
+        subprocess.check_call([sys.executable, '-c', _setup_script % params])
+        procs = [subprocess.Popen([sys.executable, '-c',
+                                   _fetch_script % params])
+                 for i in range(3)]
+        assert [proc.wait() for proc in procs] == [0, 0, 0]
+        assert server.statuses[200] == 20
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute('SELECT count(*) FROM post').fetchone()[0] == 20
+        assert conn.execute('SELECT count(*) FROM blog '
+                            'WHERE last_fetched IS NULL '
+                            'OR lease_owner IS NOT NULL').fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,71 @@
+"""Tests for per-request instrumentation."""
+import json
+import logging
+
+import flask
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from ironblogger.app import app, db
+from .util.example_data import databases as example_databases
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.yield_fixture
+def instrumented():
+    app.config['IB2_INSTRUMENT'] = True
+    db.session.add(example_databases[1]())
+    db.session.commit()
+    yield app.test_client()
+    app.config.update(IB2_INSTRUMENT=False, IB2_QUERY_BUDGETS={})
+
+
+def test_disabled_by_default():
+    resp = app.test_client().get('/posts')
+    assert 'Server-Timing' not in resp.headers
+
+
+def test_server_timing(instrumented):
+    resp = instrumented.get('/posts')
+    timing = resp.headers['Server-Timing']
+    for metric in 'db;dur=', 'tmpl;dur=', 'total;dur=':
+        assert metric in timing
+    # At the very least, the count and the page itself:
+    assert ' 0 queries' not in timing
+
+
+def test_structured_log(instrumented, caplog):
+    with caplog.at_level(logging.INFO):
+        resp = instrumented.get('/rss')
+    records = [json.loads(r.getMessage()[len('request '):])
+               for r in caplog.records
+               if r.getMessage().startswith('request ')]
+    assert len(records) == 1
+    assert records[0]['endpoint'] == 'show_rss'
+    assert records[0]['size'] == len(resp.data)
+    assert records[0]['queries'] > 0
+
+
+def test_query_budget(instrumented, caplog):
+    app.config['IB2_QUERY_BUDGETS'] = {'show_posts': 0}
+    with caplog.at_level(logging.WARNING):
+        instrumented.get('/posts')
+        instrumented.get('/bloggers')
+    warnings = [r.getMessage() for r in caplog.records
+                if r.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert warnings[0].startswith('show_posts executed')
+
+
+def test_failed_query(instrumented):
+    """Statements which fail aren't counted, and leave nothing behind."""
+    with app.test_request_context('/posts'):
+        app.preprocess_request()
+        with pytest.raises(OperationalError):
+            db.session.execute('SELECT * FROM no_such_table')
+        db.session.rollback()
+        db.session.execute('SELECT 1')
+        assert flask.g.ib2_stats['queries'] == 1
+        assert 'ib2_query_start' not in db.session.connection().info
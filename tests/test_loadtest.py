@@ -0,0 +1,40 @@
+"""Tests for the load testing harness."""
+import json
+
+import pytest
+
+from ironblogger import template_filters
+from ironblogger.app import app, db
+from ironblogger.loadtest import bench_web, caching_disabled, ROUTE_WEIGHTS
+from .util.example_data import databases as example_databases
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.mark.parametrize('socket', [False, True])
+def test_bench_web(socket, tmpdir):
+    db.session.add(example_databases[1]())
+    db.session.commit()
+    output = str(tmpdir.join('results.json'))
+    results = bench_web(requests=50, concurrency=2, socket=socket,
+                        output=output)
+    assert set(results) == {'cached', 'uncached'}
+    for summary in results.values():
+        assert summary['requests'] == 50
+        for route, stats in summary['routes'].items():
+            assert route in dict(ROUTE_WEIGHTS)
+            assert stats['errors'] == 0
+            assert stats['p50'] <= stats['p99']
+    with open(output) as f:
+        assert json.load(f)['results'] == json.loads(json.dumps(results))
+
+
+def test_caching_disabled():
+    size = app.config['IB2_COMPRESS_CACHE_SIZE']
+    memo_size = template_filters.MAX_MEMO_SIZE
+    with caching_disabled():
+        assert app.config['IB2_COMPRESS_CACHE_SIZE'] == 0
+        assert template_filters.MAX_MEMO_SIZE == 0
+    assert app.config['IB2_COMPRESS_CACHE_SIZE'] == size
+    assert template_filters.MAX_MEMO_SIZE == memo_size
@@ -0,0 +1,125 @@
+"""Tests for the metrics registry and the /metrics endpoint."""
+import os
+import tempfile
+
+import pytest
+
+from ironblogger import metrics
+from ironblogger.app import app, db
+from ironblogger.fetch import fetch_blog
+from ironblogger.tasks import sync
+from .util.example_data import databases as example_databases
+from .util.feed import rss_feed_template, feedtext_to_blog
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.yield_fixture(autouse=True)
+def reset_metrics():
+    app.config['IB2_METRICS'] = True
+    metrics.web.reset()
+    metrics.tasks.reset()
+    yield
+    metrics.web.reset()
+    metrics.tasks.reset()
+    app.config.update(IB2_METRICS=False, IB2_METRICS_FILE=None)
+
+
+@pytest.yield_fixture
+def metrics_file():
+    fd, name = tempfile.mkstemp()
+    os.close(fd)
+    os.remove(name)
+    yield name
+    if os.path.exists(name):
+        os.remove(name)
+
+
+def test_render():
+    registry = metrics.Registry()
+    counter = registry.counter('things_total', 'Things.')
+    hist = registry.histogram('wait_seconds', 'Waiting.', buckets=(1, 5))
+    counter.inc(endpoint='a"b')
+    counter.inc(2, endpoint='a"b')
+    hist.observe(3)
+    text = metrics.render(registry.families())
+    assert text.splitlines() == [
+        '# HELP things_total Things.',
+        '# TYPE things_total counter',
+        'things_total{endpoint="a\\"b"} 3',
+        '# HELP wait_seconds Waiting.',
+        '# TYPE wait_seconds histogram',
+        'wait_seconds_bucket{le="1.0"} 0',
+        'wait_seconds_bucket{le="5.0"} 1',
+        'wait_seconds_bucket{le="+Inf"} 1',
+        'wait_seconds_sum 3.0',
+        'wait_seconds_count 1',
+    ]
+
+
+def test_endpoint_reports_requests():
+    db.session.add(example_databases[1]())
+    db.session.commit()
+    client = app.test_client()
+    client.get('/posts')
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/plain'
+    text = resp.get_data(as_text=True)
+    assert '# TYPE ironblogger_request_duration_seconds histogram' in text
+    assert 'ironblogger_request_duration_seconds_count' \
+        '{endpoint="show_posts"} 1' in text
+    assert metrics.request_db_time.count(endpoint='show_posts') == 1
+
+
+def test_disabled():
+    app.config['IB2_METRICS'] = False
+    client = app.test_client()
+    client.get('/posts')
+    assert client.get('/metrics').status_code == 404
+    assert metrics.request_latency.count(endpoint='show_posts') == 0
+
+
+def test_fetch_counters():
+    blog = feedtext_to_blog(rss_feed_template.render(items=[{
+        'title': 'Hello',
+        'link': 'http://www.example.com/blog/hello',
+        'pubDate': 'Mon, 05 Jan 2015 10:00:00 +0000',
+        'description': 'Hi there.',
+    }]))
+    try:
+        db.session.add(blog)
+        db.session.commit()
+        fetch_blog(blog)
+        fetch_blog(blog)
+    finally:
+        os.remove(blog.feed_url)
+    assert metrics.feeds_fetched.value() == 2
+    assert metrics.posts_inserted.value() == 1
+    assert metrics.posts_updated.value() == 1
+
+
+def test_last_run_file(metrics_file):
+    app.config['IB2_METRICS_FILE'] = metrics_file
+    client = app.test_client()
+    # No sync has happened yet:
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'ironblogger_last_sync_timestamp_seconds' not in text
+
+    metrics.posts_inserted.inc(7)
+    metrics.write_last_run(metrics_file)
+    # The web app's own counters are separate from the saved ones:
+    metrics.tasks.reset()
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE ironblogger_last_sync_timestamp_seconds gauge' in text
+    assert 'ironblogger_posts_inserted_total 7' in text
+
+
+def test_sync_resets_task_metrics():
+    """Each sync starts its metrics from zero, e.g. in the daemon."""
+    metrics.posts_inserted.inc(7)
+    sync()
+    assert metrics.posts_inserted.value() == 0
+    assert metrics.round_assignment_time.count() == 1
@@ -0,0 +1,109 @@
+"""Make sure the main queries don't do full table scans.
+
+We record every statement issued while rendering the public pages and
+assigning rounds, and ask SQLite how it plans to execute each of them. If
+any of them scans one of the big tables without using an index, that's a
+regression -- likely a missing index, or a query which can't use the
+existing ones.
+"""
+from datetime import datetime
+import re
+
+import pytest
+from sqlalchemy import event
+
+from ironblogger import tasks
+from ironblogger.app import app
+from ironblogger.model import db, Blogger, Party, Payment, Post
+from ironblogger.date import to_dbtime, from_dbtime, duedate
+from .util.example_data import databases as example_databases
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+# Tables which grow with the archive. Scanning the others (e.g. all of the
+# bloggers for the ledger) is expected.
+BIG_TABLES = ('post', 'blog', 'payment')
+
+_full_scan = re.compile(r'^SCAN (TABLE )?(\w+)(?!.*INDEX)')
+
+
+@pytest.yield_fixture
+def statements():
+    """Collect the (statement, parameters) of every SELECT executed."""
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            recorded.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield recorded
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def _duedate(dt):
+    return to_dbtime(duedate(from_dbtime(dt)))
+
+
+def populate():
+    for database in example_databases:
+        db.session.add(database())
+    db.session.add(Party(date=datetime(2015, 4, 20),
+                         spent=1000,
+                         last_duedate=_duedate(datetime(2015, 4, 8))))
+    alice = Blogger.query.filter_by(name='Alice').one()
+    db.session.add(Payment(blogger=alice,
+                           duedate=_duedate(datetime(2015, 4, 1)),
+                           amount=500))
+    db.session.commit()
+
+
+def full_scans(statement, parameters):
+    """Return the names of the big tables ``statement`` fully scans."""
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        details = [row[-1] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    tables = []
+    for detail in details:
+        match = _full_scan.match(detail)
+        if match and match.group(2) in BIG_TABLES:
+            tables.append(match.group(2))
+    return tables
+
+
+def assert_no_full_scans(statements):
+    assert statements, "No statements were recorded."
+    for statement, parameters in statements:
+        tables = full_scans(statement, parameters)
+        assert not tables, \
+            "Full scan of %r in query:\n%s" % (tables, statement)
+
+
+@pytest.mark.parametrize('path', [
+    '/posts',
+    '/posts?page=1&page_size=2',
+    '/status',
+    '/ledger',
+    '/bloggers',
+    '/rss',
+])
+def test_view_queries(path, statements):
+    populate()
+    tasks.assign_rounds(until=datetime(2015, 5, 1))
+    del statements[:]
+    resp = app.test_client().get(path)
+    assert resp.status_code == 200
+    assert_no_full_scans(statements)
+
+
+def test_assign_rounds_queries(statements):
+    populate()
+    del statements[:]
+    tasks.assign_rounds(until=datetime(2015, 5, 1))
+    assert Post.query.filter(Post.counts_for != None).count() > 0
+    assert_no_full_scans(statements)
@@ -2,6 +2,8 @@ from datetime import datetime
 from ironblogger.date import rssdate, from_dbtime
 from ironblogger import tasks
 from ironblogger.model import *
+from ironblogger.fetch import fetch_blog, MalformedPostError
+import feedparser
 import os.path
 import pytest
 from lxml import etree
@@ -29,7 +31,7 @@ def test_malformed(post):
     blog = feedtext_to_blog(rss_feed_template.render(items=[post]))
     try:
         with pytest.raises(MalformedPostError):
-            blog.fetch_posts()
+            fetch_blog(blog)
     finally:
         os.remove(blog.feed_url)
 
@@ -38,7 +40,7 @@ def test_malformed(post):
 def test_malicious(post):
     blog = feedtext_to_blog(rss_feed_template.render(items=[post]))
     try:
-        blog.fetch_posts()
+        fetch_blog(blog)
         tree = post_summary_etree(blog.posts[0])
         assert len(tree.getroot().findall('.//p')) == 1
         assert len(tree.getroot().findall('.//script')) == 0
@@ -99,7 +101,7 @@ def test_text_mimetype():
     assert feed.entries[0].summary_detail.type == 'text/plain'
 
     try:
-        blog.fetch_posts()
+        fetch_blog(blog)
         summary = post_summary_etree(blog.posts[0])
         assert len(summary.getroot().findall('.//script')) == 0
     finally:
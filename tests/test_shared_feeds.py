@@ -0,0 +1,136 @@
+"""Tests for blogs which share a feed."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from ironblogger.app import app
+from ironblogger.feedurl import feed_hash
+from ironblogger.fetch import fetch_feed, normalize_feed_url
+from ironblogger.model import db, Blog, Blogger, Feed, FeedFetch, SyncRun
+from ironblogger.tasks import fetch_posts, sync
+from .util import fresh_context
+from .util.feedserver import FeedServer
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.mark.parametrize('url,normalized', [
+    ('http://example.com/feed.xml', 'http://example.com/feed.xml'),
+    ('HTTP://Example.COM:80/feed.xml#top', 'http://example.com/feed.xml'),
+    ('https://example.com:443/Feed?x=1', 'https://example.com/Feed?x=1'),
+    ('https://example.com:8443', 'https://example.com:8443/'),
+    ('/tmp/feed.xml', '/tmp/feed.xml'),
+])
+def test_normalize_feed_url(url, normalized):
+    assert normalize_feed_url(url) == normalized
+
+
+def add_blog(name, feed_url):
+    blogger = Blogger(name=name, start_date=datetime(2015, 1, 1))
+    blog = Blog(blogger=blogger,
+                title=name,
+                page_url='http://example.com/%s/' % name,
+                feed_url=feed_url)
+    db.session.add(blog)
+    db.session.commit()
+    return blog
+
+
+def test_shared_feed():
+    """A feed shared by several blogs is downloaded once per sync, and
+    every blog gets its posts."""
+    with FeedServer(num_feeds=1, posts_per_feed=3) as server:
+        url = server.feed_url(0)
+        alice = add_blog('alice', url)
+        bob = add_blog('bob', url.replace('http://', 'HTTP://') + '#feed')
+
+        sync()
+        assert server.statuses[200] == 1
+        assert len(alice.posts) == 3
+        assert len(bob.posts) == 3
+        run = db.session.query(SyncRun).one()
+        assert run.feeds_fetched == 1
+        assert db.session.query(FeedFetch).count() == 2
+
+        # The caching info is kept per url, so the next sync is a single
+        # conditional request:
+        assert db.session.query(Feed).one().etag is not None
+        sync()
+        assert server.statuses[304] == 1
+
+        # A blog which hasn't been fetched before still gets the posts,
+        # even though the feed hasn't changed:
+        carol = add_blog('carol', url)
+        sync()
+        assert server.statuses[200] == 2
+        assert len(carol.posts) == 3
+        assert len(alice.posts) == 3
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(shard=(0, 2)),
+    dict(lease=True),
+])
+def test_shared_feed_split(monkeypatch, kwargs):
+    """Blogs sharing a feed are fetched together when the work is split
+    between hosts, so they never miss posts because of each other's
+    caching info."""
+    monkeypatch.setitem(app.config, 'IB2_FETCH_LEASE_BATCH', 1)
+
+    def fetch():
+        if 'shard' in kwargs:
+            for k in range(2):
+                fetch_posts(shard=(k, 2))
+        else:
+            fetch_posts(**kwargs)
+        # Make both due again, for leases:
+        for blog in alice, bob:
+            blog.last_fetched -= timedelta(days=1)
+        db.session.commit()
+
+    with FeedServer(num_feeds=1, posts_per_feed=2) as server:
+        url = server.feed_url(0)
+        alice = add_blog('alice', url)
+        bob = add_blog('bob', url + '#feed')
+        fetch()
+        assert server.statuses == {200: 1}
+        server.add_post()
+        fetch()
+        assert server.statuses == {200: 2}
+        assert len(alice.posts) == len(bob.posts) == 3
+
+
+def test_shared_feed_partial():
+    """If only some of the blogs sharing a feed are fetched, the request
+    isn't conditional, and its caching info isn't saved."""
+    with FeedServer(num_feeds=1, posts_per_feed=2) as server:
+        url = server.feed_url(0)
+        alice = add_blog('alice', url)
+        bob = add_blog('bob', url)
+        fetch_feed([alice, bob])
+        etag = alice.feed.etag
+        server.add_post()
+
+        fetch_feed([bob])
+        assert server.statuses == {200: 2}
+        assert alice.feed.etag == etag
+        assert len(bob.posts) == 3
+
+        # Alice hasn't seen the new post, so this mustn't be a 304:
+        fetch_feed([alice, bob])
+        assert server.statuses == {200: 3}
+        assert len(alice.posts) == 3
+        assert alice.feed.etag != etag
+
+
+def test_feed_hash():
+    """Blogs sharing a feed have the same hash, which follows changes to
+    their feed urls."""
+    alice = add_blog('alice', 'http://example.com/feed.xml')
+    bob = add_blog('bob', 'HTTP://Example.COM:80/feed.xml#top')
+    assert alice.feed_hash == bob.feed_hash == \
+        feed_hash('http://example.com/feed.xml')
+    bob.feed_url = 'http://example.com/bob.xml'
+    db.session.commit()
+    assert bob.feed_hash == feed_hash('http://example.com/bob.xml')
+    assert bob.feed_hash != alice.feed_hash
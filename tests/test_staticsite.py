@@ -0,0 +1,83 @@
+"""Tests for the static site export."""
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import pytest
+
+from ironblogger.app import app
+from ironblogger.model import db, Blog, Post
+from ironblogger.staticsite import export_site
+from .util.example_data import databases as example_databases
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.yield_fixture
+def dest():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.mark.parametrize('database', example_databases)
+def test_export_all_pages(dest, database):
+    db.session.add(database())
+    db.session.commit()
+    rendered = export_site(dest)
+    for relpath in 'about.html', 'bloggers.html', 'ledger.html', 'rss.xml', \
+            'posts/0.html', 'status/0.html':
+        assert relpath in rendered
+        with open(os.path.join(dest, relpath), 'rb') as f:
+            plain = f.read()
+        with gzip.open(os.path.join(dest, relpath + '.gz'), 'rb') as f:
+            assert f.read() == plain
+
+
+def test_export_incremental(dest):
+    db.session.add(example_databases[0]())
+    db.session.commit()
+    export_site(dest)
+    assert export_site(dest) == [], "Unchanged pages were re-rendered."
+
+    blog = Blog.query.first()
+    db.session.add(Post(blog=blog,
+                        timestamp=datetime(2015, 4, 20),
+                        title='Yet another post',
+                        summary='Nothing much to say.',
+                        page_url='http://example.com/alice/another.html'))
+    db.session.commit()
+    rendered = export_site(dest)
+    assert 'posts/0.html' in rendered
+    assert 'rss.xml' in rendered
+    assert 'about.html' not in rendered
+
+    assert 'about.html' in export_site(dest, force=True)
+
+
+def test_export_pages_keyset(dest, monkeypatch):
+    """Each posts page is fingerprinted from its own posts, even when they
+    share timestamps across page boundaries."""
+    monkeypatch.setitem(app.config, 'IB2_POSTS_PER_PAGE', 2)
+    db.session.add(example_databases[0]())
+    blog = Blog.query.first()
+    for i in range(5):
+        db.session.add(Post(blog=blog,
+                            timestamp=datetime(2015, 4, 20),
+                            title='Post %d' % i,
+                            summary='Same time as the others.',
+                            page_url='http://example.com/alice/%d.html' % i))
+    db.session.commit()
+    export_site(dest)
+
+    post = Post.query.filter_by(title='Post 2').one()
+    post.title = 'Edited'
+    db.session.commit()
+    rendered = export_site(dest)
+    assert [relpath for relpath in rendered
+            if relpath.startswith('posts/')] == ['posts/1.html']
+    with open(os.path.join(dest, 'posts/1.html'), 'rb') as f:
+        assert b'Edited' in f.read()
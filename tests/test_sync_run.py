@@ -0,0 +1,124 @@
+"""Tests for the sync run history."""
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+import pytest
+
+from ironblogger.app import app
+from ironblogger.model import db, Blog, SyncRun, FeedFetch
+from ironblogger.tasks import sync
+from .util import fresh_context
+from .util.feed import rss_feed_template, feedtext_to_blog
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+item = {
+    'title': 'Hello',
+    'link': 'http://www.example.com/blog/hello',
+    'pubDate': 'Mon, 05 Jan 2015 10:00:00 +0000',
+    'description': 'Hi there.',
+}
+
+
+@pytest.yield_fixture
+def blog():
+    blog = feedtext_to_blog(rss_feed_template.render(items=[item]))
+    db.session.add(blog)
+    db.session.commit()
+    yield blog
+    os.remove(blog.feed_url)
+
+
+def test_records_run(blog):
+    sync()
+    run = db.session.query(SyncRun).one()
+    assert run.end_time is not None
+    assert run.duration >= 0
+    assert run.error is None
+    assert run.feeds_fetched == 1
+    assert run.fetch_errors == run.parse_errors == 0
+    for stage in SyncRun.STAGES:
+        assert getattr(run, stage + '_time') >= 0
+
+    fetch = db.session.query(FeedFetch).one()
+    assert fetch.run is run
+    assert fetch.blog is blog
+    assert fetch.bytes == os.path.getsize(blog.feed_url)
+    assert run.bytes_fetched == fetch.bytes
+    assert fetch.error is None
+
+
+def test_fetch_error(blog):
+    broken = Blog(title='Broken',
+                  page_url='http://www.example.com/broken',
+                  feed_url='/this/file/does/not/exist.xml',
+                  blogger=blog.blogger)
+    db.session.add(broken)
+    db.session.commit()
+    sync()
+    run = db.session.query(SyncRun).one()
+    assert run.feeds_fetched == 2
+    assert run.fetch_errors == 1
+    fetch = db.session.query(FeedFetch).filter_by(blog=broken).one()
+    assert fetch.error is not None
+
+
+def test_parse_error(blog):
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(rss_feed_template.render(items=[
+            dict(item, link='http://www.example.com/blog/undated', pubDate=''),
+        ]).encode('utf-8'))
+    malformed = Blog(title='Undated',
+                     page_url='http://www.example.com/undated',
+                     feed_url=f.name,
+                     blogger=blog.blogger)
+    db.session.add(malformed)
+    db.session.commit()
+    try:
+        sync()
+    finally:
+        os.remove(malformed.feed_url)
+    run = db.session.query(SyncRun).one()
+    assert run.parse_errors == 1
+    fetch = db.session.query(FeedFetch).filter_by(blog=malformed).one()
+    assert 'publication date' in fetch.error
+
+
+def test_nested_timers():
+    run = SyncRun()
+    with run.timer('parse'):
+        time.sleep(0.05)
+        with run.timer('sanitize'):
+            time.sleep(0.1)
+    assert 0.05 <= run.parse_time < 0.1
+    assert run.sanitize_time >= 0.1
+
+
+def test_deleting_blog_removes_history(blog):
+    sync()
+    db.session.delete(blog)
+    db.session.commit()
+    assert db.session.query(FeedFetch).count() == 0
+    assert db.session.query(SyncRun).count() == 1
+
+
+def test_prune_history(blog, monkeypatch):
+    """Runs older than IB2_SYNC_HISTORY_DAYS are deleted by the next sync,
+    along with their fetches."""
+    sync()
+    old = db.session.query(SyncRun).one()
+    old.start_time -= timedelta(days=31)
+    db.session.commit()
+    sync()
+    run = db.session.query(SyncRun).one()
+    assert run is not old
+    assert [fetch.run for fetch in db.session.query(FeedFetch)] == [run]
+
+    # None keeps everything:
+    monkeypatch.setitem(app.config, 'IB2_SYNC_HISTORY_DAYS', None)
+    run.start_time -= timedelta(days=365)
+    db.session.commit()
+    sync()
+    assert db.session.query(SyncRun).count() == 2
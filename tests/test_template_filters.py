@@ -0,0 +1,71 @@
+"""Tests for the template filters."""
+from datetime import datetime, date
+import arrow
+import pytest
+
+from ironblogger import template_filters
+from ironblogger.app import app
+from ironblogger.date import rssdate, from_dbtime
+from ironblogger.template_filters import timestamp_rss, timestamp_long, \
+    datestamp
+from .util import fresh_context
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+dbtimes = [
+    datetime(2015, 1, 25),
+    # Either side of the DST transitions in US/Eastern:
+    datetime(2016, 3, 13, 6, 59),
+    datetime(2016, 3, 13, 7, 1),
+    datetime(2016, 11, 6, 4, 59),
+    datetime(2016, 11, 6, 7, 1),
+]
+
+
+@pytest.mark.parametrize('zone', ['US/Eastern', 'Europe/Berlin', 'UTC'])
+@pytest.mark.parametrize('dbtime', dbtimes)
+def test_timestamp_rss_matches_rssdate(zone, dbtime):
+    app.config['IB2_TIMEZONE'] = zone
+    try:
+        expected = rssdate(from_dbtime(dbtime))
+        assert timestamp_rss(dbtime) == expected
+        # Again, from the memo:
+        assert timestamp_rss(dbtime) == expected
+    finally:
+        app.config['IB2_TIMEZONE'] = 'US/Eastern'
+
+
+def test_timestamp_rss_ambiguous_hour():
+    """The hour repeated at the end of DST gets the right offset.
+
+    (arrow gets this wrong, so we don't compare against rssdate here.)
+    """
+    assert timestamp_rss(datetime(2016, 11, 6, 5, 1)) == \
+        '06 Nov 2016 01:01:00 -0400'
+    assert timestamp_rss(datetime(2016, 11, 6, 6, 1)) == \
+        '06 Nov 2016 01:01:00 -0500'
+
+
+def test_memo_distinguishes_timezones():
+    instant = arrow.get(datetime(2015, 1, 25))
+    fmt = '%H:%M %Z'
+    app.config['IB2_TIMESTAMP_LONG'] = fmt
+    try:
+        for zone in 'US/Eastern', 'US/Pacific', 'UTC':
+            arr = instant.to(zone)
+            assert timestamp_long(arr) == arr.strftime(fmt)
+    finally:
+        app.config['IB2_TIMESTAMP_LONG'] = '%c'
+
+
+def test_memo_distinguishes_types():
+    assert datestamp(date(2015, 1, 25)) == date(2015, 1, 25).strftime('%F')
+    assert datestamp(datetime(2015, 1, 25)) == \
+        datetime(2015, 1, 25).strftime('%F')
+
+
+def test_memo_bounded(monkeypatch):
+    monkeypatch.setattr(template_filters, 'MAX_MEMO_SIZE', 10)
+    for day in range(1, 30):
+        datestamp(date(2015, 1, day))
+    assert len(template_filters._memo) <= 10
@@ -0,0 +1,190 @@
+"""Tests for push-based ingestion via WebSub."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from ironblogger import metrics
+from ironblogger.app import app
+from ironblogger.model import db, Blog, Blogger, Feed
+from ironblogger.tasks import sync, fetch_posts
+from .util import fresh_context
+from .util.feedserver import FeedServer
+from .util.websubhub import StubHub, verify, publish
+
+fresh_context = pytest.yield_fixture(autouse=True)(fresh_context)
+
+
+@pytest.fixture
+def callback_base(monkeypatch):
+    monkeypatch.setitem(app.config, 'IB2_WEBSUB_CALLBACK_BASE',
+                        'http://localhost/')
+
+
+def add_blog(name, feed_url):
+    blogger = Blogger(name=name, start_date=datetime(2015, 1, 1))
+    blog = Blog(blogger=blogger,
+                title=name,
+                page_url='http://example.com/%s/' % name,
+                feed_url=feed_url)
+    db.session.add(blog)
+    db.session.commit()
+    return blog
+
+
+def test_subscribe(callback_base):
+    """Hubs advertised by feeds are discovered, and subscribed to once."""
+    with StubHub() as hub, \
+            FeedServer(num_feeds=2, posts_per_feed=1, hub=hub.url) as server:
+        for n in range(server.num_feeds):
+            add_blog('blog%d' % n, server.feed_url(n))
+        sync()
+        assert sorted(r['hub.topic'] for r in hub.requests) == \
+            [server.feed_url(0), server.feed_url(1)]
+        for request, feed in zip(hub.requests,
+                                 db.session.query(Feed).order_by(Feed.id)):
+            assert request['hub.mode'] == 'subscribe'
+            assert request['hub.callback'] == \
+                'http://localhost/websub/%d' % feed.id
+            assert request['hub.secret'] == feed.secret
+        # The requests are pending; we don't ask again right away:
+        sync()
+        assert len(hub.requests) == 2
+
+
+def test_no_callback_base():
+    """Without a callback url, we don't subscribe."""
+    with StubHub() as hub, \
+            FeedServer(num_feeds=1, posts_per_feed=1, hub=hub.url) as server:
+        add_blog('alice', server.feed_url(0))
+        sync()
+        assert db.session.query(Feed).one().hub == hub.url
+        assert hub.requests == []
+
+
+def test_verify_intent(callback_base):
+    client = app.test_client()
+    with StubHub() as hub, \
+            FeedServer(num_feeds=1, posts_per_feed=1, hub=hub.url) as server:
+        add_blog('alice', server.feed_url(0))
+        sync()
+    request = hub.requests[0]
+    feed = db.session.query(Feed).one()
+
+    # Requests we didn't make are refused:
+    resp = verify(client, request, hub_topic='http://example.com/other.xml')
+    assert resp.status_code == 404
+    resp = verify(client, dict(request, **{
+        'hub.callback': 'http://localhost/websub/%d' % (feed.id + 1)}))
+    assert resp.status_code == 404
+    assert feed.push_expires is None
+
+    resp = verify(client, request, lease_seconds='3600')
+    assert resp.status_code == 200
+    assert resp.data == b'abc123'
+    assert timedelta(minutes=59) < \
+        feed.push_expires - datetime.utcnow() <= timedelta(hours=1)
+
+    # We only want to stop if the feed moved on:
+    resp = verify(client, request, hub_mode='unsubscribe')
+    assert resp.status_code == 404
+
+    # Denials only count for subscriptions we're waiting on:
+    resp = verify(client, request, hub_mode='denied', hub_challenge=None)
+    assert resp.status_code == 404
+    assert feed.push_expires is not None
+
+    feed.push_requested = datetime.utcnow()
+    db.session.commit()
+    resp = verify(client, request, hub_mode='denied', hub_challenge=None,
+                  hub_topic='http://example.com/other.xml')
+    assert resp.status_code == 404
+    assert feed.push_expires is not None
+    resp = verify(client, request, hub_mode='denied', hub_challenge=None)
+    assert resp.status_code == 200
+    assert feed.push_expires is None
+
+
+def test_push(callback_base):
+    """Pushed content is stored for every blog using the feed, unless it
+    isn't signed with our secret."""
+    client = app.test_client()
+    with StubHub() as hub, \
+            FeedServer(num_feeds=2, posts_per_feed=3, hub=hub.url) as server:
+        body = server.body(0)
+        # Start off with a different feed, so the posts are all new:
+        alice = add_blog('alice', server.feed_url(1))
+        sync()
+        request = hub.requests[0]
+        assert verify(client, request).status_code == 200
+        bob = add_blog('bob', server.feed_url(1))
+        bob.feed = alice.feed
+        db.session.commit()
+
+    rejected = metrics.websub_rejected.value()
+    resp = publish(client, request, body, secret='wrong')
+    assert resp.status_code == 202
+    assert metrics.websub_rejected.value() == rejected + 1
+    assert len(alice.posts) == 3
+    assert len(bob.posts) == 0
+
+    resp = publish(client, request, body, algorithm='sha256')
+    assert resp.status_code == 202
+    db.session.expire_all()
+    assert len(alice.posts) == 6
+    assert len(bob.posts) == 3
+    # Pushing the same content again doesn't duplicate anything:
+    publish(client, request, body)
+    db.session.expire_all()
+    assert len(alice.posts) == 6
+
+
+def test_push_too_big(callback_base, monkeypatch):
+    """Pushed content bigger than IB2_FETCH_MAX_SIZE is refused."""
+    client = app.test_client()
+    with StubHub() as hub, \
+            FeedServer(num_feeds=1, posts_per_feed=3, hub=hub.url) as server:
+        body = server.body(0)
+        add_blog('alice', server.feed_url(0))
+        sync()
+        request = hub.requests[0]
+        assert verify(client, request).status_code == 200
+    monkeypatch.setitem(app.config, 'IB2_FETCH_MAX_SIZE', len(body) - 1)
+    received = metrics.websub_received.value()
+    resp = publish(client, request, body)
+    assert resp.status_code == 413
+    assert metrics.websub_received.value() == received
+
+    monkeypatch.setitem(app.config, 'IB2_FETCH_MAX_SIZE', len(body))
+    resp = publish(client, request, body)
+    assert resp.status_code == 202
+    assert metrics.websub_received.value() == received + 1
+
+
+@pytest.mark.parametrize('lease', [False, True])
+def test_polling_interval(callback_base, lease):
+    """Blogs with an active subscription are polled less often."""
+    client = app.test_client()
+    with StubHub() as hub, \
+            FeedServer(num_feeds=2, posts_per_feed=1, hub=hub.url) as server:
+        add_blog('pushed', server.feed_url(0))
+        add_blog('polled', server.feed_url(1))
+        sync()
+        assert server.statuses[200] == 2
+        request = [r for r in hub.requests
+                   if r['hub.topic'] == server.feed_url(0)][0]
+        assert verify(client, request).status_code == 200
+
+        # Make both of them due, as far as leases go:
+        for blog in db.session.query(Blog):
+            blog.last_fetched -= timedelta(hours=1)
+        db.session.commit()
+        fetch_posts(lease=lease)
+        assert server.statuses[200] + server.statuses[304] == 3
+
+        # Once the poll interval has passed, it's polled again:
+        for blog in db.session.query(Blog):
+            blog.last_fetched -= timedelta(
+                seconds=app.config['IB2_WEBSUB_POLL_INTERVAL'])
+        db.session.commit()
+        fetch_posts(lease=lease)
+        assert server.statuses[200] + server.statuses[304] == 5
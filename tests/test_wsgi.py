@@ -0,0 +1,51 @@
+"""Tests for the wsgi entry point.
+
+These run in a fresh interpreter, since what we care about is which modules
+a worker ends up loading, and the test process has already loaded them all.
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+_worker_script = '''
+import json, sys, warnings
+warnings.simplefilter('ignore')
+from ironblogger.wsgi import application
+from ironblogger.app import db
+application.config.update(
+    SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',
+    IB2_TIMEZONE='US/Eastern',
+    IB2_REGION='Boston',
+    IB2_LANGUAGE='en-us',
+    IB2_ENABLE_ADMIN=%r,
+)
+with application.test_request_context():
+    db.create_all()
+    client = application.test_client()
+    statuses = [client.get(url).status_code for url in ('/posts', '/admin/')]
+print(json.dumps({
+    'statuses': statuses,
+    'modules': [name for name in ('feedparser', 'flask_admin', 'alembic')
+                if name in sys.modules],
+}))
+'''
+
+
+def run_worker(enable_admin):
+    output = subprocess.check_output(
+        [sys.executable, '-c', _worker_script % enable_admin])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('enable_admin', [True, False])
+def test_worker_imports(enable_admin):
+    """Workers don't load feedparser, or flask_admin unless it's enabled."""
+    result = run_worker(enable_admin)
+    if enable_admin:
+        assert result['statuses'] == [200, 200]
+        assert result['modules'] == ['flask_admin']
+    else:
+        assert result['statuses'] == [200, 404]
+        assert result['modules'] == []
@@ -1,11 +1,13 @@
 """This package provides helpers for use in tests.
 
-In addition to the contents of the root module, there are three other
+In addition to the contents of the root module, there are five other
 modules in this package:
 
     * randomize - helpers for randomize testing
     * example_data - example data for use in tests
     * feed - helpers for working with feeds
+    * feedserver - a local http server for generated feeds
+    * websubhub - a stub WebSub hub
 """
 from ironblogger.app import app, db
 
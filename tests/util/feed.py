@@ -13,10 +13,14 @@ import os
 
 rss_feed_template = \
 '''<?xml version="1.0" encoding="utf-8"?>
-<rss version="2.0">
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
     <channel>
         <title>Blackhat posts</title>
         <link>index.html</link>
+        {% if hub %}
+        <atom:link rel="hub" href="{{ hub }}"/>
+        <atom:link rel="self" href="{{ self_url }}"/>
+        {% endif %}
         <description>Posts that will exploit your app</description>
         <language>en-us</language>
 
@@ -39,6 +43,10 @@ atom_feed_template = \
 <feed xmlns="http://www.w3.org/2005/Atom">
     <title>Blackhat posts</title>
     <link>index.html</link>
+    {% if hub %}
+    <link rel="hub" href="{{ hub }}"/>
+    <link rel="self" href="{{ self_url }}"/>
+    {% endif %}
     <updated>2015-01-01T2030:02Z</updated>
     <author>
       <name>Mr. Badguy</name>
@@ -0,0 +1,213 @@
+"""A local HTTP server for generated feeds.
+
+This lets us exercise (and benchmark) the fetching code without touching
+the real internet. `FeedServer` serves any number of generated RSS and Atom
+feeds, at ``/feeds/<n>.xml``, and can be configured to misbehave in various
+realistic ways:
+
+* latency: sleep before responding.
+* etag: send ETag & Last-Modified headers, and honor conditional requests
+  with 304 Not Modified.
+* gzip: compress responses, if the client accepts it.
+* bytes_per_sec: trickle out the body at (roughly) this rate.
+* error_every: respond with a 500 to every n-th feed.
+* hub: advertise this WebSub hub in every feed (see `websubhub`).
+
+Usage:
+
+    with FeedServer(num_feeds=100, latency=0.01) as server:
+        url = server.feed_url(7)
+        ...
+
+The server counts the responses it sends by status, in ``server.statuses``.
+"""
+import gzip
+import hashlib
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from io import BytesIO
+
+from six.moves import BaseHTTPServer, socketserver
+
+from .feed import rss_feed_template, atom_feed_template
+from .randomize import word_choices
+
+atom_entry_template = '''
+    <title>%(title)s</title>
+    <link href="%(link)s"/>
+    <id>%(link)s</id>
+    <updated>%(date)s</updated>
+    <published>%(date)s</published>
+    <summary type="html">%(description)s</summary>
+'''
+
+# Posts in the generated feeds are spread over this many days before
+# `FeedServer.now`:
+POST_SPREAD_DAYS = 60
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FeedServer(object):
+
+    def __init__(self, num_feeds=10, posts_per_feed=10, latency=0,
+                 etag=True, gzip=False, bytes_per_sec=None, error_every=None,
+                 hub=None, seed=0):
+        self.num_feeds = num_feeds
+        self.posts_per_feed = posts_per_feed
+        self.latency = latency
+        self.etag = etag
+        self.gzip = gzip
+        self.bytes_per_sec = bytes_per_sec
+        self.error_every = error_every
+        self.hub = hub
+        self.seed = seed
+        self.now = time.time()
+        self.statuses = Counter()
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._httpd = None
+
+    def start(self):
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', 0),
+                                           _FeedRequestHandler)
+        self._httpd.feeds = self
+        thread = threading.Thread(target=self._httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address
+        return 'http://%s:%d' % (host, port)
+
+    def feed_url(self, n):
+        return '%s/feeds/%d.xml' % (self.base_url, n)
+
+    def page_url(self, n):
+        return '%s/blogs/%d/' % (self.base_url, n)
+
+    def is_error(self, n):
+        return self.error_every is not None and n % self.error_every == 0
+
+    def body(self, n):
+        """Return the (uncompressed) body of feed ``n``."""
+        with self._lock:
+            if n not in self._bodies:
+                self._bodies[n] = self._generate(n)
+            return self._bodies[n]
+
+    def add_post(self):
+        """Add a post to each of the feeds."""
+        with self._lock:
+            self.posts_per_feed += 1
+            self._bodies.clear()
+
+    def _generate(self, n):
+        rand = random.Random('%d-%d' % (self.seed, n))
+        posts = []
+        for i in range(self.posts_per_feed):
+            date = self.now - rand.randint(0, POST_SPREAD_DAYS * 24 * 60 * 60)
+            posts.append({
+                'title': ' '.join(rand.choice(word_choices)
+                                  for w in range(rand.randint(1, 10))),
+                'link': '%sposts/%d.html' % (self.page_url(n), i),
+                'date': date,
+                'description': '&lt;p&gt;%s&lt;/p&gt;' % ' '.join(
+                    rand.choice(word_choices)
+                    for w in range(rand.randint(25, 150))),
+            })
+        # Newest first, as real feeds are:
+        posts.sort(key=lambda post: post['date'], reverse=True)
+        links = {'hub': self.hub, 'self_url': self.feed_url(n)}
+        # Alternate between formats, so both parsers get exercised:
+        if n % 2 == 0:
+            text = rss_feed_template.render(links, items=[
+                dict(post, pubDate=formatdate(post['date']))
+                for post in posts])
+        else:
+            text = atom_feed_template.render(links, entries=[
+                atom_entry_template % dict(
+                    post,
+                    date=time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                       time.gmtime(post['date'])))
+                for post in posts])
+        return text.encode('utf-8')
+
+
+class _FeedRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def feeds(self):
+        return self.server.feeds
+
+    def do_GET(self):
+        feeds = self.feeds
+        if feeds.latency:
+            time.sleep(feeds.latency)
+        try:
+            n = int(self.path.split('/')[-1].split('.')[0])
+        except ValueError:
+            n = -1
+        if not (self.path.startswith('/feeds/') and
+                0 <= n < feeds.num_feeds):
+            return self._respond(404)
+        if feeds.is_error(n):
+            return self._respond(500)
+
+        body = feeds.body(n)
+        headers = {'Content-Type': 'application/xml; charset=utf-8'}
+        if feeds.etag:
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            headers['ETag'] = etag
+            headers['Last-Modified'] = formatdate(feeds.now, usegmt=True)
+            if self.headers.get('If-None-Match') == etag:
+                return self._respond(304, headers)
+        if feeds.gzip and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self._respond(200, headers, body)
+
+    def _respond(self, status, headers={}, body=b''):
+        with self.feeds._lock:
+            self.feeds.statuses[status] += 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.feeds.bytes_per_sec is None:
+            self.wfile.write(body)
+            return
+        # Trickle the body out in ~10 chunks per second:
+        chunk_size = max(1, self.feeds.bytes_per_sec // 10)
+        for i in range(0, len(body), chunk_size):
+            self.wfile.write(body[i:i + chunk_size])
+            self.wfile.flush()
+            time.sleep(0.1)
@@ -0,0 +1,108 @@
+"""A stub WebSub hub.
+
+`StubHub` is a local HTTP server which accepts subscription requests, and
+records them in ``hub.requests``, as dictionaries of their parameters. It
+doesn't contact the subscriber itself; instead, the tests play the part
+of the hub with `verify` and `publish`, which make the requests a real hub
+would, through a Flask test client.
+
+Usage:
+
+    with StubHub() as hub:
+        with FeedServer(hub=hub.url) as server:
+            ...
+            request = hub.requests[0]
+            verify(client, request)
+            publish(client, request, server.body(0))
+"""
+import hashlib
+import hmac
+import threading
+
+from six.moves import BaseHTTPServer
+from six.moves.urllib.parse import parse_qsl, urlsplit
+
+
+class StubHub(object):
+
+    def __init__(self, status=202):
+        self.status = status
+        self.requests = []
+        self._httpd = None
+
+    def start(self):
+        self._httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                _HubRequestHandler)
+        self._httpd.hub = self
+        thread = threading.Thread(target=self._httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return 'http://%s:%d/' % (host, port)
+
+
+class _HubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8')
+        self.server.hub.requests.append(dict(parse_qsl(body)))
+        self.send_response(self.server.hub.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _callback_path(request):
+    return urlsplit(request['hub.callback']).path
+
+
+def verify(client, request, challenge='abc123', lease_seconds=None,
+           **params):
+    """Verify the subscription ``request``, as the hub would.
+
+    Returns the subscriber's response. Any of the query parameters can be
+    overridden with ``params``, using ``_`` in place of ``.``.
+    """
+    query = {
+        'hub.mode': request['hub.mode'],
+        'hub.topic': request['hub.topic'],
+        'hub.challenge': challenge,
+        'hub.lease_seconds': lease_seconds or request['hub.lease_seconds'],
+    }
+    for name, value in params.items():
+        query[name.replace('_', '.')] = value
+    return client.get(_callback_path(request), query_string=query)
+
+
+def publish(client, request, body, secret=None, algorithm='sha1'):
+    """Push ``body`` to the subscriber of ``request``, as the hub would.
+
+    The content is signed with the secret in ``request``, unless another
+    ``secret`` is given. Returns the subscriber's response.
+    """
+    if secret is None:
+        secret = request['hub.secret']
+    digest = hmac.new(secret.encode('utf-8'), body,
+                      getattr(hashlib, algorithm)).hexdigest()
+    return client.post(_callback_path(request),
+                       data=body,
+                       content_type='application/atom+xml',
+                       headers={'X-Hub-Signature':
+                                '%s=%s' % (algorithm, digest)})